@@ -122,11 +122,17 @@ class SubDistribution(NamedTuple):
 
 
 class MixtureDistribution(Distribution):
-    def __init__(self, size: int, dists: Sequence[SubDistribution], isr_remainder: Optional[Distribution] = None):
+    def __init__(
+        self,
+        size: int,
+        dists: Sequence[SubDistribution],
+        isr_remainder: Optional[Distribution] = None,
+        dtype: npt.DTypeLike = np.float64,
+    ):
         super().__init__()
 
         self._dims = len(dists)
-        self._tree = SumTree(size, self._dims)
+        self._tree = SumTree(size, self._dims, dtype)
 
         self.dists = [sub.d for sub in dists]
         self._weights = np.array([sub.p for sub in dists])
@@ -164,13 +170,11 @@ class MixtureDistribution(Distribution):
 
     def sample(self, rng: np.random.Generator, n: int):
         w = self._filter_defunct()
-        w = w * self._tree.effective_weights()
-        return self._tree.sample(rng, n, w)
+        return self._tree.sample_mixture(rng, n, w)
 
     def stratified_sample(self, rng: np.random.Generator, n: int):
         w = self._filter_defunct()
-        w = w * self._tree.effective_weights()
-        return self._tree.stratified_sample(rng, n, w)
+        return self._tree.stratified_sample_mixture(rng, n, w)
 
     def isr(self, target: Distribution, idxs: np.ndarray):
         tops = target.probs(idxs)
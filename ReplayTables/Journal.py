@@ -0,0 +1,219 @@
+import os
+import shutil
+import pickle
+import struct
+import zlib
+import ReplayTables._utils.snapshot as snapshot
+
+from typing import Any, List, NamedTuple
+from ReplayTables.ReplayBuffer import ReplayBufferInterface
+
+# each frame is [payload length, crc32 of payload] followed by the payload
+_FRAME = struct.Struct('<QI')
+_HEAD = 'HEAD'
+
+class Journal:
+    """
+    Append-only checkpointing for a replay buffer. Adds and priority updates are
+    recorded as they happen, and `checkpoint` appends everything since the last
+    checkpoint to a log on top of a base snapshot. Once the log outgrows the
+    base, it is folded into a new base snapshot.
+    """
+    def __init__(self, buffer: ReplayBufferInterface, path: str, compact_ratio: float = 1.):
+        self._buffer = buffer
+        self._path = path
+        self._compact_ratio = compact_ratio
+
+        self._pending: List[bytes] = []
+        self._base_bytes = 0
+        self._log: Any = None
+
+        # starting over in an old journal replaces its last generation
+        os.makedirs(path, exist_ok=True)
+        self._gen = _read_head(path) if os.path.exists(os.path.join(path, _HEAD)) else 0
+        self.compact()
+        buffer._journal = self
+
+    @classmethod
+    def recover(cls, path: str, mmap: bool = True, compact_ratio: float = 1.) -> ReplayBufferInterface:
+        """
+        Rebuilds the buffer as of the last checkpoint, and keeps journaling it to path.
+        """
+        gen = _read_head(path)
+        buffer = snapshot.load(_base_path(path, gen), mmap=mmap)
+
+        # a crash can leave a partial frame at the end, everything before it is intact
+        log_path = _log_path(path, gen)
+        good = 0
+        with open(log_path, 'rb') as f:
+            for end, payload in _frames(f):
+                _replay(buffer, pickle.loads(payload))
+                good = end
+
+        journal = cls.__new__(cls)
+        journal._buffer = buffer
+        journal._path = path
+        journal._compact_ratio = compact_ratio
+        journal._pending = []
+        journal._gen = gen
+        journal._base_bytes = _dir_bytes(_base_path(path, gen))
+
+        journal._log = open(log_path, 'r+b')
+        journal._log.truncate(good)
+        journal._log.seek(good)
+
+        buffer._journal = journal
+        return buffer
+
+    def record(self, op: str, *args: Any):
+        # serialize now, the caller is free to reuse its arrays afterwards
+        self._pending.append(pickle.dumps((op, args), protocol=pickle.HIGHEST_PROTOCOL))
+
+    def checkpoint(self):
+        assert self._log is not None, 'Journal has been closed'
+
+        # a prefetching thread can be sampling, which moves the rng along
+        b = self._buffer
+        with b._lock:
+            frame = pickle.dumps({
+                'ops': self._pending,
+                't': b._t,
+                'rng': b._rng.bit_generator.state,
+                'lag': getattr(b, '_lag_buffer', None),
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+            self._pending = []
+
+        self._log.write(_FRAME.pack(len(frame), zlib.crc32(frame)))
+        self._log.write(frame)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+        if self._log.tell() > self._compact_ratio * self._base_bytes:
+            self.compact()
+
+    def compact(self):
+        """
+        Writes the whole buffer as a new base snapshot and starts an empty log.
+        """
+        gen = self._gen + 1
+
+        # never pickle the journal into its own snapshot
+        with self._buffer._lock:
+            self._buffer._journal = None
+            try:
+                snapshot.save(self._buffer, _base_path(self._path, gen))
+            finally:
+                self._buffer._journal = self
+
+            self._pending = []
+
+        # snapshot.save has already made the new base durable, the log and HEAD must follow
+        # before the old generation can go, or a power loss could leave neither
+        with open(_log_path(self._path, gen), 'wb') as f:
+            os.fsync(f.fileno())
+
+        snapshot.fsync_dir(self._path)
+        _write_head(self._path, gen)
+
+        # only drop the old generation once the new one is reachable
+        if self._log is not None:
+            self._log.close()
+
+        shutil.rmtree(_base_path(self._path, self._gen), ignore_errors=True)
+        if os.path.exists(_log_path(self._path, self._gen)):
+            os.remove(_log_path(self._path, self._gen))
+
+        snapshot.fsync_dir(self._path)
+
+        self._gen = gen
+        self._base_bytes = _dir_bytes(_base_path(self._path, gen))
+        self._log = open(_log_path(self._path, gen), 'ab')
+
+    def close(self):
+        if self._log is None:
+            return
+
+        self._log.close()
+        self._log = None
+        self._buffer._journal = None
+
+    def __reduce__(self):
+        # a pickled buffer comes back without its journal
+        return (_detached, ())
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _detached():
+    return None
+
+class _EIDs(NamedTuple):
+    # updating priorities only reads the eids of a batch,
+    # so there is no need to gather the transitions again
+    eid: Any
+
+def _replay(buffer: Any, frame: Any):
+    for raw in frame['ops']:
+        op, args = pickle.loads(raw)
+
+        if op == 'add':
+            idx, transition = args
+            buffer.add(transition)
+            assert buffer._idx_mapper.eid2idx(transition.eid) == idx, 'Replaying the journal placed a transition differently'
+
+        elif op == 'priorities':
+            eids, priorities = args
+            buffer.update_priorities(_EIDs(eids), priorities)
+
+        elif op == 'delete':
+            buffer.delete_sample(*args)
+
+        else:
+            raise ValueError(f'Unknown journal op <{op}>')
+
+    buffer._t = frame['t']
+    buffer._rng.bit_generator.state = frame['rng']
+    if frame['lag'] is not None:
+        buffer._lag_buffer = frame['lag']
+
+def _frames(f: Any):
+    while True:
+        header = f.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            return
+
+        n, crc = _FRAME.unpack(header)
+        payload = f.read(n)
+        if len(payload) < n or zlib.crc32(payload) != crc:
+            return
+
+        yield f.tell(), payload
+
+def _base_path(path: str, gen: int):
+    return os.path.join(path, f'base-{gen}')
+
+def _log_path(path: str, gen: int):
+    return os.path.join(path, f'log-{gen}')
+
+def _read_head(path: str) -> int:
+    with open(os.path.join(path, _HEAD)) as f:
+        return int(f.read())
+
+def _write_head(path: str, gen: int):
+    head = os.path.join(path, _HEAD)
+    with open(head + '.tmp', 'w') as f:
+        f.write(str(gen))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(head + '.tmp', head)
+    snapshot.fsync_dir(path)
+
+def _dir_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
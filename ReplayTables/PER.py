@@ -13,6 +13,7 @@ class PERConfig:
     uniform_probability: float = 1e-3
     priority_exponent: float = 0.5
     max_decay: float = 1.
+    tree_dtype: str = 'float64'
 
 class PrioritizedReplay(ReplayBuffer):
     def __init__(
@@ -31,6 +32,7 @@ class PrioritizedReplay(ReplayBuffer):
             rng=self._rng,
             max_size=self._storage.max_size,
             uniform_probability=self._c.uniform_probability,
+            tree_dtype=self._c.tree_dtype,
         )
 
         self._max_priority = 1e-16
@@ -55,16 +57,20 @@ class PrioritizedReplay(ReplayBuffer):
         return self.update_priorities(batch, priorities)
 
     def update_priorities(self, batch: Batch, priorities: np.ndarray):
-        idxs = self._idx_mapper.eids2idxs(batch.eid)
+        with self._lock:
+            if self._journal is not None: self._journal.record('priorities', batch.eid, priorities)
+            idxs = self._idx_mapper.eids2idxs(batch.eid)
 
-        priorities = np.abs(priorities) ** self._c.priority_exponent
-        self._sampler.update(idxs, batch, priorities=priorities)
+            priorities = np.abs(priorities) ** self._c.priority_exponent
+            self._sampler.update(idxs, batch, priorities=priorities)
 
-        self._max_priority = max(
-            self._c.max_decay * self._max_priority,
-            priorities.max(),
-        )
+            self._max_priority = max(
+                self._c.max_decay * self._max_priority,
+                priorities.max(),
+            )
 
     def delete_sample(self, eid: EID):
-        idx = self._idx_mapper.eid2idx(eid)
-        self._sampler.mask_sample(idx)
+        with self._lock:
+            if self._journal is not None: self._journal.record('delete', eid)
+            idx = self._idx_mapper.eid2idx(eid)
+            self._sampler.mask_sample(idx)
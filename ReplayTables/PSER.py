@@ -34,6 +34,7 @@ class PrioritizedSequenceReplay(ReplayBuffer):
             self._c.trace_decay,
             self._c.trace_depth,
             self._c.combinator,
+            self._c.tree_dtype,
         )
 
         self._max_priority = 1e-16
@@ -58,16 +59,20 @@ class PrioritizedSequenceReplay(ReplayBuffer):
         return self.update_priorities(batch, priorities)
 
     def update_priorities(self, batch: Batch, priorities: np.ndarray):
-        idxs = self._idx_mapper.eids2idxs(batch.eid)
+        with self._lock:
+            if self._journal is not None: self._journal.record('priorities', batch.eid, priorities)
+            idxs = self._idx_mapper.eids2idxs(batch.eid)
 
-        priorities = np.abs(priorities) ** self._c.priority_exponent
-        self._sampler.update(idxs, batch, priorities=priorities)
+            priorities = np.abs(priorities) ** self._c.priority_exponent
+            self._sampler.update(idxs, batch, priorities=priorities)
 
-        self._max_priority = max(
-            self._c.max_decay * self._max_priority,
-            priorities.max(),
-        )
+            self._max_priority = max(
+                self._c.max_decay * self._max_priority,
+                priorities.max(),
+            )
 
     def delete_sample(self, eid: EID):
-        idx = self._idx_mapper.eid2idx(eid)
-        self._sampler.mask_sample(idx)
+        with self._lock:
+            if self._journal is not None: self._journal.record('delete', eid)
+            idx = self._idx_mapper.eid2idx(eid)
+            self._sampler.mask_sample(idx)
@@ -1,6 +1,9 @@
+import queue
+import threading
 import numpy as np
+import ReplayTables._utils.snapshot as snapshot
 from abc import abstractmethod
-from typing import Any
+from typing import Any, Dict, Iterator, Sequence
 from ReplayTables._utils.logger import logger
 from ReplayTables.interface import Timestep, LaggedTimestep, Batch, EID, EIDs, Item
 from ReplayTables.ingress.IndexMapper import IndexMapper
@@ -25,11 +28,18 @@ class ReplayBufferInterface:
 
         self._t = 0
         self._idx_mapper: IndexMapper = idx_mapper or CircularMapper(max_size)
-        self._storage: Storage = storage or BasicStorage(max_size)
+        self._storage: Storage = storage if storage is not None else BasicStorage(max_size)
         self._sampler: IndexSampler = sampler or UniformSampler(self._rng, max_size)
 
         self._built = False
 
+        # set while a ReplayTables.Journal.Journal is recording this buffer
+        self._journal: Any = None
+
+        # held by anything that reads or changes the contents,
+        # so that prefetching threads see whole adds and updates
+        self._lock = threading.RLock()
+
     def _deferred_init(self):
         self._sampler.deferred_init(self._storage, self._idx_mapper)
         self._built = True
@@ -38,23 +48,97 @@ class ReplayBufferInterface:
         return max(0, len(self._storage))
 
     def add(self, transition: LaggedTimestep):
-        if not self._built: self._deferred_init()
+        with self._lock:
+            if not self._built: self._deferred_init()
+
+            idx = self._idx_mapper.add_eid(transition.eid)
+            if self._journal is not None: self._journal.record('add', idx, transition)
+
+            item = self._storage.add(idx, transition)
+            self._on_add(item, transition)
+
+    def add_many(self, transitions: Sequence[LaggedTimestep]):
+        with self._lock:
+            if not self._built: self._deferred_init()
+
+            idxs: Any = np.empty(len(transitions), dtype=np.int64)
+            for i, t in enumerate(transitions):
+                idxs[i] = self._idx_mapper.add_eid(t.eid)
+                if self._journal is not None: self._journal.record('add', idxs[i], t)
+
+            items = self._storage.add_many(idxs, transitions)
+            for item, t in zip(items, transitions):
+                self._on_add(item, t)
+
+    def sample(self, n: int, out: Batch | None = None) -> Batch:
+        with self._lock:
+            idxs = self._sampler.sample(n)
+            samples = self._storage.get(idxs, out=out)
+            return samples
+
+    def stratified_sample(self, n: int, out: Batch | None = None) -> Batch:
+        with self._lock:
+            idxs = self._sampler.stratified_sample(n)
+            samples = self._storage.get(idxs, out=out)
+            return samples
+
+    def empty_batch(self, n: int) -> Batch:
+        """
+        Allocates a batch of n transitions to pass as `out` to sample and get.
+        Reusing it means sampling does not allocate, but every call overwrites it.
+        """
+        with self._lock:
+            return self._storage.empty_batch(n)
+
+    def iter_batches(self, batch_size: int, prefetch: int = 2) -> Iterator[Batch]:
+        """
+        Yields sampled batches forever. Batches are sampled and gathered on a
+        background thread, which keeps up to `prefetch` of them ready.
+
+        Each batch is built under the buffer's lock, so it never sees a partial add,
+        but it reflects the buffer as of when it was built. That can be up to
+        `prefetch` batches behind the latest adds and priority updates.
+        """
+        assert prefetch > 0, 'Need room for at least one batch'
+
+        ready: queue.Queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def put(item: Any):
+            # wait for room, but give up once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.05)
+                    return
+                except queue.Full:
+                    continue
 
-        idx = self._idx_mapper.add_eid(transition.eid)
-        item = self._storage.add(idx, transition)
-        self._on_add(item, transition)
+        def work():
+            try:
+                while not stop.is_set():
+                    put(self.sample(batch_size))
+            except BaseException as e:
+                put(_WorkerError(e))
 
-    def sample(self, n: int) -> Batch:
-        idxs = self._sampler.sample(n)
-        samples = self._storage.get(idxs)
-        return samples
+        worker = threading.Thread(target=work, name='ReplayTables-prefetch', daemon=True)
+        worker.start()
 
-    def stratified_sample(self, n: int) -> Batch:
-        idxs = self._sampler.stratified_sample(n)
-        samples = self._storage.get(idxs)
-        return samples
+        try:
+            while True:
+                batch = ready.get()
+                if isinstance(batch, _WorkerError):
+                    raise batch.error
+
+                yield batch
+        finally:
+            stop.set()
+            worker.join()
 
     def sample_without_replacement(self, n: int) -> Batch:
+        with self._lock:
+            return self._sample_without_replacement(n)
+
+    def _sample_without_replacement(self, n: int) -> Batch:
         # most of the time, we get unique idxs in the first sample
         # so we fastpath past the type conversions and set additions
         # for that common case for performance reasons.
@@ -77,13 +161,15 @@ class ReplayBufferInterface:
         return self._storage.get(idxs)
 
     def isr_weights(self, eids: EIDs) -> np.ndarray:
-        idxs = self._idx_mapper.eids2idxs(eids)
-        weights = self._sampler.isr_weights(idxs)
-        return weights
+        with self._lock:
+            idxs = self._idx_mapper.eids2idxs(eids)
+            weights = self._sampler.isr_weights(idxs)
+            return weights
 
-    def get(self, eids: EIDs):
-        idxs = self._idx_mapper.eids2idxs(eids)
-        return self._storage.get(idxs)
+    def get(self, eids: EIDs, out: Batch | None = None):
+        with self._lock:
+            idxs = self._idx_mapper.eids2idxs(eids)
+            return self._storage.get(idxs, out=out)
 
     def next_eid(self) -> EID:
         eid: Any = self._t
@@ -101,9 +187,47 @@ class ReplayBufferInterface:
 
     def update_batch(self, batch: Batch, **kwargs: Any): ...
 
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by each part of the buffer, keyed by component. Entries ending
+        in `_used` are the part of the matching entry that holds live data.
+        """
+        with self._lock:
+            usage = {f'storage.{k}': v for k, v in self._storage.memory_usage().items()}
+            for k, v in self._sampler.memory_usage().items():
+                usage[f'sampler.{k}'] = v
+
+            return usage
+
+    def defragment(self):
+        with self._lock:
+            self._storage.defragment()
+
+    def save(self, path: str):
+        # a prefetching thread can be sampling, and adds must not be caught half applied
+        with self._lock:
+            snapshot.save(self, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        buffer = snapshot.load(path, mmap=mmap)
+        assert isinstance(buffer, cls), f'Expected a <{cls.__name__}> snapshot, got <{type(buffer).__name__}>'
+        return buffer
+
     @abstractmethod
     def _on_add(self, item: Item, transition: LaggedTimestep): ...
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: Any):
+        # buffers pickled before journals existed are not being recorded
+        self._journal = None
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
 class ReplayBuffer(ReplayBufferInterface):
     def __init__(
             self,
@@ -130,3 +254,12 @@ class ReplayBuffer(ReplayBufferInterface):
 
     def _on_add(self, item: Item, transition: LaggedTimestep):
         self._sampler.replace(item.idx, transition)
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+class _WorkerError:
+    def __init__(self, error: BaseException):
+        self.error = error
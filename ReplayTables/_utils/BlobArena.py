@@ -0,0 +1,138 @@
+import numpy as np
+
+from typing import Dict, List
+
+# Variable length blobs packed into one growable byte buffer, with an offset and a length per key.
+# Each blob takes an extent rounded up to a size class, at most 1/16th larger than the blob.
+# Freed extents go on a free list for their class and are reused by later blobs of that class,
+# so a store that churns through similarly sized blobs stops growing.
+#
+# Keys are small non-negative ints, plus -1. Reads do not take a lock: an extent is only
+# rewritten once its key has been removed or overwritten, and growing the buffer copies it,
+# so a reader holding the old buffer still sees the same bytes.
+class BlobArena:
+    def __init__(self):
+        self._data = np.empty(0, dtype=np.uint8)
+        self._end = 0
+
+        # indexed by key + 1, so that -1 has a place too
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.int64)
+
+        self._free: Dict[int, List[int]] = {}
+        self.used = 0
+        self.free_bytes = 0
+
+    def __contains__(self, key: int):
+        i = key + 1
+        return i < len(self._offsets) and self._lengths[i] > 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self._lengths))
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes + self._offsets.nbytes + self._lengths.nbytes
+
+    def get(self, key: int) -> memoryview:
+        if key not in self:
+            raise KeyError(key)
+
+        i = key + 1
+        o = self._offsets[i]
+        return memoryview(self._data[o:o + self._lengths[i]])
+
+    def put(self, key: int, blob: bytes):
+        n = len(blob)
+        assert n > 0, 'Cannot store an empty blob'
+
+        i = key + 1
+        if i >= len(self._offsets):
+            self._grow_index(i + 1)
+
+        # overwrite in place if the new blob is of the same class
+        size = _size_class(n)
+        old = int(self._lengths[i])
+        if old > 0 and _size_class(old) == size:
+            o = int(self._offsets[i])
+            self.used -= old
+        else:
+            self.remove(key)
+            o = self._take(size)
+
+        self._data[o:o + n] = np.frombuffer(blob, dtype=np.uint8)
+        self._offsets[i] = o
+        self._lengths[i] = n
+        self.used += n
+
+    def remove(self, key: int):
+        if key not in self:
+            return
+
+        i = key + 1
+        n = int(self._lengths[i])
+        size = _size_class(n)
+        self._free.setdefault(size, []).append(int(self._offsets[i]))
+        self.free_bytes += size
+        self.used -= n
+
+        self._lengths[i] = 0
+
+    def permute(self, src: np.ndarray):
+        # key j becomes what key src[j] was, -1 stays put, and everything
+        # else is dropped. The live extents are packed with no gaps.
+        keys = np.concatenate((np.array([-1]), src)).astype(np.int64) + 1
+        lengths = self._lengths[keys]
+        sizes = np.array([_size_class(n) if n else 0 for n in lengths.tolist()], dtype=np.int64)
+        offsets = np.cumsum(sizes) - sizes
+
+        data = np.empty(int(sizes.sum()), dtype=np.uint8)
+        for o, old, n in zip(offsets.tolist(), self._offsets[keys].tolist(), lengths.tolist()):
+            data[o:o + n] = self._data[old:old + n]
+
+        self._data = data
+        self._end = len(data)
+        self._offsets = offsets
+        self._lengths = lengths
+        self._free = {}
+        self.free_bytes = 0
+
+    def _take(self, size: int) -> int:
+        free = self._free.get(size)
+        if free:
+            self.free_bytes -= size
+            return free.pop()
+
+        o = self._end
+        self._end += size
+        if self._end > len(self._data):
+            # grow by a quarter, the buffer is usually large and slack here is pure overhead
+            data = np.empty(max(self._end, len(self._data) + len(self._data) // 4), dtype=np.uint8)
+            data[:o] = self._data[:o]
+            self._data = data
+
+        return o
+
+    def _grow_index(self, n: int):
+        n = max(n, 2 * len(self._offsets))
+        offsets = np.zeros(n, dtype=np.int64)
+        lengths = np.zeros(n, dtype=np.int64)
+        offsets[:len(self._offsets)] = self._offsets
+        lengths[:len(self._lengths)] = self._lengths
+        self._offsets = offsets
+        self._lengths = lengths
+
+    def __getstate__(self):
+        # the spare room at the end is not worth writing out
+        d = self.__dict__.copy()
+        d['_data'] = self._data[:self._end]
+        return d
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _size_class(n: int) -> int:
+    g = max(16, 1 << max(0, n.bit_length() - 5))
+    return -(-n // g) * g
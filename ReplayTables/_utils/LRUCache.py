@@ -0,0 +1,64 @@
+import numpy as np
+
+from collections import OrderedDict
+from typing import Dict
+
+# A cache of arrays bounded by their total bytes, evicting the least recently used first.
+# Entries are frozen, since a caller writing into one would corrupt every later hit.
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[int, np.ndarray] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: int):
+        return key in self._entries
+
+    def get(self, key: int) -> np.ndarray | None:
+        v = self._entries.get(key)
+        if v is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return v
+
+    def put(self, key: int, v: np.ndarray):
+        self.discard(key)
+        if v.nbytes > self.max_bytes:
+            return
+
+        v.flags.writeable = False
+        self._entries[key] = v
+        self.nbytes += v.nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def discard(self, key: int):
+        v = self._entries.pop(key, None)
+        if v is not None:
+            self.nbytes -= v.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.,
+            'entries': len(self._entries),
+            'bytes': self.nbytes,
+        }
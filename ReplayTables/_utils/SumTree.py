@@ -1,10 +1,16 @@
 import numpy as np
+import numpy.typing as npt
 from typing import Iterable
-import ReplayTables.rust as ru
+from ReplayTables._utils.native import ru
 
 class SumTree:
-    def __init__(self, size: int, dims: int):
-        self.st = ru.SumTree(size, dims)
+    # float32 halves the memory of the tree, at about 7 significant digits per node
+    def __init__(self, size: int, dims: int, dtype: npt.DTypeLike = np.float64):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f'SumTree can only hold float32 or float64, got <{self.dtype}>')
+
+        self.st = ru.SumTree(size, dims, self.dtype == np.float32)
         self.u = np.ones(dims, dtype=np.float64)
 
     @property
@@ -15,6 +21,10 @@ class SumTree:
     def size(self):
         return self.st.size
 
+    @property
+    def nbytes(self) -> int:
+        return self.st.nbytes
+
     def update(self, dim: int, idxs: Iterable[int], values: Iterable[float]):
         a_idxs = np.asarray(idxs, dtype=np.int64)
         a_values = np.asarray(values, dtype=np.float64)
@@ -63,16 +73,56 @@ class SumTree:
 
         return self.st.query(values, w)
 
+    def sample_mixture(self, rng: np.random.Generator, n: int, p: np.ndarray) -> np.ndarray:
+        # samples dim d with probability p[d], then an index in proportion to its value in d
+        u = rng.uniform(0, 1, size=n)
+        return self._query_mixture(u, p)
+
+    def stratified_sample_mixture(self, rng: np.random.Generator, n: int, p: np.ndarray) -> np.ndarray:
+        buckets = np.linspace(0., 1., n + 1)
+        u = rng.uniform(buckets[:-1], buckets[1:])
+        return self._query_mixture(u, p)
+
+    def _query_mixture(self, u: np.ndarray, p: np.ndarray) -> np.ndarray:
+        # the dim is wherever u falls in the cdf of p, and the rest of u says where within that dim
+        cdf = np.cumsum(p)
+        assert cdf[-1] > 0, "Cannot sample when the tree is empty or contains negative values"
+
+        u = u * cdf[-1]
+        dims = np.minimum(np.searchsorted(cdf, u, side='right'), self.dims - 1)
+
+        totals = self.all_totals()[dims]
+        assert np.all(totals > 0), "Cannot sample from a dim that is empty or contains negative values"
+
+        within = (u - (cdf[dims] - p[dims])) / p[dims]
+        v = within * totals
+        return self.st.query_dims(v, dims.astype(np.int64))
+
     def _get_w(self, w: np.ndarray | None = None) -> np.ndarray:
         if w is None:
             return self.u
         return w
 
     def __getstate__(self):
+        # the leaves determine the rest of the tree, and as plain arrays
+        # they pickle much faster than the serialized nodes
+        idxs = np.arange(self.size, dtype=np.int64)
         return {
-            'st': self.st.__getstate__()
+            'size': self.size,
+            'dims': self.dims,
+            'dtype': self.dtype.name,
+            'leaves': [self.get_values(d, idxs) for d in range(self.dims)],
         }
 
     def __setstate__(self, state):
-        self.st = ru.SumTree()
-        self.st.__setstate__(state['st'])
+        if 'st' in state:
+            # pickled as the serialized rust tree, before the leaves were written out as arrays
+            state = ru.SumTree.legacy_state(state['st'])
+
+        self.dtype = np.dtype(state['dtype'])
+        self.st = ru.SumTree(state['size'], state['dims'], self.dtype == np.float32)
+        self.u = np.ones(state['dims'], dtype=np.float64)
+
+        idxs = np.arange(state['size'], dtype=np.int64)
+        for d, leaves in enumerate(state['leaves']):
+            self.update(d, idxs, leaves)
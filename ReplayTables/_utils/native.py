@@ -0,0 +1,11 @@
+import ReplayTables.rust as ru
+
+# the version of the ReplayTables.rust api that this code is written against
+_API_VERSION = 1
+
+_built = getattr(ru, 'API_VERSION', 0)
+if _built != _API_VERSION:
+    raise ImportError(
+        f'ReplayTables.rust was built from other sources (api <{_built}>, expected <{_API_VERSION}>). '
+        'Rebuild it with `maturin develop --release`'
+    )
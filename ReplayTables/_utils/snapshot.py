@@ -0,0 +1,134 @@
+import os
+import shutil
+import pickle
+import numpy as np
+
+from typing import Any, Dict, List
+
+# arrays smaller than this are cheaper to keep inside the pickle
+_MIN_BYTES = 4096
+
+_META = 'meta.pkl'
+_ARRAYS = 'arrays'
+
+def save(obj: Any, path: str):
+    """
+    Writes obj to the directory at path. Every large array reachable from obj is
+    written as its own .npy file, whose data is 64-byte aligned, and everything
+    else is pickled alongside them.
+
+    The snapshot is written next to path and swapped in once it is on disk, so
+    a crash leaves either the previous snapshot or the new one, never a mix.
+    """
+    path = os.path.abspath(path)
+    tmp, old = path + '.tmp', path + '.old'
+    _recover(path)
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    arrays = os.path.join(tmp, _ARRAYS)
+    os.makedirs(arrays)
+
+    with open(os.path.join(tmp, _META), 'wb') as f:
+        _Writer(f, arrays).dump(obj)
+        f.flush()
+        os.fsync(f.fileno())
+
+    fsync_dir(arrays)
+    fsync_dir(tmp)
+
+    # directories cannot be replaced while they hold files, so move the old one
+    # aside first. Until it is deleted, load falls back to it if path is missing.
+    if os.path.exists(path):
+        os.replace(path, old)
+
+    os.replace(tmp, path)
+    fsync_dir(os.path.dirname(path))
+
+    # files of the old snapshot that are still mapped by a load stay readable
+    shutil.rmtree(old, ignore_errors=True)
+
+def load(path: str, mmap: bool = True) -> Any:
+    """
+    Reads an object written by save. When mmap is set, arrays are mapped
+    copy-on-write, so they are paged in as they are touched and writes
+    never reach the snapshot.
+    """
+    path = os.path.abspath(path)
+    if not os.path.exists(path) and os.path.exists(path + '.old'):
+        path = path + '.old'
+
+    with open(os.path.join(path, _META), 'rb') as f:
+        return _Reader(f, os.path.join(path, _ARRAYS), mmap).load()
+
+def fsync_dir(path: str):
+    """
+    Makes the entries of a directory durable, so that files created,
+    renamed or removed in it survive a power loss.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _recover(path: str):
+    # a crash between moving the old snapshot aside and moving the new one in
+    # leaves only the old one complete
+    old = path + '.old'
+    if not os.path.exists(old):
+        return
+
+    if os.path.exists(path):
+        shutil.rmtree(old)
+    else:
+        os.replace(old, path)
+
+class _Writer(pickle.Pickler):
+    def __init__(self, f: Any, root: str):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._root = root
+
+        # pickle checks persistent ids before its memo, so track aliases here.
+        # holding the arrays keeps their ids from being reused mid-dump.
+        self._names: Dict[int, str] = {}
+        self._held: List[np.ndarray] = []
+
+    def persistent_id(self, obj: Any):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject or obj.nbytes < _MIN_BYTES:
+            return None
+
+        name = self._names.get(id(obj))
+        if name is not None:
+            return name
+
+        name = f'{len(self._names):06d}.npy'
+        self._names[id(obj)] = name
+        self._held.append(obj)
+
+        with open(os.path.join(self._root, name), 'wb') as f:
+            np.save(f, np.asarray(obj), allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        return name
+
+class _Reader(pickle.Unpickler):
+    def __init__(self, f: Any, root: str, mmap: bool):
+        super().__init__(f)
+        self._root = root
+        self._mmap = mmap
+
+    def persistent_load(self, pid: Any):
+        file = os.path.join(self._root, pid)
+        if not self._mmap:
+            return np.load(file, allow_pickle=False)
+
+        arr = np.load(file, mmap_mode='c', allow_pickle=False)
+
+        # hand out plain arrays, the mapping stays alive through .base
+        return arr.view(np.ndarray)
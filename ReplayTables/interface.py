@@ -55,6 +55,7 @@ class Batch(NamedTuple):
     terminal: np.ndarray
     eid: EIDs
     xp: np.ndarray
+    extra: Dict[Hashable, np.ndarray] | None = None
 
 T = TypeVar('T', bound=Timestep)
 
@@ -1,6 +1,6 @@
 import numpy as np
 from abc import abstractmethod
-from typing import Any
+from typing import Any, Dict
 from ReplayTables.interface import IDX, IDXs, LaggedTimestep, Batch
 from ReplayTables.Distributions import UniformDistribution
 from ReplayTables.storage.Storage import Storage
@@ -24,6 +24,9 @@ class IndexSampler:
         self._mapper = mapper
         self._built = True
 
+    def memory_usage(self) -> Dict[str, int]:
+        return {}
+
     @abstractmethod
     def replace(self, idx: IDX, transition: LaggedTimestep, /, **kwargs: Any) -> None:
         ...
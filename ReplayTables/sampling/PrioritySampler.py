@@ -1,5 +1,5 @@
 import numpy as np
-from typing import Any
+from typing import Any, Dict
 from ReplayTables.Distributions import MixinUniformDistribution, SubDistribution, PrioritizedDistribution, MixtureDistribution
 from ReplayTables.interface import IDX, IDXs, LaggedTimestep, Batch
 from ReplayTables.sampling.IndexSampler import IndexSampler
@@ -10,6 +10,7 @@ class PrioritySampler(IndexSampler):
         rng: np.random.Generator,
         max_size: int,
         uniform_probability: float,
+        tree_dtype: str = 'float64',
     ) -> None:
         super().__init__(rng, max_size)
 
@@ -20,7 +21,10 @@ class PrioritySampler(IndexSampler):
         self._dist = MixtureDistribution(self._max_size, dists=[
             SubDistribution(d=self._p_dist, p=1 - uniform_probability),
             SubDistribution(d=self._uniform, p=uniform_probability)
-        ])
+        ], dtype=tree_dtype)
+
+    def memory_usage(self) -> Dict[str, int]:
+        return {'sum_tree': self._dist.tree.nbytes}
 
     def replace(self, idx: IDX, transition: LaggedTimestep, /, **kwargs: Any) -> None:
         idxs = np.array([idx], dtype=np.int64)
@@ -1,7 +1,8 @@
+import sys
 import numpy as np
 
 from dataclasses import dataclass
-from typing import Any, Set
+from typing import Any, Dict, Set
 
 from ReplayTables.Distributions import PrioritizedDistribution, SubDistribution, MixtureDistribution, MixinUniformDistribution
 from ReplayTables._utils.SumTree import SumTree
@@ -21,6 +22,7 @@ class PrioritySequenceSampler(IndexSampler):
         trace_decay: float,
         trace_depth: int,
         combinator: str,
+        tree_dtype: str = 'float64',
     ) -> None:
         super().__init__(rng, max_size)
 
@@ -32,6 +34,7 @@ class PrioritySequenceSampler(IndexSampler):
         self._terminal.add(-1)
 
         self._uniform_prob = uniform_probability
+        self._tree_dtype = tree_dtype
         self._c = PSDistributionConfig(
             trace_decay=trace_decay,
             trace_depth=trace_depth,
@@ -47,7 +50,16 @@ class PrioritySequenceSampler(IndexSampler):
         self._dist = MixtureDistribution(self._max_size, dists=[
             SubDistribution(d=self._ps_dist, p=1 - self._uniform_prob),
             SubDistribution(d=self._uniform, p=self._uniform_prob)
-        ])
+        ], dtype=self._tree_dtype)
+
+    def memory_usage(self) -> Dict[str, int]:
+        if not self._built:
+            return {}
+
+        return {
+            'sum_tree': self._dist.tree.nbytes,
+            'terminal': sys.getsizeof(self._terminal),
+        }
 
     def replace(self, idx: IDX, transition: LaggedTimestep, /, **kwargs: Any) -> None:
         self._terminal.discard(int(idx))
@@ -0,0 +1,84 @@
+import numpy as np
+import ReplayTables._utils.np as npu
+from ReplayTables._utils.native import ru
+
+from typing import Any, Tuple
+from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
+from ReplayTables.storage.BasicStorage import BasicStorage
+
+class ArenaStorage(BasicStorage):
+    def __init__(self, max_size: int, capacity: int | None = None):
+        super().__init__(max_size, capacity)
+
+        self._arena: Any = None
+        self._shape: Tuple[int, ...] = ()
+        self._dtype: Any = np.float64
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        self._built = True
+
+        x = np.asarray(transition.x)
+        self._shape = x.shape
+        self._dtype = x.dtype
+        self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
+
+        self._arena = ru.StateArena(x.nbytes, self._capacity)
+
+    def _resize(self, n: int):
+        if n <= self._capacity:
+            return
+
+        self._arena.reserve(n)
+        self._capacity = n
+
+    def _permute_states(self, src: SIDXs):
+        self._arena.permute(src)
+
+    def _state_memory(self) -> Tuple[int, int]:
+        if self._arena is None:
+            return 0, 0
+
+        return self.meta.n_states() * self._arena.row_bytes, self._arena.nbytes
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        if idx >= self._capacity:
+            self._grow(idx)
+
+        row = np.ascontiguousarray(state, dtype=self._dtype).reshape(-1).view(np.uint8)
+        self._arena.store(idx, row)
+
+    def _empty(self, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        out = np.empty((n, ) + self._shape, dtype=self._dtype)
+        return out, out.reshape(n, int(np.prod(self._shape))).view(np.uint8)
+
+    def _load_states(self, idxs: SIDXs) -> np.ndarray:
+        out, raw = self._empty(len(idxs))
+        self._arena.gather(idxs, raw)
+        return out
+
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        self._arena.gather(idxs, out.reshape(len(idxs), -1).view(np.uint8))
+
+    def _load_state_pair(self, idxs: SIDXs, n_idxs: SIDXs) -> Tuple[np.ndarray, np.ndarray]:
+        # both gathers happen in one call to the arena, outside of the GIL
+        x, raw_x = self._empty(len(idxs))
+        xp, raw_xp = self._empty(len(n_idxs))
+        self._arena.gather_pair(idxs, n_idxs, raw_x, raw_xp)
+        return x, xp
+
+    def _load_state(self, idx: SIDX) -> np.ndarray:
+        idxs: Any = np.array([idx], dtype=np.int64)
+        return self._load_states(idxs)[0]
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        if self._arena is not None:
+            d['_arena'] = self._arena.__getstate__()
+        return d
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        if self._arena is not None:
+            arena = ru.StateArena()
+            arena.__setstate__(state['_arena'])
+            self._arena = arena
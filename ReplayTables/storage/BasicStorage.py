@@ -1,18 +1,24 @@
 import numpy as np
 import ReplayTables._utils.np as npu
 
-from typing import Any, Dict
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
 from ReplayTables.interface import Batch, LaggedTimestep, IDX, IDXs, SIDX, SIDXs, Item
 from ReplayTables.storage.Storage import Storage
+from ReplayTables.storage.tools import max_states, take_into
 
 
 class BasicStorage(Storage):
-    def __init__(self, max_size: int):
+    def __init__(self, max_size: int, capacity: int | None = None):
         super().__init__(max_size)
 
         self._built = False
+        self._capacity = capacity or max_size
+
+        # one column per extra key, created the first time the key is seen
+        self._extras: Dict[Hashable, np.ndarray] = {}
+        self._live = np.zeros(max_size, dtype=np.bool_)
+        self._size = 0
 
-        self._extras: Dict[IDX, Any] = {}
         self._r = np.ones(max_size, dtype=np.float_) * np.nan
         self._term = np.empty(max_size, dtype=np.bool_)
         self._gamma = np.ones(max_size, dtype=np.float_) * np.nan
@@ -21,17 +27,21 @@ class BasicStorage(Storage):
         self._state_store: Any = np.empty(0)
         self._a = np.zeros(0)
 
+        # reused by get(out=...) to hold the sidxs and n_sidxs to gather
+        self._gather_sidxs = np.empty(0, dtype=np.int64)
+
     def _deferred_init(self, transition: LaggedTimestep):
         self._built = True
 
         shape = transition.x.shape
-        self._state_store = np.empty((self._max_size + 1, ) + shape, dtype=transition.x.dtype)
+        self._state_store = np.empty((self._capacity + 1, ) + shape, dtype=transition.x.dtype)
         self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
 
         self._state_store[-1] = 0
 
     def add(self, idx: IDX, transition: LaggedTimestep, /, **kwargs: Any):
         if not self._built: self._deferred_init(transition)
+        self._check_extras(transition.extra)
 
         # stash metadata
         item, last_item = self.meta.add_item(
@@ -50,7 +60,7 @@ class BasicStorage(Storage):
         self._a[idx] = transition.a
         self._term[idx] = transition.terminal
         self._gamma[idx] = transition.gamma
-        self._extras[idx] = transition.extra
+        self._store_extras(idx, transition.extra)
 
         self._store_state(item.sidx, transition.x)
 
@@ -61,8 +71,58 @@ class BasicStorage(Storage):
 
         return item
 
+    def add_many(self, idxs: IDXs, transitions: Sequence[LaggedTimestep]) -> List[Item]:
+        if not transitions:
+            return []
+
+        if not self._built: self._deferred_init(transitions[0])
+        for t in transitions: self._check_extras(t.extra)
+
+        null = self._max_i
+        n = len(transitions)
+        eids = np.fromiter((t.eid for t in transitions), dtype=np.int64, count=n)
+        xids = np.fromiter((t.xid for t in transitions), dtype=np.int64, count=n)
+        n_xids = np.fromiter((null if t.n_xid is None else t.n_xid for t in transitions), dtype=np.int64, count=n)
+
+        sidxs, n_sidxs, evicted = self.meta.add_items(eids, idxs, xids, n_xids)
+
+        # make room in state storage before any freed sidx is handed back out
+        for sidx in evicted:
+            self._remove_state(sidx)
+
+        self._r[idxs] = [t.r for t in transitions]
+        self._a[idxs] = [t.a for t in transitions]
+        self._term[idxs] = [t.terminal for t in transitions]
+        self._gamma[idxs] = [t.gamma for t in transitions]
+
+        idx_l: Any = idxs.tolist()
+        sidx_l: Any = sidxs.tolist()
+        n_sidx_l: Any = [None if s < 0 else s for s in n_sidxs.tolist()]
+
+        # an idx written twice in one batch only keeps its last transition.
+        # consecutive transitions share a state, so each sidx is only stored once
+        last = {idx: i for i, idx in enumerate(idx_l)}
+        states: Dict[Any, Any] = {}
+        for idx, i in last.items():
+            t = transitions[i]
+            self._store_extras(idx, t.extra)
+            states[sidx_l[i]] = t.x
+
+            if n_sidx_l[i] is not None:
+                assert t.n_x is not None
+                states[n_sidx_l[i]] = t.n_x
+
+        for sidx, x in states.items():
+            self._store_state(sidx, x)
+
+        return [
+            Item(eid=t.eid, idx=idx_l[i], xid=t.xid, n_xid=t.n_xid, sidx=sidx_l[i], n_sidx=n_sidx_l[i])
+            for i, t in enumerate(transitions)
+        ]
+
     def set(self, idx: IDX, transition: LaggedTimestep):
         if not self._built: self._deferred_init(transition)
+        self._check_extras(transition.extra)
 
         item = self.meta.get_item_by_idx(idx)
 
@@ -70,7 +130,7 @@ class BasicStorage(Storage):
         self._a[idx] = transition.a
         self._term[idx] = transition.terminal
         self._gamma[idx] = transition.gamma
-        self._extras[idx] = transition.extra
+        self._store_extras(idx, transition.extra)
 
         self._store_state(item.sidx, transition.x)
 
@@ -80,11 +140,12 @@ class BasicStorage(Storage):
 
         return item
 
-    def get(self, idxs: IDXs) -> Batch:
-        items = self.meta.get_items_by_idx(idxs)
+    def get(self, idxs: IDXs, out: Batch | None = None) -> Batch:
+        if out is not None:
+            return self._get_into(idxs, out)
 
-        x = self._load_states(items.sidxs)
-        xp = self._load_states(items.n_sidxs)
+        items = self.meta.get_items_by_idx(idxs)
+        x, xp = self._load_state_pair(items.sidxs, items.n_sidxs)
 
         return Batch(
             x=x,
@@ -94,8 +155,60 @@ class BasicStorage(Storage):
             terminal=self._term[idxs],
             eid=items.eids,
             xp=xp,
+            extra={k: col[idxs] for k, col in self._extras.items()},
         )
 
+    def empty_batch(self, n: int) -> Batch:
+        assert self._built, 'The state shape is not known until the first add'
+
+        zero: Any = np.full(1, -1, dtype=np.int64)
+        state = self._load_states(zero)
+        assert isinstance(state, np.ndarray), 'Only array states can be gathered into a preallocated batch'
+
+        # x and xp share one block so that both are gathered in a single pass
+        pair = np.empty((2, n) + state.shape[1:], dtype=state.dtype)
+        eids: Any = np.empty(n, dtype=np.int64)
+
+        return Batch(
+            x=pair[0],
+            a=np.empty(n, dtype=self._a.dtype),
+            r=np.empty(n, dtype=self._r.dtype),
+            gamma=np.empty(n, dtype=self._gamma.dtype),
+            terminal=np.empty(n, dtype=self._term.dtype),
+            eid=eids,
+            xp=pair[1],
+            extra={k: np.empty((n, ) + col.shape[1:], dtype=col.dtype) for k, col in self._extras.items()},
+        )
+
+    def _get_into(self, idxs: IDXs, out: Batch) -> Batch:
+        n = len(idxs)
+        if len(self._gather_sidxs) != 2 * n:
+            self._gather_sidxs = np.empty(2 * n, dtype=np.int64)
+
+        sidxs: Any = self._gather_sidxs
+        self.meta.get_sidxs_into(idxs, out.eid, sidxs)
+
+        pair = _pair_block(out.x, out.xp)
+        if pair is not None:
+            self._load_states_into(sidxs, pair)
+        else:
+            self._load_states_into(sidxs[:n], out.x)
+            self._load_states_into(sidxs[n:], out.xp)
+
+        take_into(self._a, idxs, out.a)
+        take_into(self._r, idxs, out.r)
+        take_into(self._gamma, idxs, out.gamma)
+        take_into(self._term, idxs, out.terminal)
+
+        extra = out.extra if out.extra is not None else {}
+        for k, col in self._extras.items():
+            if k in extra:
+                take_into(col, idxs, extra[k])
+            else:
+                extra[k] = col[idxs]
+
+        return out if out.extra is not None else out._replace(extra=extra)
+
     def get_item(self, idx: IDX) -> LaggedTimestep:
         item = self.meta.get_item_by_idx(idx)
         n_x = None
@@ -112,7 +225,7 @@ class BasicStorage(Storage):
             terminal=self._term[idx],
             eid=item.eid,
             xid=item.xid,
-            extra=self._extras[idx],
+            extra={k: col[idx] for k, col in self._extras.items()},
             n_xid=item.n_xid,
             n_x=n_x,
         )
@@ -125,31 +238,220 @@ class BasicStorage(Storage):
         if not self.meta.has_xid(item.xid):
             self._remove_state(item.sidx)
 
-        if item.idx in self._extras:
-            del self._extras[item.idx]
+        if self._live[item.idx]:
+            self._live[item.idx] = False
+            self._size -= 1
 
         if item.n_xid is not None and not self.meta.has_xid(item.n_xid):
             assert item.n_sidx is not None
             self._remove_state(item.n_sidx)
 
     def __len__(self):
-        return len(self._extras)
-
-    def _store_state(self, idx: SIDX, state: np.ndarray):
+        return self._size
+
+    def declare_extra(self, key: Hashable, shape: Tuple[int, ...] = (), dtype: Any = np.float_):
+        """
+        Adds a column for an extra. Transitions without the key hold NaN in float
+        columns and None in object columns. Other dtypes have no empty value, so
+        every transition must carry the key.
+        """
+        if key in self._extras:
+            return
+
+        col = np.zeros((self._max_size, ) + shape, dtype=dtype)
+        can_empty, empty = _empty_value(col.dtype)
+        if can_empty: col[:] = empty
+        self._extras[key] = col
+
+    def _check_extras(self, extra: Dict[Hashable, Any] | None):
+        # runs before anything is written, so a bad transition leaves the storage untouched
+        extra = extra or {}
+        for k, v in extra.items():
+            col = self._extras.get(k)
+            if col is not None:
+                _check_fits(k, v, col)
+                continue
+
+            dtype = _infer_dtype(v)
+            if self._size > 0 and not _empty_value(dtype)[0]:
+                raise ValueError(f'Extra <{k}> of dtype <{dtype}> first appeared after transitions without it, declare it before the first add')
+
+            self.declare_extra(k, np.shape(v), dtype)
+
+        for k, col in self._extras.items():
+            if k not in extra and not _empty_value(col.dtype)[0]:
+                raise ValueError(f'Transition is missing extra <{k}>, which a column of <{col.dtype}> cannot leave empty')
+
+    def _store_extras(self, idx: IDX, extra: Dict[Hashable, Any] | None):
+        if not self._live[idx]:
+            self._live[idx] = True
+            self._size += 1
+
+        extra = extra or {}
+        for k, col in self._extras.items():
+            col[idx] = extra[k] if k in extra else _empty_value(col.dtype)[1]
+
+    def defragment(self):
+        """
+        Moves states into the order they were seen in, so that states from
+        the same episode sit next to each other again.
+        """
+        if not self._built:
+            return
+
+        src = self.meta.defragment()
+        self._permute_states(src)
+
+    def _permute_states(self, src: SIDXs):
+        # fancy indexing copies first, so rows can be moved in place
+        self._state_store[:len(src)] = self._state_store[src]
+
+    def memory_usage(self) -> Dict[str, int]:
+        used, reserved = self._state_memory()
+        cols = [self._a, self._r, self._gamma, self._term, self._live, self._gather_sidxs]
+        return {
+            'states': reserved,
+            'states_used': used,
+            'columns': sum(col.nbytes for col in cols),
+            'extras': sum(col.nbytes for col in self._extras.values()),
+            **super().memory_usage(),
+        }
+
+    def _state_memory(self) -> Tuple[int, int]:
+        # bytes held by live states, and bytes allocated for states including spare rows
+        if not self._built:
+            return 0, 0
+
+        row = self._state_store[0].nbytes
+        return self.meta.n_states() * row, self._state_store.nbytes
+
+    def reserve(self, n: int):
+        self._capacity = max(self._capacity, n)
+        if self._built:
+            self._resize(self._capacity)
+
+    def _resize(self, n: int):
         # leave one spot at the end for zero term for bootstrapping
         cur_size = self._state_store.shape[0] - 1
-        if idx >= cur_size:
-            new_shape = (cur_size + 5, ) + self._state_store.shape[1:]
-            self._state_store = np.resize(self._state_store, new_shape)
-            self._state_store[-1] = 0
+        if n <= cur_size:
+            return
+
+        old = self._state_store
+        self._state_store = np.empty((n + 1, ) + old.shape[1:], dtype=old.dtype)
+        self._state_store[:cur_size] = old[:cur_size]
+        self._state_store[-1] = 0
+        self._capacity = n
+
+    def _grow(self, idx: SIDX):
+        # grow geometrically, but never past the worst case
+        limit = max_states(self._max_size)
+        self._resize(max(idx + 1, min(limit, self._capacity + self._capacity // 2)))
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        if idx >= self._capacity:
+            self._grow(idx)
 
         self._state_store[idx] = state
 
     def _load_states(self, idxs: SIDXs) -> np.ndarray:
         return self._state_store[idxs]
 
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        # -1 points at the zero state
+        take_into(self._state_store, idxs, out, minus_one_is_last=True)
+
+    def _load_state_pair(self, idxs: SIDXs, n_idxs: SIDXs) -> Tuple[np.ndarray, np.ndarray]:
+        return self._load_states(idxs), self._load_states(n_idxs)
+
     def _load_state(self, idx: SIDX) -> np.ndarray:
         return self._state_store[idx]
 
     def _remove_state(self, sidx: SIDX):
         ...
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_live' in state:
+            return
+
+        # pickled before extras were stored as columns, when each idx holding
+        # a transition kept its own dict of extras
+        extras: Dict[Any, Any] = state['_extras']
+        self._extras = {}
+        self._live = np.zeros(self._max_size, dtype=np.bool_)
+        self._size = 0
+        self._capacity = max(self._max_size, len(self._state_store) - 1)
+        self._gather_sidxs = np.empty(0, dtype=np.int64)
+
+        for idx, extra in extras.items():
+            self._check_extras(extra)
+            self._store_extras(idx, extra)
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _infer_dtype(v: Any) -> np.dtype:
+    # plain numbers get float columns, so that a first value of 0 does not truncate later ones
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return np.dtype(np.float_)
+
+    # strings vary in length, so they are kept as objects
+    dtype = np.asarray(v).dtype
+    if dtype.kind in 'US':
+        return np.dtype(object)
+
+    return dtype
+
+def _empty_value(dtype: np.dtype) -> Tuple[bool, Any]:
+    # whether a column of dtype can hold a row without a value, and what that row holds
+    if dtype.kind in 'fc':
+        return True, np.nan
+
+    if dtype.kind == 'O':
+        return True, None
+
+    return False, 0
+
+def _check_fits(key: Hashable, v: Any, col: np.ndarray):
+    # plain numbers into a float column are the common case, and always fit
+    if col.dtype.kind == 'f' and col.ndim == 1 and isinstance(v, (int, float)):
+        return
+
+    x = np.asarray(v)
+    if x.shape != col.shape[1:]:
+        raise ValueError(f'Extra <{key}> has shape <{x.shape}>, but its column holds <{col.shape[1:]}>')
+
+    if col.dtype.kind == 'O':
+        return
+
+    # numbers may be rounded into a float column, anything else has to be exact
+    if col.dtype.kind == 'f' and x.dtype.kind in 'biuf':
+        return
+
+    if col.dtype.kind == 'c' and x.dtype.kind in 'biufc':
+        return
+
+    if col.dtype.kind in 'iu' and x.dtype.kind in 'biu':
+        fits = np.array_equal(x.astype(col.dtype), x)
+    else:
+        fits = np.can_cast(x.dtype, col.dtype, casting='safe')
+
+    if not fits:
+        raise ValueError(f'Extra <{key}> of dtype <{x.dtype}> does not fit its column of <{col.dtype}>')
+
+def _pair_block(x: np.ndarray, xp: np.ndarray) -> np.ndarray | None:
+    # x and xp from empty_batch are the two halves of one contiguous block
+    block = x.base
+    if (
+        block is None
+        or block is not xp.base
+        or not block.flags.c_contiguous
+        or block.shape != (2, ) + x.shape
+        or x.ctypes.data != block.ctypes.data
+        or xp.ctypes.data != block.ctypes.data + x.nbytes
+    ):
+        return None
+
+    return block.reshape((2 * len(x), ) + x.shape[1:])
@@ -0,0 +1,146 @@
+import zlib
+import lz4.frame
+import numpy as np
+
+from abc import abstractmethod
+from typing import Any, List, Sequence, Tuple
+
+_Spec = Tuple[np.dtype, Tuple[int, ...]]
+
+# compressed states may be handed over as views into a larger buffer
+Blob = bytes | memoryview
+
+# ------------------
+# -- Compressors --
+# ------------------
+
+class Compressor:
+    @abstractmethod
+    def compress(self, data: Any) -> bytes: ...
+
+    @abstractmethod
+    def decompress(self, blob: Blob) -> bytes: ...
+
+
+class LZ4(Compressor):
+    def __init__(self, level: int = 0):
+        self.level = level
+
+    def compress(self, data: Any) -> bytes:
+        return lz4.frame.compress(data, compression_level=self.level)
+
+    def decompress(self, blob: Blob) -> bytes:
+        return lz4.frame.decompress(blob)
+
+
+class Zlib(Compressor):
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: Any) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, blob: Blob) -> bytes:
+        return zlib.decompress(blob)
+
+# -------------
+# -- Filters --
+# -------------
+
+# An invertible transform applied to a state before it is compressed.
+# decode is given the dtype and shape of the array that encode was given.
+class Filter:
+    @abstractmethod
+    def encode(self, x: np.ndarray) -> np.ndarray: ...
+
+    @abstractmethod
+    def decode(self, y: np.ndarray, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray: ...
+
+
+class ByteShuffle(Filter):
+    # groups the i-th byte of every element together. The high bytes of floats
+    # change slowly, so they end up in long runs that compress well.
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        b = _bytes(x)
+        return np.ascontiguousarray(b.T)
+
+    def decode(self, y: np.ndarray, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        return np.ascontiguousarray(y.T).view(dtype).reshape(shape)
+
+
+class BitShuffle(Filter):
+    # like ByteShuffle, but one plane per bit. Slower, and better on noisy low bits.
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        bits = np.unpackbits(_bytes(x), axis=1)
+        return np.packbits(bits.T, axis=1)
+
+    def decode(self, y: np.ndarray, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        n = int(np.prod(shape))
+        bits = np.unpackbits(y, axis=1, count=n)
+        b = np.ascontiguousarray(np.packbits(bits.T, axis=1))
+        return b.view(dtype).reshape(shape)
+
+
+class Delta(Filter):
+    # Stores each frame along `axis` as its difference from the previous frame,
+    # so stacked frames that barely change become mostly zeros. Differences are
+    # taken on the raw bits, which wrap around and so are exact for any dtype.
+    def __init__(self, axis: int = 0):
+        self.axis = axis
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        u = np.moveaxis(_uint(x), self.axis, 0)
+        d = u.copy()
+        np.subtract(u[1:], u[:-1], out=d[1:])
+        return np.ascontiguousarray(np.moveaxis(d, 0, self.axis))
+
+    def decode(self, y: np.ndarray, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        return np.cumsum(y, axis=self.axis, dtype=y.dtype).view(dtype)
+
+# -----------
+# -- Codec --
+# -----------
+
+class Codec:
+    def __init__(self, filters: Sequence[Filter] = (), compressor: Compressor | None = None):
+        self.filters = list(filters)
+        self.compressor = compressor or LZ4()
+
+        # the dtype and shape going into each filter, and coming out of the last one
+        self._specs: List[_Spec] = []
+
+    def build(self, dtype: Any, shape: Tuple[int, ...]):
+        y = np.zeros(shape, dtype=dtype)
+        self._specs = [(y.dtype, y.shape)]
+        for f in self.filters:
+            y = f.encode(y)
+            self._specs.append((y.dtype, y.shape))
+
+    def encode(self, x: np.ndarray) -> bytes:
+        for f in self.filters:
+            x = f.encode(x)
+
+        return self.compressor.compress(np.ascontiguousarray(x))
+
+    def decode(self, blob: Blob) -> np.ndarray:
+        raw = self.compressor.decompress(blob)
+        dtype, shape = self._specs[-1]
+        y = np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+        for i in reversed(range(len(self.filters))):
+            dtype, shape = self._specs[i]
+            y = self.filters[i].decode(y, dtype, shape)
+
+        return y
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _bytes(x: np.ndarray) -> np.ndarray:
+    # one row of raw bytes per element
+    x = np.ascontiguousarray(x)
+    return x.reshape(-1).view(np.uint8).reshape(-1, x.dtype.itemsize)
+
+def _uint(x: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(x).view(f'u{x.dtype.itemsize}')
@@ -1,20 +1,90 @@
-import lz4.frame
+import os
+import time
+import threading
 import numpy as np
 import ReplayTables._utils.np as npu
 
-from typing import Dict
+from typing import Any, Dict, List, Set, Tuple
 from concurrent.futures import ThreadPoolExecutor, Future
 
 from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
 from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.Codecs import Codec
+from ReplayTables._utils.BlobArena import BlobArena
+from ReplayTables._utils.LRUCache import LRUCache
+
+# below this many states per worker, handing work to the pool costs more than it saves
+_MIN_DECODE_CHUNK = 32
+
+# a state waiting to be compressed: sidx, ticket, state, and when it was stored
+_Job = Tuple[int, int, np.ndarray, float]
 
 class CompressedStorage(BasicStorage):
-    def __init__(self, max_size: int):
+    def __init__(
+        self,
+        max_size: int,
+        decode_workers: int | None = None,
+        cache_bytes: int = 0,
+        codec: Codec | None = None,
+        compress_workers: int = 2,
+        max_pending: int = 1024,
+        compress_batch: int = 32,
+    ):
         super().__init__(max_size)
 
-        self._state_store: Dict[int, bytes] = {}
-        self._tpe = ThreadPoolExecutor(max_workers=2)
-        self._locks: Dict[int, Future] = {}
+        # plain lz4 of the raw bytes unless told otherwise
+        self._codec = codec or Codec()
+
+        # compressed states, packed into one buffer
+        self._state_store = BlobArena()
+
+        # States are compressed off the calling thread, in batches. Until its blob is
+        # written a state is served raw from _pending, under the latest ticket for its
+        # sidx so that an older compression finishing late is thrown away.
+        # At most max_pending states wait at once, after that storing a state blocks.
+        self._compress_workers = compress_workers
+        self._max_pending = max_pending
+        self._compress_batch = compress_batch
+        self._start_compressor()
+        self._ticket = 0
+        self._pending: Dict[int, Tuple[int, np.ndarray]] = {}
+        self._compress_stats = _new_compress_stats()
+
+        self._decode_workers = decode_workers or os.cpu_count() or 1
+        self._decoder = ThreadPoolExecutor(max_workers=self._decode_workers)
+
+        # decoded states, so that states sampled over and over are only decompressed once
+        self._cache = LRUCache(cache_bytes) if cache_bytes > 0 else None
+
+    def cache_stats(self) -> Dict[str, float]:
+        if self._cache is None:
+            return {}
+
+        return self._cache.stats()
+
+    def compression_stats(self) -> Dict[str, float]:
+        # latencies are seconds from storing a state to its blob being written
+        with self._mutex:
+            stats = dict(self._compress_stats)
+            stats['queue_depth'] = self._queued
+            stats['max_pending'] = self._max_pending
+
+        n = stats['compressed']
+        stats['latency_mean'] = stats.pop('latency_total') / n if n else 0.
+        return stats
+
+    def flush(self):
+        # blocks until every stored state has been compressed
+        self._submit()
+        for f in list(self._inflight): f.result()
+
+    def _start_compressor(self):
+        self._tpe = ThreadPoolExecutor(max_workers=self._compress_workers)
+        self._mutex = threading.Lock()
+        self._room = threading.Semaphore(self._max_pending)
+        self._queued = 0
+        self._batch: List[_Job] = []
+        self._inflight: Set[Future] = set()
 
     def _deferred_init(self, transition: LaggedTimestep):
         self._built = True
@@ -24,40 +94,231 @@ class CompressedStorage(BasicStorage):
         zero_x = np.zeros(shape, dtype=self._dtype)
         self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
 
-        self._state_store[-1] = lz4.frame.compress(zero_x)
+        self._codec.build(self._dtype, shape)
+        self._state_store.put(-1, self._codec.encode(zero_x))
         self._shape = zero_x.shape
 
-    def _wait(self, idx: int):
-        if idx in self._locks:
-            self._locks[idx].result()
-            del self._locks[idx]
+    def _resize(self, n: int):
+        # the arena grows one blob at a time
+        ...
+
+    def _permute_states(self, src: SIDXs):
+        self.flush()
+
+        self._state_store.permute(src)
+
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _state_memory(self) -> Tuple[int, int]:
+        # states still waiting to be compressed are held raw
+        with self._mutex:
+            raw = sum(x.nbytes for _, x in self._pending.values())
+            return self._state_store.used + raw, self._state_store.nbytes + raw
+
+    def memory_usage(self) -> Dict[str, int]:
+        usage = super().memory_usage()
+        usage['decoded_cache'] = 0 if self._cache is None else self._cache.nbytes
+        return usage
 
     def _store_state(self, idx: SIDX, state: np.ndarray):
-        def _inner(data):
-            self._state_store[idx] = lz4.frame.compress(data)
+        # backpressure: wait for room, after handing over anything that is still batching
+        if not self._room.acquire(blocking=False):
+            start = time.perf_counter()
+            self._submit()
+            self._room.acquire()
+            self._compress_stats['blocked'] += 1
+            self._compress_stats['blocked_time'] += time.perf_counter() - start
+
+        if self._cache is not None:
+            self._cache.discard(idx)
+
+        with self._mutex:
+            self._ticket += 1
+            self._queued += 1
+            self._pending[idx] = (self._ticket, state)
+
+        self._batch.append((idx, self._ticket, state, time.perf_counter()))
+
+        # hand over full batches, or anything at all if a worker is idle
+        if len(self._batch) >= self._compress_batch or len(self._inflight) < self._compress_workers:
+            self._submit()
+
+    def _submit(self):
+        if not self._batch:
+            return
+
+        f = self._tpe.submit(self._compress, self._batch)
+        self._batch = []
+        self._inflight.add(f)
+        f.add_done_callback(self._inflight.discard)
+
+    def _compress(self, jobs: List[_Job]):
+        try:
+            blobs = [self._codec.encode(x) for _, _, x, _ in jobs]
+            now = time.perf_counter()
+            stats = self._compress_stats
+
+            with self._mutex:
+                for (idx, ticket, _, start), blob in zip(jobs, blobs):
+                    p = self._pending.get(idx)
+                    if p is not None and p[0] == ticket:
+                        self._state_store.put(idx, blob)
+                        del self._pending[idx]
+
+                    stats['compressed'] += 1
+                    stats['latency_total'] += now - start
+                    stats['latency_max'] = max(stats['latency_max'], now - start)
+
+                self._queued -= len(jobs)
 
-        self._wait(idx)
-        self._locks[idx] = self._tpe.submit(_inner, state)
+        finally:
+            for _ in jobs: self._room.release()
 
     def _load_state(self, idx: SIDX) -> np.ndarray:
-        self._wait(idx)
-        raw = lz4.frame.decompress(self._state_store[idx])
-        return np.frombuffer(raw, dtype=self._dtype).reshape(self._shape)
+        if self._pending:
+            with self._mutex:
+                p = self._pending.get(idx)
+
+            if p is not None:
+                return p[1]
+
+        if self._cache is not None:
+            x = self._cache.get(idx)
+            if x is not None:
+                return x
+
+        x = self._codec.decode(self._state_store.get(idx))
+
+        if self._cache is not None:
+            self._cache.put(idx, x)
+
+        return x
 
     def _load_states(self, idxs: SIDXs) -> np.ndarray:
-        return np.stack([self._load_state(idx) for idx in idxs])
+        out = np.empty((len(idxs), ) + self._shape, dtype=self._dtype)
+        self._load_states_into(idxs, out)
+        return out
+
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        todo = np.arange(len(idxs)) if self._cache is None else self._from_cache(idxs, out)
+        if self._pending:
+            todo = self._from_pending(idxs, out, todo)
+
+        n = len(todo)
+
+        # lz4 and zlib release the GIL while decoding, so chunks of the batch
+        # can be decompressed in parallel straight into the output
+        chunks = min(self._decode_workers, n // _MIN_DECODE_CHUNK)
+        if chunks <= 1:
+            self._decode_into(out, idxs, todo)
+        else:
+            futures = [
+                self._decoder.submit(self._decode_into, out, idxs, part)
+                for part in np.array_split(todo, chunks)
+            ]
+
+            for f in futures: f.result()
+
+        if self._cache is not None:
+            for i in todo.tolist():
+                self._cache.put(int(idxs[i]), out[i].copy())
+
+    def _from_cache(self, idxs: SIDXs, out: np.ndarray) -> np.ndarray:
+        # fills the hits and returns the positions that still need decoding
+        assert self._cache is not None
+        misses = []
+        for i, idx in enumerate(idxs.tolist()):
+            x = self._cache.get(idx)
+            if x is None:
+                misses.append(i)
+            else:
+                out[i] = x
+
+        return np.asarray(misses, dtype=np.int64)
+
+    def _from_pending(self, idxs: SIDXs, out: np.ndarray, todo: np.ndarray) -> np.ndarray:
+        # states not yet compressed are copied as they are
+        keep = np.ones(len(todo), dtype=np.bool_)
+        with self._mutex:
+            for j, i in enumerate(todo.tolist()):
+                p = self._pending.get(int(idxs[i]))
+                if p is not None:
+                    out[i] = p[1]
+                    keep[j] = False
+
+        return todo[keep]
+
+    def _decode_into(self, out: np.ndarray, idxs: SIDXs, todo: np.ndarray):
+        # assign row by row, so that decoded states land in out even when it is not contiguous
+        for i in todo.tolist():
+            out[i] = self._codec.decode(self._state_store.get(idxs[i]))
 
     def _remove_state(self, sidx: SIDX):
-        if sidx in self._state_store:
-            del self._state_store[sidx]
+        if self._cache is not None:
+            self._cache.discard(sidx)
+
+        with self._mutex:
+            self._pending.pop(sidx, None)
+            self._state_store.remove(sidx)
 
     def __getstate__(self):
-        for idx in list(self._locks): self._wait(idx)
+        self.flush()
         d = self.__dict__.copy()
-        del d['_tpe']
+        for k in ['_tpe', '_decoder', '_mutex', '_room', '_queued', '_batch', '_inflight']:
+            del d[k]
+
+        # decoded states are cheap to rebuild, so only the cache's budget is kept
+        if self._cache is not None:
+            d['_cache'] = LRUCache(self._cache.max_bytes)
+
         return d
 
     def __setstate__(self, state):
-        self.__dict__ = state
-        self._tpe = ThreadPoolExecutor(max_workers=2)
-        self._locks = {}
+        if '_locks' in state:
+            state = _from_baseline(state)
+
+        super().__setstate__(state)
+        self._start_compressor()
+        self._decoder = ThreadPoolExecutor(max_workers=self._decode_workers)
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _from_baseline(state: Dict[str, Any]) -> Dict[str, Any]:
+    # pickled before compression was pipelined, when each state was compressed
+    # on its own with plain lz4 and the blobs were kept in a dict by sidx
+    blobs: Dict[int, bytes] = state.pop('_state_store')
+    del state['_locks']
+
+    arena = BlobArena()
+    for sidx, blob in blobs.items():
+        arena.put(sidx, blob)
+
+    codec = Codec()
+    if state['_built']: codec.build(state['_dtype'], state['_shape'])
+
+    return {
+        **state,
+        '_state_store': arena,
+        '_codec': codec,
+        '_compress_workers': 2,
+        '_max_pending': 1024,
+        '_compress_batch': 32,
+        '_ticket': 0,
+        '_pending': {},
+        '_compress_stats': _new_compress_stats(),
+        '_decode_workers': os.cpu_count() or 1,
+        '_cache': None,
+    }
+
+def _new_compress_stats() -> Dict[str, float]:
+    return {
+        'compressed': 0,
+        'latency_total': 0.,
+        'latency_max': 0.,
+        'blocked': 0,
+        'blocked_time': 0.,
+    }
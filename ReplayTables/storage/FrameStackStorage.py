@@ -0,0 +1,207 @@
+import numpy as np
+import ReplayTables._utils.np as npu
+
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.tools import take_into
+
+# frame id that always points at the all-zeros frame
+_ZERO = -1
+
+# Stores stacked observations (e.g. the last k Atari frames) one frame at a time.
+# Each state is a row of k frame ids indexed by sidx. When a new state is the prior
+# state shifted by one frame, the overlapping frames are shared and only the newest
+# frame is stored. Sharing is decided by comparing frame contents, so stacks that
+# straddle an episode boundary are still stored exactly.
+class FrameStackStorage(BasicStorage):
+    def __init__(self, max_size: int, stack_axis: int = 0, capacity: int | None = None):
+        super().__init__(max_size, capacity)
+
+        self._axis = stack_axis
+        self._k = 0
+
+        self._frames = np.empty(0)
+        self._frame_refs = np.zeros(0, dtype=np.int64)
+        self._free_frames: List[int] = []
+        self._n_frames = 0
+
+        self._links = np.zeros((0, 0), dtype=np.int64)
+        self._occupied = np.zeros(0, dtype=np.bool_)
+
+        # the last couple of newly stored states are the only candidates for sharing.
+        # For n-step returns, x and n_x are stored interleaved so two are needed.
+        self._recent: Deque[SIDX] = deque(maxlen=2)
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        self._built = True
+
+        x = np.moveaxis(transition.x, self._axis, 0)
+        self._k = x.shape[0]
+        self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
+
+        # in steady state each state only adds a single new frame
+        n_frames = self._capacity + self._k
+        self._frames = np.empty((n_frames + 1, ) + x.shape[1:], dtype=x.dtype)
+        self._frames[_ZERO] = 0
+        self._frame_refs = np.zeros(n_frames, dtype=np.int64)
+
+        # the last row is the zero state used for bootstrapping
+        self._links = np.full((self._capacity + 1, self._k), _ZERO, dtype=np.int64)
+        self._occupied = np.zeros(self._capacity, dtype=np.bool_)
+
+    def _resize(self, n: int):
+        if n <= self._capacity:
+            return
+
+        links = np.full((n + 1, self._k), _ZERO, dtype=np.int64)
+        links[:self._capacity] = self._links[:self._capacity]
+        self._links = links
+
+        occupied = np.zeros(n, dtype=np.bool_)
+        occupied[:self._capacity] = self._occupied
+        self._occupied = occupied
+
+        self._capacity = n
+
+    def _permute_states(self, src: SIDXs):
+        # only the links move, frames stay where they are in the pool
+        n = len(src)
+        self._links[:n] = self._links[src]
+
+        occupied = np.zeros_like(self._occupied)
+        occupied[:n] = self._occupied[src]
+        self._occupied = occupied
+
+        new: Dict[int, Any] = {int(s): i for i, s in enumerate(src)}
+        self._recent = deque((new[s] for s in self._recent if s in new), maxlen=2)
+
+    def _state_memory(self) -> Tuple[int, int]:
+        if not self._built:
+            return 0, 0
+
+        # frames are shared between states, so count the frames that are still referenced
+        frames = np.count_nonzero(self._frame_refs) * self._frames[0].nbytes
+        links = self.meta.n_states() * self._links[0].nbytes
+        tables = [self._frames, self._frame_refs, self._links, self._occupied]
+        return frames + links, sum(t.nbytes for t in tables)
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        if idx >= self._capacity:
+            self._grow(idx)
+
+        x = np.moveaxis(state, self._axis, 0)
+        if self._occupied[idx]:
+            # the same xid is commonly stored again as the start of the next transition
+            if np.array_equal(self._frames[self._links[idx]], x):
+                return
+
+            self._release(idx)
+
+        links = self._shared_links(x)
+        if links is None:
+            links = self._new_links(x)
+
+        self._links[idx] = links
+        self._occupied[idx] = True
+        self._recent.append(idx)
+
+    def _shared_links(self, x: np.ndarray) -> np.ndarray | None:
+        for sidx in self._recent:
+            prior = self._links[sidx]
+            if not np.array_equal(self._frames[prior[1:]], x[:-1]):
+                continue
+
+            links = np.empty(self._k, dtype=np.int64)
+            links[:-1] = prior[1:]
+            links[-1] = self._add_frame(x[-1])
+            self._ref(links[:-1])
+            return links
+
+        return None
+
+    def _new_links(self, x: np.ndarray) -> np.ndarray:
+        links = np.empty(self._k, dtype=np.int64)
+        for j in range(self._k):
+            # padding at the start of an episode is commonly zeros or a repeated frame
+            if not x[j].any():
+                links[j] = _ZERO
+            elif j > 0 and np.array_equal(x[j], x[j - 1]):
+                links[j] = links[j - 1]
+                self._ref(links[j:j + 1])
+            else:
+                links[j] = self._add_frame(x[j])
+
+        return links
+
+    def _add_frame(self, frame: np.ndarray) -> int:
+        if self._free_frames:
+            f = self._free_frames.pop()
+        else:
+            if self._n_frames >= len(self._frame_refs):
+                self._grow_frames()
+
+            f = self._n_frames
+            self._n_frames += 1
+
+        self._frames[f] = frame
+        self._frame_refs[f] = 1
+        return f
+
+    def _grow_frames(self):
+        n = len(self._frame_refs)
+        new_n = n + n // 2 + self._k
+
+        frames = np.empty((new_n + 1, ) + self._frames.shape[1:], dtype=self._frames.dtype)
+        frames[:n] = self._frames[:n]
+        frames[_ZERO] = 0
+        self._frames = frames
+
+        refs = np.zeros(new_n, dtype=np.int64)
+        refs[:n] = self._frame_refs
+        self._frame_refs = refs
+
+    def _ref(self, frames: np.ndarray):
+        for f in frames:
+            if f != _ZERO:
+                self._frame_refs[f] += 1
+
+    def _release(self, sidx: SIDX):
+        for f in self._links[sidx]:
+            if f == _ZERO:
+                continue
+
+            self._frame_refs[f] -= 1
+            if self._frame_refs[f] == 0:
+                self._free_frames.append(int(f))
+
+        self._occupied[sidx] = False
+        if sidx in self._recent:
+            self._recent.remove(sidx)
+
+    def _load_states(self, idxs: SIDXs) -> np.ndarray:
+        stacks = self._frames[self._links[idxs]]
+        if self._axis == 0:
+            return stacks
+
+        dest = self._axis + 1 if self._axis >= 0 else self._axis
+        return np.ascontiguousarray(np.moveaxis(stacks, 1, dest))
+
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        links = self._links[idxs]
+        if self._axis == 0:
+            take_into(self._frames, links, out, minus_one_is_last=True)
+            return
+
+        dest = self._axis + 1 if self._axis >= 0 else self._axis
+        np.moveaxis(out, dest, 1)[:] = self._frames[links]
+
+    def _load_state(self, idx: SIDX) -> np.ndarray:
+        return np.moveaxis(self._frames[self._links[idx]], 0, self._axis)
+
+    def _remove_state(self, sidx: SIDX):
+        if sidx >= self._capacity or not self._occupied[sidx]:
+            return
+
+        self._release(sidx)
@@ -0,0 +1,92 @@
+import tempfile
+import numpy as np
+import ReplayTables._utils.np as npu
+
+from typing import Any, Dict
+from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.tools import max_states
+
+class MemmapStorage(BasicStorage):
+    def __init__(self, max_size: int, path: str | None = None):
+        super().__init__(max_size)
+
+        self._path = path
+        self._file: Any = None
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        self._built = True
+
+        shape = transition.x.shape
+        self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
+
+        # size for the worst case up front, the backing file is sparse
+        # so untouched rows do not cost disk space
+        self._capacity = max(self._capacity, max_states(self._max_size))
+        rows = self._capacity + 1
+        self._state_store = self._open(rows, shape, transition.x.dtype, mode='w+')
+        self._state_store[-1] = 0
+
+    def _open(self, rows: int, shape: tuple[int, ...], dtype: Any, mode: Any) -> np.memmap:
+        target: Any = self._path
+        if target is None:
+            # an anonymous file is cleaned up by the os once it is closed
+            self._file = tempfile.TemporaryFile(prefix='ReplayTables-')
+            target = self._file
+            mode = 'w+'
+
+        return np.memmap(target, dtype=dtype, mode=mode, shape=(rows, ) + shape)
+
+    def _resize(self, n: int):
+        # already sized for the worst case in _deferred_init
+        ...
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        self._state_store[idx] = state
+
+    def _load_states(self, idxs: SIDXs) -> np.ndarray:
+        return np.asarray(self._state_store[idxs])
+
+    def memory_usage(self) -> Dict[str, int]:
+        # states are paged in from the backing file, and the os can drop them at any time
+        usage = super().memory_usage()
+        usage['states_on_disk'] = usage.pop('states')
+        usage['states_on_disk_used'] = usage.pop('states_used')
+        return usage
+
+    def flush(self):
+        if self._built:
+            self._state_store.flush()
+
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        del d['_file']
+
+        if not self._built:
+            return d
+
+        self.flush()
+        store = self._state_store
+        d['_state_store'] = None
+        d['_store_meta'] = (store.shape, store.dtype)
+
+        # without a user-owned file, the only way to persist the states is to copy them
+        if self._path is None:
+            d['_state_store'] = np.asarray(store).copy()
+
+        return d
+
+    def __setstate__(self, state):
+        data = state.pop('_state_store')
+        meta = state.pop('_store_meta', None)
+        self.__dict__ = state
+        self._file = None
+        self._state_store = data
+
+        if meta is None:
+            return
+
+        shape, dtype = meta
+        self._state_store = self._open(shape[0], shape[1:], dtype, mode='r+')
+        if data is not None:
+            self._state_store[:] = data
@@ -1,6 +1,7 @@
-from typing import Tuple
-from ReplayTables.interface import Item, Items, EID, IDX, IDXs, XID
-import ReplayTables.rust as ru
+import numpy as np
+from typing import Dict, Tuple
+from ReplayTables.interface import Item, Items, EID, IDX, IDXs, SIDXs, XID
+from ReplayTables._utils.native import ru
 
 _EID_C = 0
 _XID_C = 1
@@ -10,6 +11,8 @@ _NSIDX_C = 4
 
 class MetadataStorage:
     def __init__(self, max_size: int, null_idx: int):
+        self._max_size = max_size
+        self._null_idx = null_idx
         self._m = ru.MetadataStorage(max_size, null_idx)
 
     def get_item_by_idx(self, idx: IDX) -> Item:
@@ -18,17 +21,69 @@ class MetadataStorage:
     def get_items_by_idx(self, idxs: IDXs) -> Items:
         return self._m.get_items_by_idx(idxs)
 
+    def get_sidxs_into(self, idxs: IDXs, eids: np.ndarray, sidxs: np.ndarray):
+        """
+        Fills eids with n eids and sidxs with n sidxs followed by n n_sidxs,
+        using -1 where there is no bootstrap state.
+        """
+        self._m.get_sidxs_into(idxs, eids, sidxs)
+
     def add_item(self, eid: EID, idx: IDX, xid: XID, n_xid: XID | None) -> Tuple[Item, Item | None]:
         return self._m.add_item(eid, idx, xid, n_xid)
 
+    def add_items(self, eids: np.ndarray, idxs: IDXs, xids: np.ndarray, n_xids: np.ndarray) -> Tuple[SIDXs, SIDXs, SIDXs]:
+        """
+        n_xids holds the null idx where there is no bootstrap state, and n_sidxs holds -1.
+        Also returns the sidxs that are no longer referenced after these adds.
+        """
+        return self._m.add_items(eids, idxs, xids, n_xids)
+
+    def defragment(self) -> SIDXs:
+        """
+        Renumbers sidxs into the order their states were first seen.
+        Returns the old sidx for each new sidx.
+        """
+        return self._m.defragment()
+
     def has_xid(self, xid: XID):
         return self._m.has_xid(xid)
 
+    def n_states(self) -> int:
+        return self._m.memory_usage()[2]
+
+    def memory_usage(self) -> Dict[str, int]:
+        items, ref_count, _ = self._m.memory_usage()
+        return {'items': items, 'ref_count': ref_count}
+
     def __getstate__(self):
+        # the item table and free list are enough to rebuild the reference counts
+        items = self.get_items_by_idx(np.arange(self._max_size, dtype=np.int64))
         return {
-            'm': self._m.__getstate__()
+            'max_size': self._max_size,
+            'null_idx': self._null_idx,
+            'eids': items.eids,
+            'xids': items.xids,
+            'n_xids': items.n_xids,
+            'sidxs': items.sidxs,
+            'n_sidxs': items.n_sidxs,
+            'free': self._m.free_sidxs(),
+            'last': self._m.last_sidx(),
         }
 
     def __setstate__(self, state):
-        self._m = ru.MetadataStorage()
-        self._m.__setstate__(state['m'])
+        if 'm' in state:
+            # pickled as the serialized rust storage, before the item table was written out as arrays
+            state = ru.MetadataStorage.legacy_state(state['m'])
+
+        self._max_size = state['max_size']
+        self._null_idx = state['null_idx']
+        self._m = ru.MetadataStorage(self._max_size, self._null_idx)
+        self._m.restore(
+            np.ascontiguousarray(state['eids']),
+            np.ascontiguousarray(state['xids']),
+            np.ascontiguousarray(state['n_xids']),
+            np.ascontiguousarray(state['sidxs']),
+            np.ascontiguousarray(state['n_sidxs']),
+            np.ascontiguousarray(state['free']),
+            state['last'],
+        )
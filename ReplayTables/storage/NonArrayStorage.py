@@ -1,7 +1,8 @@
+import sys
 import numpy as np
 import ReplayTables._utils.np as npu
 
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
 from ReplayTables.storage.BasicStorage import BasicStorage
 
@@ -17,6 +18,20 @@ class NonArrayStorage(BasicStorage):
         self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
         self._state_store[-1] = None
 
+    def _resize(self, n: int):
+        # dict-backed stores grow one state at a time
+        ...
+
+    def _permute_states(self, src: SIDXs):
+        old = self._state_store
+        self._state_store = {new: old[s] for new, s in enumerate(src.tolist())}
+        self._state_store[-1] = old[-1]
+
+    def _state_memory(self) -> Tuple[int, int]:
+        # only the outer size of each object, anything it points to is not followed
+        used = sum(sys.getsizeof(s) for s in self._state_store.values())
+        return used, used + sys.getsizeof(self._state_store)
+
     def _store_state(self, idx: SIDX, state: Any):
         self._state_store[idx] = state
 
@@ -0,0 +1,137 @@
+import numpy as np
+import numpy.typing as npt
+import ReplayTables._utils.np as npu
+
+from typing import Any
+from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
+from ReplayTables.storage.BasicStorage import BasicStorage
+
+class QuantizedStorage(BasicStorage):
+    def __init__(
+        self,
+        max_size: int,
+        dtype: npt.DTypeLike = np.uint8,
+        low: npt.ArrayLike | None = None,
+        high: npt.ArrayLike | None = None,
+        calibration_size: int = 1000,
+        margin: float = 0.1,
+        capacity: int | None = None,
+    ):
+        super().__init__(max_size, capacity)
+
+        self._q_dtype = np.dtype(dtype)
+        assert self._q_dtype in (np.uint8, np.float16), 'Can only quantize to uint8 or float16'
+        assert (low is None) == (high is None), 'Give both low and high, or neither'
+
+        self._given = (low, high)
+        self._calibration_size = calibration_size
+        self._margin = margin
+        self._calibrated = False
+        self._seen = 0
+
+        # per-feature affine transform, x ~= q * scale + offset
+        self._raw_dtype: Any = np.float32
+        self._low = np.zeros(0)
+        self._high = np.zeros(0)
+        self._scale = np.ones(0)
+        self._offset = np.zeros(0)
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        self._built = True
+
+        shape = transition.x.shape
+        assert np.issubdtype(transition.x.dtype, np.floating), 'Can only quantize floating point states'
+        self._raw_dtype = transition.x.dtype
+        self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
+
+        # until calibrated, states are stored at full precision
+        self._state_store = np.zeros((self._capacity + 1, ) + shape, dtype=self._raw_dtype)
+        self._low = np.full(shape, np.inf)
+        self._high = np.full(shape, -np.inf)
+
+        low, high = self._given
+        if low is not None and high is not None:
+            self._low = np.broadcast_to(np.asarray(low, dtype=np.float64), shape).copy()
+            self._high = np.broadcast_to(np.asarray(high, dtype=np.float64), shape).copy()
+            self._calibrate()
+
+    def _calibrate(self):
+        width = self._high - self._low
+        width[width <= 0] = 1.
+
+        if self._q_dtype == np.uint8:
+            self._offset = self._low
+            self._scale = width / 255.
+        else:
+            self._offset = (self._high + self._low) / 2
+            self._scale = width / 2
+
+        self._offset = self._offset.astype(self._raw_dtype)
+        self._scale = self._scale.astype(self._raw_dtype)
+
+        # unwritten rows can hold anything, so ignore warnings from casting them
+        with np.errstate(all='ignore'):
+            self._state_store = self._encode(self._state_store)
+
+        self._calibrated = True
+
+    def _encode(self, x: np.ndarray) -> np.ndarray:
+        q = (x - self._offset) / self._scale
+        if self._q_dtype == np.uint8:
+            q = np.clip(np.rint(q), 0, 255)
+
+        return q.astype(self._q_dtype)
+
+    def _decode(self, q: np.ndarray) -> np.ndarray:
+        x = q.astype(self._raw_dtype)
+        x *= self._scale
+        x += self._offset
+        return x
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        if not self._calibrated:
+            self._seen += 1
+            np.minimum(self._low, state, out=self._low)
+            np.maximum(self._high, state, out=self._high)
+            super()._store_state(idx, state)
+
+            if self._seen >= self._calibration_size:
+                # later states may fall outside of the range seen so far
+                pad = self._margin * (self._high - self._low)
+                self._low -= pad
+                self._high += pad
+                self._calibrate()
+            return
+
+        super()._store_state(idx, self._encode(state))
+
+    def _load_states(self, idxs: SIDXs) -> np.ndarray:
+        q = self._state_store[idxs]
+        if not self._calibrated:
+            return q
+
+        x = self._decode(q)
+
+        # the bootstrap state needs to be exactly zero, which may not be representable
+        x[idxs == -1] = 0
+        return x
+
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        if not self._calibrated:
+            super()._load_states_into(idxs, out)
+            return
+
+        # decode straight into out, the same way as _decode
+        np.multiply(self._state_store[idxs], self._scale, out=out)
+        out += self._offset
+        out[idxs == -1] = 0
+
+    def _load_state(self, idx: SIDX) -> np.ndarray:
+        q = self._state_store[idx]
+        if not self._calibrated:
+            return q
+
+        if idx == -1:
+            return np.zeros_like(q, dtype=self._raw_dtype)
+
+        return self._decode(q)
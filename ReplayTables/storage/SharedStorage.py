@@ -0,0 +1,256 @@
+import json
+import time
+import secrets
+import numpy as np
+import ReplayTables._utils.np as npu
+
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Sequence, Tuple
+from ReplayTables.interface import Batch, LaggedTimestep, IDX, IDXs, SIDX, SIDXs, Item
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.tools import max_states
+
+# header layout: [version, size, layout length] followed by the json layout
+_HEADER_BYTES = 4096
+_VERSION = 0
+_SIZE = 1
+_LAYOUT_LEN = 2
+_LAYOUT_START = 32
+
+_ALIGN = 64
+
+_Layout = Dict[str, Tuple[int, Tuple[int, ...], str]]
+
+class SharedStorage(BasicStorage):
+    def __init__(self, max_size: int, name: str | None = None):
+        super().__init__(max_size)
+
+        self._name = name or f'ReplayTables_{secrets.token_hex(6)}'
+        self._shm: SharedMemory | None = None
+        self._header = np.zeros(3, dtype=np.int64)
+
+        # mirror of the metadata that readers need, since the rust metadata cannot be shared
+        self._eids = np.zeros(0, dtype=np.int64)
+        self._sidxs = np.zeros(0, dtype=np.int64)
+        self._n_sidxs = np.zeros(0, dtype=np.int64)
+
+    @property
+    def name(self):
+        return self._name
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        self._built = True
+
+        x = np.asarray(transition.x)
+        assert not x.dtype.hasobject, 'Cannot share object arrays between processes'
+
+        # shared memory cannot grow, so size for the worst case.
+        # pages that are never touched are not backed by memory.
+        self._capacity = max(self._capacity, max_states(self._max_size))
+        n = self._max_size
+        specs = [
+            ('x', (self._capacity + 1, ) + x.shape, x.dtype),
+            ('a', (n, ), np.dtype(npu.get_dtype(transition.a))),
+            ('r', (n, ), self._r.dtype),
+            ('gamma', (n, ), self._gamma.dtype),
+            ('term', (n, ), self._term.dtype),
+            ('eid', (n, ), np.dtype(np.int64)),
+            ('sidx', (n, ), np.dtype(np.int64)),
+            ('n_sidx', (n, ), np.dtype(np.int64)),
+        ]
+
+        layout: _Layout = {}
+        offset = _HEADER_BYTES
+        for key, shape, dtype in specs:
+            layout[key] = (offset, shape, dtype.str)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            offset += -(-nbytes // _ALIGN) * _ALIGN
+
+        self._shm = SharedMemory(name=self._name, create=True, size=offset)
+        raw = json.dumps(layout).encode()
+        assert _LAYOUT_START + len(raw) <= _HEADER_BYTES
+
+        self._header = _header(self._shm)
+        buf = self._shm.buf
+        assert buf is not None
+        buf[_LAYOUT_START:_LAYOUT_START + len(raw)] = raw
+
+        cols = _columns(self._shm, layout)
+        self._state_store = cols['x']
+        self._a = cols['a']
+        self._r = cols['r']
+        self._gamma = cols['gamma']
+        self._term = cols['term']
+        self._eids = cols['eid']
+        self._sidxs = cols['sidx']
+        self._n_sidxs = cols['n_sidx']
+
+        self._r[:] = np.nan
+        self._gamma[:] = np.nan
+        self._state_store[-1] = 0
+
+        # publish the layout last so readers never see a partial one
+        self._header[_LAYOUT_LEN] = len(raw)
+
+    def add(self, idx: IDX, transition: LaggedTimestep, /, **kwargs: Any):
+        if not self._built: self._deferred_init(transition)
+
+        # an odd version tells readers that a write is in progress
+        self._header[_VERSION] += 1
+        try:
+            item = super().add(idx, transition)
+            self._publish(item)
+        finally:
+            # even again, so a failed write cannot leave readers waiting forever
+            self._header[_VERSION] += 1
+
+        return item
+
+    def add_many(self, idxs: IDXs, transitions: Sequence[LaggedTimestep]) -> List[Item]:
+        if not transitions:
+            return []
+
+        if not self._built: self._deferred_init(transitions[0])
+
+        self._header[_VERSION] += 1
+        try:
+            items = super().add_many(idxs, transitions)
+            for item in items: self._publish(item)
+        finally:
+            self._header[_VERSION] += 1
+
+        return items
+
+    def set(self, idx: IDX, transition: LaggedTimestep):
+        if not self._built: self._deferred_init(transition)
+
+        self._header[_VERSION] += 1
+        try:
+            item = super().set(idx, transition)
+            self._publish(item)
+        finally:
+            self._header[_VERSION] += 1
+
+        return item
+
+    def defragment(self):
+        if not self._built:
+            return
+
+        # readers gather through the sidx columns, so rewrite them in the same write
+        self._header[_VERSION] += 1
+        try:
+            super().defragment()
+
+            items = self.meta.get_items_by_idx(np.arange(self._max_size, dtype=np.int64))
+            self._sidxs[:] = items.sidxs
+            self._n_sidxs[:] = items.n_sidxs
+        finally:
+            self._header[_VERSION] += 1
+
+    def memory_usage(self) -> Dict[str, int]:
+        usage = super().memory_usage()
+        usage['columns'] += self._eids.nbytes + self._sidxs.nbytes + self._n_sidxs.nbytes
+        return usage
+
+    def _publish(self, item: Item):
+        self._eids[item.idx] = item.eid
+        self._sidxs[item.idx] = item.sidx
+        self._n_sidxs[item.idx] = -1 if item.n_sidx is None else item.n_sidx
+        self._header[_SIZE] = len(self)
+
+    def _resize(self, n: int):
+        # already sized for the worst case in _deferred_init
+        ...
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        self._state_store[idx] = state
+
+    def _load_states(self, idxs: SIDXs) -> np.ndarray:
+        return self._state_store[idxs]
+
+    def close(self):
+        if self._shm is None:
+            return
+
+        # drop our views before releasing the buffer they point into
+        self._state_store = self._a = self._r = self._gamma = self._term = np.zeros(0)
+        self._eids = self._sidxs = self._n_sidxs = self._header = np.zeros(0, dtype=np.int64)
+
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __getstate__(self):
+        raise TypeError('SharedStorage cannot be pickled, attach to it with SharedStorageReader instead')
+
+
+class SharedStorageReader:
+    def __init__(self, name: str, timeout: float = 10.):
+        self._shm = SharedMemory(name=name)
+        self._timeout = timeout
+
+        # the writer owns the segment, so keep this process from unlinking it on exit
+        resource_tracker.unregister(self._shm._name, 'shared_memory')  # type: ignore
+
+        self._header = _header(self._shm)
+        start = time.monotonic()
+        while self._header[_LAYOUT_LEN] == 0:
+            assert time.monotonic() - start < timeout, 'Timed out waiting for the writer'
+            time.sleep(1e-3)
+
+        n = int(self._header[_LAYOUT_LEN])
+        buf = self._shm.buf
+        assert buf is not None
+        layout = json.loads(bytes(buf[_LAYOUT_START:_LAYOUT_START + n]))
+        self._cols = _columns(self._shm, layout)
+
+    def size(self) -> int:
+        return int(self._header[_SIZE])
+
+    def get(self, idxs: IDXs) -> Batch:
+        # retry until no write overlapped with the gather
+        start = time.monotonic()
+        while True:
+            v = self._header[_VERSION]
+            if v % 2 == 0:
+                batch = self._gather(idxs)
+                if self._header[_VERSION] == v:
+                    return batch
+
+            assert time.monotonic() - start < self._timeout, 'Timed out waiting for the writer'
+            time.sleep(1e-4)
+
+    def _gather(self, idxs: IDXs) -> Batch:
+        c = self._cols
+        eids: Any = c['eid'][idxs]
+        return Batch(
+            x=c['x'][c['sidx'][idxs]],
+            a=c['a'][idxs],
+            r=c['r'][idxs],
+            gamma=c['gamma'][idxs],
+            terminal=c['term'][idxs],
+            eid=eids,
+            xp=c['x'][c['n_sidx'][idxs]],
+        )
+
+    def close(self):
+        self._cols = {}
+        self._header = np.zeros(0, dtype=np.int64)
+        self._shm.close()
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+def _header(shm: SharedMemory) -> np.ndarray:
+    return np.ndarray((3, ), dtype=np.int64, buffer=shm.buf)
+
+def _columns(shm: SharedMemory, layout: Any) -> Dict[str, np.ndarray]:
+    out: Dict[str, np.ndarray] = {}
+    for key, (offset, shape, dtype) in layout.items():
+        out[key] = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+
+    return out
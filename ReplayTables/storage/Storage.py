@@ -1,6 +1,6 @@
 import numpy as np
 from abc import abstractmethod
-from typing import Any
+from typing import Any, Dict, List, Sequence
 from ReplayTables.interface import Batch, LaggedTimestep, IDX, IDXs, Item
 from ReplayTables.storage.MetadataStorage import MetadataStorage
 
@@ -19,7 +19,18 @@ class Storage:
         ...
 
     @abstractmethod
-    def get(self, idxs: IDXs) -> Batch:
+    def get(self, idxs: IDXs, out: Batch | None = None) -> Batch:
+        """
+        Gathers the transitions at idxs. When out is given, usually from
+        empty_batch, its arrays are filled in place and it is returned.
+        """
+        ...
+
+    @abstractmethod
+    def empty_batch(self, n: int) -> Batch:
+        """
+        Allocates a batch of n transitions that get(out=...) can fill.
+        """
         ...
 
     @abstractmethod
@@ -34,6 +45,24 @@ class Storage:
     def add(self, idx: IDX, transition: LaggedTimestep, /, **kwargs: Any) -> Item:
         ...
 
+    def add_many(self, idxs: IDXs, transitions: Sequence[LaggedTimestep]) -> List[Item]:
+        return [self.add(idx, t) for idx, t in zip(idxs, transitions)]
+
     @abstractmethod
     def delete(self, idx: IDX):
         ...
+
+    def defragment(self):
+        ...
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held by each part of the storage. Entries ending in `_used` are
+        the part of the matching entry that holds live data, so they are not
+        counted separately.
+        """
+        meta = self.meta.memory_usage()
+        return {
+            'metadata_items': meta['items'],
+            'metadata_ref_count': meta['ref_count'],
+        }
@@ -0,0 +1,124 @@
+import numpy as np
+import ReplayTables._utils.np as npu
+
+from typing import Any, Iterator, List, NamedTuple, Sequence, Tuple
+from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.tools import take_into
+
+class StructuredStorage(BasicStorage):
+    def __init__(self, max_size: int, capacity: int | None = None):
+        super().__init__(max_size, capacity)
+
+        self._tree: _TreeDef | None = None
+        self._columns: List[np.ndarray] = []
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        self._built = True
+
+        self._a = np.empty(self._max_size, dtype=npu.get_dtype(transition.a))
+
+        # one contiguous column per leaf, each with a zero row at the end for bootstrapping
+        self._tree = _structure(transition.x)
+        self._columns = []
+        for leaf in _leaves(self._tree, transition.x):
+            leaf = np.asarray(leaf)
+            col = np.empty((self._capacity + 1, ) + leaf.shape, dtype=leaf.dtype)
+            col[-1] = 0
+            self._columns.append(col)
+
+        self._state_store = self._columns
+
+    def _resize(self, n: int):
+        if n <= self._capacity:
+            return
+
+        for i, old in enumerate(self._columns):
+            col = np.empty((n + 1, ) + old.shape[1:], dtype=old.dtype)
+            col[:self._capacity] = old[:self._capacity]
+            col[-1] = 0
+            self._columns[i] = col
+
+        self._capacity = n
+
+    def _permute_states(self, src: SIDXs):
+        for col in self._columns:
+            col[:len(src)] = col[src]
+
+    def _state_memory(self) -> Tuple[int, int]:
+        row = sum(col[0].nbytes for col in self._columns)
+        return self.meta.n_states() * row, sum(col.nbytes for col in self._columns)
+
+    def _store_state(self, idx: SIDX, state: Any):
+        if idx >= self._capacity:
+            self._grow(idx)
+
+        assert self._tree is not None
+        for col, leaf in zip(self._columns, _leaves(self._tree, state)):
+            col[idx] = leaf
+
+    def _load_states(self, idxs: SIDXs) -> Any:
+        assert self._tree is not None
+        return _unflatten(self._tree, iter([col[idxs] for col in self._columns]))
+
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        # empty_batch only hands out arrays, so the state is a single leaf
+        assert len(self._columns) == 1 and self._tree == _LEAF
+        take_into(self._columns[0], idxs, out, minus_one_is_last=True)
+
+    def _load_state(self, idx: SIDX) -> Any:
+        assert self._tree is not None
+        return _unflatten(self._tree, iter([col[idx] for col in self._columns]))
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+class _TreeDef(NamedTuple):
+    # None for leaves, otherwise the container type
+    kind: Any
+    keys: Sequence[Any]
+    children: Sequence['_TreeDef']
+
+_LEAF = _TreeDef(None, (), ())
+
+def _structure(x: Any) -> _TreeDef:
+    if isinstance(x, dict):
+        keys = list(x.keys())
+        return _TreeDef(type(x), keys, [_structure(x[k]) for k in keys])
+
+    if isinstance(x, (tuple, list)):
+        return _TreeDef(type(x), (), [_structure(v) for v in x])
+
+    return _LEAF
+
+def _leaves(tree: _TreeDef, x: Any) -> List[Any]:
+    out: List[Any] = []
+    _flatten(tree, x, out)
+    return out
+
+def _flatten(tree: _TreeDef, x: Any, out: List[Any]):
+    if tree.kind is None:
+        out.append(x)
+
+    # walk dicts by the recorded keys so insertion order does not matter
+    elif tree.keys:
+        for k, c in zip(tree.keys, tree.children): _flatten(c, x[k], out)
+
+    else:
+        for v, c in zip(x, tree.children): _flatten(c, v, out)
+
+def _unflatten(tree: _TreeDef, leaves: Iterator[Any]) -> Any:
+    if tree.kind is None:
+        return next(leaves)
+
+    children = [_unflatten(c, leaves) for c in tree.children]
+    if issubclass(tree.kind, dict):
+        return tree.kind(zip(tree.keys, children))
+
+    # namedtuples take their fields positionally
+    if issubclass(tree.kind, tuple) and hasattr(tree.kind, '_fields'):
+        return tree.kind(*children)
+
+    return tree.kind(children)
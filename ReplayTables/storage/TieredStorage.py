@@ -0,0 +1,157 @@
+import numpy as np
+
+from typing import Any, Dict
+from ReplayTables.interface import LaggedTimestep, SIDX, SIDXs
+from ReplayTables.storage.MemmapStorage import MemmapStorage
+from ReplayTables.storage.tools import take_into
+from ReplayTables._utils.jit import try2jit
+
+# slot lookup value for states that are only on disk
+_COLD = -1
+
+# Keeps a bounded hot set of states in memory on top of a file that holds every state.
+# States are written through to the file, so dropping one from memory never needs a write.
+# Hot slots are recycled with the clock algorithm: new states take the next slot under the
+# hand, and a state that is sampled again while hot survives the hand's next pass. Under
+# prioritized sampling the hot set settles on the states that keep getting drawn.
+class TieredStorage(MemmapStorage):
+    def __init__(self, max_size: int, hot_size: int, path: str | None = None):
+        super().__init__(max_size, path=path)
+        assert hot_size > 0, 'Need room for at least one hot state'
+
+        self._hot_size = hot_size
+        self._hand = 0
+
+        self._hot = np.empty(0)
+        self._slots = np.zeros(0, dtype=np.int64)
+        self._owners = np.zeros(0, dtype=np.int64)
+        self._referenced = np.zeros(0, dtype=np.bool_)
+
+    def _deferred_init(self, transition: LaggedTimestep):
+        super()._deferred_init(transition)
+
+        # the last hot row is the zero state, and sidx -1 always points at it
+        x = np.asarray(transition.x)
+        self._hot = np.empty((self._hot_size + 1, ) + x.shape, dtype=x.dtype)
+        self._hot[-1] = 0
+
+        self._slots = np.full(self._capacity + 1, _COLD, dtype=np.int64)
+        self._slots[-1] = self._hot_size
+        self._owners = np.full(self._hot_size, _COLD, dtype=np.int64)
+        self._referenced = np.zeros(self._hot_size, dtype=np.bool_)
+
+    def memory_usage(self) -> Dict[str, int]:
+        usage = super().memory_usage()
+        tables = [self._hot, self._slots, self._owners, self._referenced]
+        usage['states'] = sum(t.nbytes for t in tables)
+        usage['states_used'] = np.count_nonzero(self._owners != _COLD) * self._hot[0].nbytes if self._built else 0
+        return usage
+
+    def _store_state(self, idx: SIDX, state: np.ndarray):
+        super()._store_state(idx, state)
+
+        slot = self._slots[idx]
+        if slot == _COLD:
+            slot = self._claim(1)[0]
+            self._own(slot, idx)
+
+        self._hot[slot] = state
+
+    def _remove_state(self, sidx: SIDX):
+        slot = self._slots[sidx]
+        if slot != _COLD:
+            self._owners[slot] = _COLD
+            self._referenced[slot] = False
+            self._slots[sidx] = _COLD
+
+    def _load_state(self, idx: SIDX) -> np.ndarray:
+        slot = self._slots[idx]
+        if slot != _COLD:
+            return self._hot[slot]
+
+        return np.asarray(self._state_store[idx])
+
+    def _load_states(self, idxs: SIDXs) -> np.ndarray:
+        out = np.empty((len(idxs), ) + self._hot.shape[1:], dtype=self._hot.dtype)
+        self._load_states_into(idxs, out)
+        return out
+
+    def _load_states_into(self, idxs: SIDXs, out: np.ndarray):
+        slots = self._slots[idxs]
+        hot = slots != _COLD
+
+        # the zero slot has no reference bit, and setting it is harmless
+        self._referenced[slots[hot & (slots < self._hot_size)]] = True
+
+        if hot.all():
+            take_into(self._hot, slots, out)
+            return
+
+        out[hot] = self._hot[slots[hot]]
+
+        # read each cold state once, in file order
+        cold = ~hot
+        sidxs, inverse = np.unique(idxs[cold], return_inverse=True)
+        rows = np.asarray(self._state_store[sidxs])
+        out[cold] = rows[inverse]
+
+        # promote what was just read, but never churn more than half of the hot set at once
+        n = min(len(sidxs), self._hot_size // 2)
+        if n == 0:
+            return
+
+        claimed = self._claim(n)
+        self._own(claimed, sidxs[:n])
+        self._hot[claimed] = rows[:n]
+
+    def _claim(self, n: int) -> np.ndarray:
+        out = np.empty(n, dtype=np.int64)
+        self._hand = _sweep(self._referenced, self._hand, out)
+
+        # whatever held these slots is now only on disk
+        prior = self._owners[out]
+        self._slots[prior[prior != _COLD]] = _COLD
+        return out
+
+    def _own(self, slots: Any, sidxs: Any):
+        self._owners[slots] = sidxs
+        self._slots[sidxs] = slots
+        self._referenced[slots] = False
+
+    def _permute_states(self, src: SIDXs):
+        super()._permute_states(src)
+
+        # hot rows stay put, only the sidxs they belong to change
+        new = np.full(self._capacity + 1, _COLD, dtype=np.int64)
+        new[src] = np.arange(len(src), dtype=np.int64)
+
+        owned = self._owners != _COLD
+        self._owners[owned] = new[self._owners[owned]]
+
+        # a hot state that is no longer live stays out of the hot set
+        owned = self._owners != _COLD
+        self._slots[:] = _COLD
+        self._slots[-1] = self._hot_size
+        self._slots[self._owners[owned]] = np.flatnonzero(owned)
+
+
+# --------------------
+# -- Internal Utils --
+# --------------------
+
+@try2jit()
+def _sweep(referenced: np.ndarray, hand: int, out: np.ndarray) -> int:
+    n = len(referenced)
+    i = 0
+    while i < len(out):
+        if referenced[hand]:
+            referenced[hand] = False
+        else:
+            out[i] = hand
+            i += 1
+            # so that a sweep that wraps around does not take the same slot twice
+            referenced[hand] = True
+
+        hand = (hand + 1) % n
+
+    return hand
@@ -0,0 +1,16 @@
+import numpy as np
+
+def max_states(max_size: int) -> int:
+    # every transition owns the state it starts from, and can hold one
+    # more bootstrap state that no transition starts from
+    return 2 * max_size
+
+def take_into(src: np.ndarray, idxs: np.ndarray, out: np.ndarray, minus_one_is_last: bool = False):
+    # np.take buffers its output unless told how to handle out-of-bounds idxs,
+    # so the bounds are checked here and the mode take is given never applies.
+    # where -1 stands for the last row, wrap sends exactly that idx there.
+    low = -1 if minus_one_is_last else 0
+    if len(idxs) and (idxs.min() < low or idxs.max() >= len(src)):
+        raise IndexError(f'Index out of bounds for <{len(src)}> rows')
+
+    np.take(src, idxs, axis=0, out=out, mode='wrap' if minus_one_is_last else 'clip')
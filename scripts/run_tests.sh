@@ -1,4 +1,5 @@
 #!/bin/bash
 set -e
 mypy -p ReplayTables
+cargo test
 pytest
@@ -6,9 +6,13 @@ mod storage;
 /// A Python module implemented in Rust.
 #[pymodule]
 fn rust(_py: Python, m: &PyModule) -> PyResult<()> {
+    // bumped whenever the python side starts to rely on something new from this module,
+    // so that a stale build fails on import instead of deep inside a call
+    m.add("API_VERSION", 1)?;
     m.add_class::<utils::ref_count::RefCount>()?;
     m.add_class::<utils::sumtree::SumTree>()?;
     m.add_class::<storage::metadata_storage::MetadataStorage>()?;
     m.add_class::<storage::metadata_storage::Item>()?;
+    m.add_class::<storage::state_arena::StateArena>()?;
     Ok(())
 }
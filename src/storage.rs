@@ -1 +1,2 @@
 pub mod metadata_storage;
+pub mod state_arena;
@@ -1,5 +1,5 @@
-use numpy::{PyArray1, PyReadonlyArray1, ToPyArray};
-use pyo3::{prelude::*, types::{PyBytes, PyTuple}};
+use numpy::{PyArray1, PyReadonlyArray1, PyReadwriteArray1, ToPyArray};
+use pyo3::{prelude::*, exceptions::PyValueError, types::{PyBytes, PyDict, PyTuple}};
 use bincode::{deserialize, serialize};
 use serde::{Deserialize, Serialize};
 
@@ -63,6 +63,17 @@ pub struct MetadataStorage {
 }
 
 
+// The layout MetadataStorage was pickled in while its reference counts were
+// kept in trees. The items themselves have not changed.
+#[derive(Deserialize)]
+struct LegacyMetadataStorage {
+    _max_size: usize,
+    _ref: crate::utils::ref_count::LegacyRefCount,
+    _null_idx: i64,
+    _ids: Vec<Item>,
+}
+
+
 #[pymethods]
 impl MetadataStorage {
     #[new]
@@ -137,6 +148,34 @@ impl MetadataStorage {
         })
     }
 
+    // fills caller-owned arrays with what a batch gather needs. sidxs holds
+    // the sidxs followed by the n_sidxs, so both can be gathered in one pass.
+    pub fn get_sidxs_into(
+        &self,
+        idxs: PyReadonlyArray1<i64>,
+        mut eids: PyReadwriteArray1<i64>,
+        mut sidxs: PyReadwriteArray1<i64>,
+    ) -> PyResult<()> {
+        let idxs = idxs.as_array();
+        let mut eids = eids.as_array_mut();
+        let mut sidxs = sidxs.as_array_mut();
+        let size = idxs.len();
+
+        if eids.len() != size || sidxs.len() != 2 * size {
+            return Err(PyValueError::new_err("Expected <n> eids and <2n> sidxs to fill"));
+        }
+
+        for i in 0..size {
+            let idx = *idxs.get(i).expect("");
+            let item = self._ids.get(idx as usize).expect("");
+            eids[i] = item.eid;
+            sidxs[i] = item.sidx;
+            sidxs[size + i] = item.n_sidx.unwrap_or(-1);
+        }
+
+        Ok(())
+    }
+
     pub fn add_item(
         &mut self,
         eid: i64,
@@ -176,10 +215,181 @@ impl MetadataStorage {
         (item, last_item)
     }
 
+    // add many items in one call, returning the sidxs of each item
+    // and every sidx that is no longer referenced by any item
+    pub fn add_items(
+        &mut self,
+        py: Python<'_>,
+        eids: PyReadonlyArray1<i64>,
+        idxs: PyReadonlyArray1<i64>,
+        xids: PyReadonlyArray1<i64>,
+        n_xids: PyReadonlyArray1<i64>,
+    ) -> (Py<PyArray1<i64>>, Py<PyArray1<i64>>, Py<PyArray1<i64>>) {
+        let eids = eids.as_array();
+        let idxs = idxs.as_array();
+        let xids = xids.as_array();
+        let n_xids = n_xids.as_array();
+        let size = eids.len();
+
+        let mut sidxs = vec![0; size];
+        let mut n_sidxs = vec![-1; size];
+        let mut evicted = vec![];
+
+        for i in 0..size {
+            let n_xid = if n_xids[i] == self._null_idx { None } else { Some(n_xids[i]) };
+            let (item, last_item) = self.add_item(eids[i], idxs[i], xids[i], n_xid);
+
+            sidxs[i] = item.sidx;
+            n_sidxs[i] = item.n_sidx.unwrap_or(-1);
+
+            if let Some(last) = last_item {
+                if !self._ref.has_xid(last.xid) {
+                    evicted.push(last.sidx);
+                }
+
+                if let (Some(n_xid), Some(n_sidx)) = (last.n_xid, last.n_sidx) {
+                    if !self._ref.has_xid(n_xid) {
+                        evicted.push(n_sidx);
+                    }
+                }
+            }
+        }
+
+        (
+            sidxs.to_pyarray(py).to_owned(),
+            n_sidxs.to_pyarray(py).to_owned(),
+            evicted.to_pyarray(py).to_owned(),
+        )
+    }
+
+    // bytes held by the item table and by the reference counts,
+    // and the number of distinct states they refer to
+    pub fn memory_usage(&self) -> (usize, usize, usize) {
+        let items = self._ids.capacity() * std::mem::size_of::<Item>();
+        (items, self._ref.nbytes(), self._ref.n_states())
+    }
+
     pub fn has_xid(&mut self, xid: i64) -> bool {
         self._ref.has_xid(xid)
     }
 
+    pub fn free_sidxs(&self, py: Python<'_>) -> Py<PyArray1<i64>> {
+        self._ref.free_list().to_pyarray(py).to_owned()
+    }
+
+    pub fn last_sidx(&self) -> i64 {
+        self._ref.last_idx()
+    }
+
+    // renumber sidxs into the order their states were seen in.
+    // Returns the old sidx of each new sidx, so state storage can follow.
+    pub fn defragment(&mut self, py: Python<'_>) -> Py<PyArray1<i64>> {
+        let src = self._ref.defragment();
+
+        let mut remap = vec![-1; src.iter().max().map_or(0, |s| s + 1) as usize];
+        for (new, old) in src.iter().enumerate() {
+            remap[*old as usize] = new as i64;
+        }
+
+        for item in self._ids.iter_mut() {
+            if item.eid == self._null_idx {
+                continue;
+            }
+
+            item.sidx = remap[item.sidx as usize];
+            item.n_sidx = item.n_sidx.map(|s| remap[s as usize]);
+        }
+
+        src.to_pyarray(py).to_owned()
+    }
+
+    // rebuild from the arrays given by get_items_by_idx, free_sidxs and last_sidx,
+    // keeping every sidx in place and handing out free sidxs in the same order
+    pub fn restore(
+        &mut self,
+        eids: PyReadonlyArray1<i64>,
+        xids: PyReadonlyArray1<i64>,
+        n_xids: PyReadonlyArray1<i64>,
+        sidxs: PyReadonlyArray1<i64>,
+        n_sidxs: PyReadonlyArray1<i64>,
+        free: PyReadonlyArray1<i64>,
+        last: i64,
+    ) {
+        let eids = eids.as_array();
+        let xids = xids.as_array();
+        let n_xids = n_xids.as_array();
+        let sidxs = sidxs.as_array();
+        let n_sidxs = n_sidxs.as_array();
+
+        self._ref = crate::utils::ref_count::RefCount::new();
+        self._ids = vec![Item::default(self._null_idx); self._max_size];
+
+        for idx in 0..eids.len() {
+            let eid = eids[idx];
+            if eid == self._null_idx {
+                continue;
+            }
+
+            let (n_xid, n_sidx) = if n_sidxs[idx] < 0 {
+                (None, None)
+            } else {
+                (Some(n_xids[idx]), Some(n_sidxs[idx]))
+            };
+
+            self._ref.restore_state(eid, xids[idx], sidxs[idx]);
+            if let (Some(n_xid), Some(n_sidx)) = (n_xid, n_sidx) {
+                self._ref.restore_state(eid, n_xid, n_sidx);
+            }
+
+            self._ids[idx] = Item {
+                idx,
+                eid,
+                xid: xids[idx],
+                sidx: sidxs[idx],
+                n_xid,
+                n_sidx,
+            };
+        }
+
+        self._ref.restore_free_list(free.as_array().to_vec(), last);
+    }
+
+    // reads a pickle of the old layout into the state that the python
+    // MetadataStorage.__getstate__ gives, so it can be restored like any other
+    #[staticmethod]
+    pub fn legacy_state<'py>(state: &PyBytes, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let old: LegacyMetadataStorage = deserialize(state.as_bytes())
+            .map_err(|e| PyValueError::new_err(format!("Could not read legacy MetadataStorage: {e}")))?;
+
+        let size = old._ids.len();
+        let mut eids = vec![0; size];
+        let mut xids = vec![0; size];
+        let mut n_xids = vec![0; size];
+        let mut sidxs = vec![0; size];
+        let mut n_sidxs = vec![0; size];
+
+        for (i, item) in old._ids.iter().enumerate() {
+            eids[i] = item.eid;
+            xids[i] = item.xid;
+            sidxs[i] = item.sidx;
+
+            n_xids[i] = item.n_xid.unwrap_or(old._null_idx);
+            n_sidxs[i] = item.n_sidx.unwrap_or(-1);
+        }
+
+        let d = PyDict::new(py);
+        d.set_item("max_size", old._max_size)?;
+        d.set_item("null_idx", old._null_idx)?;
+        d.set_item("eids", eids.to_pyarray(py))?;
+        d.set_item("xids", xids.to_pyarray(py))?;
+        d.set_item("n_xids", n_xids.to_pyarray(py))?;
+        d.set_item("sidxs", sidxs.to_pyarray(py))?;
+        d.set_item("n_sidxs", n_sidxs.to_pyarray(py))?;
+        d.set_item("free", old._ref.free_list().to_pyarray(py))?;
+        d.set_item("last", old._ref.last_idx())?;
+        Ok(d)
+    }
+
     // enable pickling this data type
     pub fn __setstate__(&mut self, state: &PyBytes) -> PyResult<()> {
         *self = deserialize(state.as_bytes()).unwrap();
@@ -0,0 +1,204 @@
+use std::sync::RwLock;
+use numpy::{PyReadonlyArray1, PyReadwriteArray2};
+use pyo3::{prelude::*, exceptions::{PyIndexError, PyValueError}, types::{PyBytes, PyTuple}};
+use bincode::{deserialize, serialize};
+use serde::{Deserialize, Serialize};
+
+// below this many bytes per gather, spawning threads costs more than it saves
+const PARALLEL_BYTES: usize = 1 << 20;
+
+#[pyclass(module = "rust")]
+#[derive(Serialize, Deserialize)]
+pub struct StateArena {
+    #[pyo3(get)]
+    row_bytes: usize,
+    // one row per sidx plus a trailing zero row, addressed as sidx -1
+    data: RwLock<Vec<u8>>,
+}
+
+#[pymethods]
+impl StateArena {
+    #[new]
+    #[pyo3(signature = (*args))]
+    fn new(args: &PyTuple) -> PyResult<Self> {
+        match args.len() {
+            // loading from pickle
+            0 => Ok(StateArena {
+                row_bytes: 1,
+                data: RwLock::new(vec![0; 1]),
+            }),
+            2 => {
+                let row_bytes = args
+                    .get_item(0)?
+                    .extract::<usize>()?;
+
+                let capacity = args
+                    .get_item(1)?
+                    .extract::<usize>()?;
+
+                if row_bytes == 0 {
+                    return Err(PyValueError::new_err("States must take at least one byte"));
+                }
+
+                Ok(StateArena {
+                    row_bytes,
+                    data: RwLock::new(vec![0; (capacity + 1) * row_bytes]),
+                })
+            },
+            _ => unreachable!(),
+        }
+    }
+
+    #[getter]
+    pub fn capacity(&self) -> usize {
+        let data = self.data.read().expect("");
+        data.len() / self.row_bytes - 1
+    }
+
+    // bytes held by the arena, including rows reserved but not yet used
+    #[getter]
+    pub fn nbytes(&self) -> usize {
+        let data = self.data.read().expect("");
+        data.capacity()
+    }
+
+    pub fn reserve(&self, py: Python<'_>, rows: usize) {
+        py.allow_threads(|| {
+            let mut data = self.data.write().expect("");
+            resize_rows(&mut data, self.row_bytes, rows);
+        });
+    }
+
+    pub fn store(&self, py: Python<'_>, sidx: i64, row: PyReadonlyArray1<u8>) -> PyResult<()> {
+        let row = row.as_slice()?;
+        if row.len() != self.row_bytes {
+            return Err(PyValueError::new_err(format!(
+                "Expected a state of <{}> bytes, got <{}>", self.row_bytes, row.len(),
+            )));
+        }
+
+        py.allow_threads(|| {
+            let mut data = self.data.write().expect("");
+            let rows = data.len() / self.row_bytes - 1;
+            if sidx < 0 || sidx as usize >= rows {
+                return Err(PyIndexError::new_err(format!("Tried to store state outside of arena: <{sidx}>")));
+            }
+
+            let start = sidx as usize * self.row_bytes;
+            data[start..start + self.row_bytes].copy_from_slice(row);
+            Ok(())
+        })
+    }
+
+    pub fn gather(
+        &self,
+        py: Python<'_>,
+        sidxs: PyReadonlyArray1<i64>,
+        mut out: PyReadwriteArray2<u8>,
+    ) -> PyResult<()> {
+        let sidxs = sidxs.as_slice()?;
+        let out = out.as_slice_mut()?;
+
+        py.allow_threads(|| {
+            let data = self.data.read().expect("");
+            gather_rows(&data, self.row_bytes, sidxs, out)
+        })
+    }
+
+    pub fn gather_pair(
+        &self,
+        py: Python<'_>,
+        sidxs: PyReadonlyArray1<i64>,
+        n_sidxs: PyReadonlyArray1<i64>,
+        mut out: PyReadwriteArray2<u8>,
+        mut n_out: PyReadwriteArray2<u8>,
+    ) -> PyResult<()> {
+        let sidxs = sidxs.as_slice()?;
+        let n_sidxs = n_sidxs.as_slice()?;
+        let out = out.as_slice_mut()?;
+        let n_out = n_out.as_slice_mut()?;
+
+        py.allow_threads(|| {
+            // hold a single read lock so both halves see the same arena
+            let data = self.data.read().expect("");
+            gather_rows(&data, self.row_bytes, sidxs, out)?;
+            gather_rows(&data, self.row_bytes, n_sidxs, n_out)
+        })
+    }
+
+    // rewrite the arena so that row i holds what was in row sidxs[i]
+    pub fn permute(&self, py: Python<'_>, sidxs: PyReadonlyArray1<i64>) -> PyResult<()> {
+        let sidxs = sidxs.as_slice()?;
+
+        py.allow_threads(|| {
+            let mut data = self.data.write().expect("");
+            let mut rows = vec![0; sidxs.len() * self.row_bytes];
+            gather_rows(&data, self.row_bytes, sidxs, &mut rows)?;
+            data[..rows.len()].copy_from_slice(&rows);
+            Ok(())
+        })
+    }
+
+    // enable pickling this data type
+    pub fn __setstate__(&mut self, state: &PyBytes) -> PyResult<()> {
+        *self = deserialize(state.as_bytes()).unwrap();
+        Ok(())
+    }
+    pub fn __getstate__<'py>(&self, py: Python<'py>) -> PyResult<&'py PyBytes> {
+        Ok(PyBytes::new(py, &serialize(&self).unwrap()))
+    }
+}
+
+fn resize_rows(data: &mut Vec<u8>, row_bytes: usize, rows: usize) {
+    let old_rows = data.len() / row_bytes - 1;
+    if rows <= old_rows {
+        return;
+    }
+
+    // drop the zero row, then pad with zeros which also re-creates it at the end
+    data.truncate(old_rows * row_bytes);
+    data.resize((rows + 1) * row_bytes, 0);
+}
+
+fn gather_rows(data: &[u8], row_bytes: usize, sidxs: &[i64], out: &mut [u8]) -> PyResult<()> {
+    if out.len() != sidxs.len() * row_bytes {
+        return Err(PyValueError::new_err("Output buffer does not match the number of states"));
+    }
+
+    let rows = (data.len() / row_bytes) as i64;
+    if let Some(bad) = sidxs.iter().find(|s| **s >= rows - 1 || **s < -1) {
+        return Err(PyIndexError::new_err(format!("Tried to load state outside of arena: <{bad}>")));
+    }
+
+    let threads = std::thread::available_parallelism()
+        .map(|n| n.get())
+        .unwrap_or(1)
+        .min(out.len() / PARALLEL_BYTES)
+        .max(1);
+
+    if threads == 1 {
+        copy_rows(data, row_bytes, sidxs, out);
+        return Ok(());
+    }
+
+    let per = (sidxs.len() + threads - 1) / threads;
+    std::thread::scope(|scope| {
+        sidxs.chunks(per)
+            .zip(out.chunks_mut(per * row_bytes))
+            .for_each(|(s, o)| {
+                scope.spawn(move || copy_rows(data, row_bytes, s, o));
+            });
+    });
+
+    Ok(())
+}
+
+fn copy_rows(data: &[u8], row_bytes: usize, sidxs: &[i64], out: &mut [u8]) {
+    let rows = data.len() / row_bytes;
+    sidxs.iter()
+        .zip(out.chunks_exact_mut(row_bytes))
+        .for_each(|(sidx, o)| {
+            let r = if *sidx < 0 { rows - 1 } else { *sidx as usize };
+            o.copy_from_slice(&data[r * row_bytes..(r + 1) * row_bytes]);
+        });
+}
@@ -1,111 +1,179 @@
 use std::collections::BTreeSet;
 
 use hashbrown::HashMap;
-use pyo3::{prelude::*, types::PyBytes};
+use pyo3::{prelude::*, exceptions::PyValueError, types::PyBytes};
 use bincode::{deserialize, serialize};
 use serde::{Deserialize, Serialize};
 
+// marks an unused slot in a ring, and an unused xid in an eid's pair
+const EMPTY: i64 = i64::MIN;
+
+// the null xid always points at the zero state
+const NULL_XID: i64 = i64::MAX;
+const NULL_IDX: i64 = -1;
+
+// how far past the last idx to look for a free one before starting a new run
+const RUN_LOOKAHEAD: i64 = 64;
+
+#[derive(Serialize, Deserialize, Clone, Copy, Default)]
+struct XidRef {
+    idx: i64,
+    refs: u32,
+}
+
 #[pyclass(module = "rust")]
 #[derive(Serialize, Deserialize)]
 pub struct RefCount {
     _i: i64,
-    _eid2xids: HashMap<i64, BTreeSet<i64>>,
-    _refs: HashMap<i64, BTreeSet<i64>>,
-    _avail_idxs: BTreeSet<i64>,
-    _idxs: HashMap<i64, i64>,
+    // each eid refers to at most two xids, its state and its bootstrap state
+    _eid2xids: RingMap<[i64; 2]>,
+    _xids: RingMap<XidRef>,
+    // free idxs to start new runs from. Entries are dropped lazily once taken.
+    _free: Vec<i64>,
+    _is_free: Vec<bool>,
+    // the last idx handed out, the next state goes right after it if possible
+    _last: i64,
 }
 
 #[pymethods]
 impl RefCount {
     #[new]
     pub fn new() -> Self {
-        let mut idxs = HashMap::new();
-        idxs.insert(i64::MAX, -1);
-
         RefCount {
             _i: 0,
-            _eid2xids: HashMap::new(),
-            _refs: HashMap::new(),
-            _avail_idxs: BTreeSet::new(),
-            _idxs: idxs,
+            _eid2xids: RingMap::new(),
+            _xids: RingMap::new(),
+            _free: vec![],
+            _is_free: vec![],
+            _last: -1,
         }
     }
 
     pub fn add_state(&mut self, eid: i64, xid: i64) -> PyResult<i64> {
-        self._eid2xids
-            .entry(eid).or_insert(BTreeSet::new())
-            .insert(xid);
+        let mut xids = self._eid2xids
+            .get(eid)
+            .unwrap_or([EMPTY; 2]);
 
-        self._refs
-            .entry(xid).or_insert(BTreeSet::new())
-            .insert(eid);
+        // the same eid referencing the same xid twice only counts once
+        if xids.contains(&xid) {
+            return Ok(self.load_state(xid));
+        }
+
+        let Some(slot) = xids.iter().position(|x| *x == EMPTY) else {
+            return Err(PyValueError::new_err(format!("eid <{eid}> already refers to two xids")));
+        };
+
+        xids[slot] = xid;
+        self._eid2xids.insert(eid, xids);
 
-        if !self._idxs.contains_key(&xid) {
-            let idx = self._next_free_idx();
-            self._idxs.insert(xid, idx);
+        if let Some(r) = self._xids.get_mut(xid) {
+            r.refs += 1;
+            return Ok(r.idx);
         }
 
-        let idx = *self._idxs.get(&xid).expect("");
+        let idx = self._next_free_idx();
+        self._xids.insert(xid, XidRef { idx, refs: 1 });
         Ok(idx)
     }
 
     pub fn load_state(&mut self, xid: i64) -> i64 {
-        *self._idxs
-            .get(&xid)
+        if xid == NULL_XID {
+            return NULL_IDX;
+        }
+
+        self._xids
+            .get(xid)
             .expect("Tried to load idx for non-existant xid")
+            .idx
     }
 
     pub fn has_xid(&mut self, xid: i64) -> bool {
-        self._idxs.contains_key(&xid)
+        xid == NULL_XID || self._xids.get(xid).is_some()
     }
 
     pub fn remove_transition(&mut self, eid: i64) {
-        if !self._eid2xids.contains_key(&eid) {
+        let Some(xids) = self._eid2xids.remove(eid) else {
             return;
-        }
-
-        let xids = self._eid2xids
-            .remove(&eid)
-            .expect("");
+        };
 
         for xid in xids {
-            // get xid->eids mapping
-            // and remove this eid from set
-            let refs = self._refs
-                .get_mut(&xid)
+            if xid == EMPTY {
+                continue;
+            }
+
+            let r = self._xids
+                .get_mut(xid)
                 .expect("");
 
-            refs.remove(&eid);
+            r.refs -= 1;
 
             // if this xid no longer points to any eids
-            // then remove it and return its idx back
-            // to the pool
-            if refs.len() == 0 {
-                let idx = self._idxs
-                    .get(&xid)
-                    .expect("");
-
-                self._avail_idxs.insert(*idx);
-                self._refs.remove(&xid);
-                self._idxs.remove(&xid);
+            // then give its idx back to the pool
+            if r.refs == 0 {
+                let idx = r.idx;
+                self._xids.remove(xid);
+                self._release(idx);
             }
         }
     }
 
+    // Consecutive states are usually from the same episode, so keep them
+    // in consecutive idxs when possible and start a new run otherwise.
+    // When a buffer wraps, it frees old runs in order just ahead of the last idx.
     fn _next_free_idx(&mut self) -> i64 {
-        let idx: i64;
-        if self._avail_idxs.len() == 0 {
-            self._i += 1;
-            idx = self._i - 1;
+        let next = self._last + 1;
+        let ahead = (next..(next + RUN_LOOKAHEAD).min(self._i))
+            .find(|idx| self._is_free[*idx as usize]);
+
+        let idx = if let Some(idx) = ahead {
+            idx
+        } else if let Some(idx) = self._pop_free() {
+            idx
         } else {
-            idx = self._avail_idxs
-                .pop_first()
-                .expect("Tried to pop from empty set!");
-        }
+            self._i += 1;
+            self._is_free.push(false);
+            self._i - 1
+        };
 
+        self._is_free[idx as usize] = false;
+        self._last = idx;
         idx
     }
 
+    fn _pop_free(&mut self) -> Option<i64> {
+        while let Some(idx) = self._free.pop() {
+            if self._is_free[idx as usize] {
+                return Some(idx);
+            }
+        }
+
+        None
+    }
+
+    fn _release(&mut self, idx: i64) {
+        self._is_free[idx as usize] = true;
+        self._free.push(idx);
+
+        // idxs taken by a run stay in the stack, so prune them before they pile up
+        if self._free.len() > 2 * self._is_free.len() {
+            self._free = self.free_list();
+        }
+    }
+
+    // the number of distinct states currently referenced
+    pub fn n_states(&self) -> usize {
+        self._xids.len()
+    }
+
+    // heap bytes held by the tables, including spare capacity
+    pub fn nbytes(&self) -> usize {
+        std::mem::size_of::<Self>()
+            + self._eid2xids.nbytes()
+            + self._xids.nbytes()
+            + self._free.capacity() * std::mem::size_of::<i64>()
+            + self._is_free.capacity() * std::mem::size_of::<bool>()
+    }
+
     pub fn __setstate__(&mut self, state: &PyBytes) -> PyResult<()> {
         *self = deserialize(state.as_bytes()).unwrap();
         Ok(())
@@ -114,3 +182,353 @@ impl RefCount {
         Ok(PyBytes::new(py, &serialize(&self).unwrap()))
     }
 }
+
+impl RefCount {
+    // record a reference at a known idx, used when restoring from a snapshot
+    pub fn restore_state(&mut self, eid: i64, xid: i64, idx: i64) {
+        let mut xids = self._eid2xids
+            .get(eid)
+            .unwrap_or([EMPTY; 2]);
+
+        if xids.contains(&xid) {
+            return;
+        }
+
+        let slot = xids
+            .iter()
+            .position(|x| *x == EMPTY)
+            .expect("eid already refers to two xids");
+
+        xids[slot] = xid;
+        self._eid2xids.insert(eid, xids);
+
+        match self._xids.get_mut(xid) {
+            Some(r) => r.refs += 1,
+            None => self._xids.insert(xid, XidRef { idx, refs: 1 }),
+        }
+    }
+
+    // the free idxs in the order they will start new runs, last first
+    pub fn free_list(&self) -> Vec<i64> {
+        let mut seen = vec![false; self._is_free.len()];
+        let mut free: Vec<i64> = self._free
+            .iter()
+            .rev()
+            .filter(|idx| {
+                let i = **idx as usize;
+                let keep = self._is_free[i] && !seen[i];
+                seen[i] = true;
+                keep
+            })
+            .copied()
+            .collect();
+
+        free.reverse();
+        free
+    }
+
+    pub fn last_idx(&self) -> i64 {
+        self._last
+    }
+
+    pub fn restore_free_list(&mut self, free: Vec<i64>, last: i64) {
+        let used = self._xids.values().map(|r| r.idx);
+        self._i = used
+            .chain(free.iter().copied())
+            .chain(std::iter::once(last))
+            .max()
+            .map_or(0, |idx| idx + 1);
+
+        self._is_free = vec![false; self._i as usize];
+        for idx in &free {
+            self._is_free[*idx as usize] = true;
+        }
+
+        self._free = free;
+        self._last = last;
+    }
+
+    // Renumbers every live idx so that idxs follow xid order, which is the
+    // order states were seen in, and leaves no free idxs behind.
+    // Returns the old idx of each new idx.
+    pub fn defragment(&mut self) -> Vec<i64> {
+        let mut live: Vec<(i64, i64)> = self._xids
+            .iter_mut()
+            .map(|(xid, r)| (xid, r.idx))
+            .collect();
+
+        live.sort_unstable();
+
+        let mut remap = vec![-1; self._i as usize];
+        for (new, (_, old)) in live.iter().enumerate() {
+            remap[*old as usize] = new as i64;
+        }
+
+        for (_, r) in self._xids.iter_mut() {
+            r.idx = remap[r.idx as usize];
+        }
+
+        let n = live.len();
+        self._i = n as i64;
+        self._last = n as i64 - 1;
+        self._free = vec![];
+        self._is_free = vec![false; n];
+
+        live.into_iter().map(|(_, old)| old).collect()
+    }
+}
+
+// The layout RefCount was pickled in while it kept its tables in trees,
+// only read so that those pickles can still be loaded.
+#[derive(Deserialize)]
+#[allow(dead_code)]
+pub struct LegacyRefCount {
+    _i: i64,
+    _eid2xids: HashMap<i64, BTreeSet<i64>>,
+    _refs: HashMap<i64, BTreeSet<i64>>,
+    _avail_idxs: BTreeSet<i64>,
+    _idxs: HashMap<i64, i64>,
+}
+
+impl LegacyRefCount {
+    // the smallest free idx was handed out first, and free lists are popped from the back
+    pub fn free_list(&self) -> Vec<i64> {
+        self._avail_idxs.iter().rev().copied().collect()
+    }
+
+    pub fn last_idx(&self) -> i64 {
+        self._i - 1
+    }
+}
+
+// A map for keys that are issued in increasing order, like eids and xids.
+// The live keys then fall in a sliding window, so a power-of-two ring indexed
+// by the low bits of the key holds them without any per-entry allocation.
+// Stragglers from long ago that collide with the window spill into a hashmap.
+#[derive(Serialize, Deserialize)]
+struct RingMap<V> {
+    keys: Vec<i64>,
+    vals: Vec<V>,
+    in_ring: usize,
+    spill: HashMap<i64, V>,
+}
+
+impl<V: Copy + Default> RingMap<V> {
+    fn new() -> Self {
+        Self::with_capacity(64)
+    }
+
+    fn with_capacity(cap: usize) -> Self {
+        RingMap {
+            keys: vec![EMPTY; cap],
+            vals: vec![V::default(); cap],
+            in_ring: 0,
+            spill: HashMap::new(),
+        }
+    }
+
+    fn len(&self) -> usize {
+        self.in_ring + self.spill.len()
+    }
+
+    fn nbytes(&self) -> usize {
+        // hashbrown keeps one control byte per bucket next to each entry
+        self.keys.capacity() * std::mem::size_of::<i64>()
+            + self.vals.capacity() * std::mem::size_of::<V>()
+            + self.spill.capacity() * (std::mem::size_of::<(i64, V)>() + 1)
+    }
+
+    fn slot(&self, key: i64) -> usize {
+        (key as u64 as usize) & (self.keys.len() - 1)
+    }
+
+    fn get(&self, key: i64) -> Option<V> {
+        let i = self.slot(key);
+        if self.keys[i] == key {
+            return Some(self.vals[i]);
+        }
+
+        self.spill.get(&key).copied()
+    }
+
+    fn get_mut(&mut self, key: i64) -> Option<&mut V> {
+        let i = self.slot(key);
+        if self.keys[i] == key {
+            return Some(&mut self.vals[i]);
+        }
+
+        self.spill.get_mut(&key)
+    }
+
+    fn insert(&mut self, key: i64, val: V) {
+        if let Some(v) = self.get_mut(key) {
+            *v = val;
+            return;
+        }
+
+        let i = self.slot(key);
+        if self.keys[i] != EMPTY && self.in_ring * 2 >= self.keys.len() {
+            // the window no longer fits, so double the ring instead of spilling
+            self.grow();
+            return self.insert(key, val);
+        }
+
+        self.place(key, val);
+    }
+
+    fn remove(&mut self, key: i64) -> Option<V> {
+        let i = self.slot(key);
+        if self.keys[i] == key {
+            self.keys[i] = EMPTY;
+            self.in_ring -= 1;
+            return Some(self.vals[i]);
+        }
+
+        self.spill.remove(&key)
+    }
+
+    fn iter_mut(&mut self) -> impl Iterator<Item = (i64, &mut V)> {
+        self.keys.iter()
+            .zip(self.vals.iter_mut())
+            .filter(|(k, _)| **k != EMPTY)
+            .map(|(k, v)| (*k, v))
+            .chain(self.spill.iter_mut().map(|(k, v)| (*k, v)))
+    }
+
+    fn values(&self) -> impl Iterator<Item = &V> {
+        self.keys.iter()
+            .zip(self.vals.iter())
+            .filter(|(k, _)| **k != EMPTY)
+            .map(|(_, v)| v)
+            .chain(self.spill.values())
+    }
+
+    fn place(&mut self, key: i64, val: V) {
+        let i = self.slot(key);
+        if self.keys[i] == EMPTY {
+            self.keys[i] = key;
+            self.vals[i] = val;
+            self.in_ring += 1;
+        } else {
+            self.spill.insert(key, val);
+        }
+    }
+
+    fn grow(&mut self) {
+        let mut next = Self::with_capacity(self.keys.len() * 2);
+        for (k, v) in self.keys.iter().zip(self.vals.iter()) {
+            if *k != EMPTY {
+                next.place(*k, *v);
+            }
+        }
+
+        for (k, v) in self.spill.drain() {
+            next.place(k, v);
+        }
+
+        *self = next;
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn ring_map_spills_collisions_while_the_window_is_small() {
+        let mut m: RingMap<i64> = RingMap::with_capacity(8);
+        m.insert(0, 10);
+        m.insert(8, 80);
+
+        // 8 lands on 0's slot, with plenty of room left in the ring
+        assert_eq!(m.keys.len(), 8);
+        assert_eq!(m.in_ring, 1);
+        assert_eq!(m.spill.len(), 1);
+        assert_eq!(m.len(), 2);
+        assert_eq!(m.get(0), Some(10));
+        assert_eq!(m.get(8), Some(80));
+
+        // overwriting a spilled key keeps it in the spill
+        m.insert(8, 81);
+        assert_eq!(m.get(8), Some(81));
+        assert_eq!(m.len(), 2);
+
+        // freeing the ring slot does not hide the spilled key
+        assert_eq!(m.remove(0), Some(10));
+        assert_eq!(m.get(0), None);
+        assert_eq!(m.get(8), Some(81));
+
+        assert_eq!(m.remove(8), Some(81));
+        assert_eq!(m.remove(8), None);
+        assert_eq!(m.len(), 0);
+    }
+
+    #[test]
+    fn ring_map_grows_and_takes_back_the_spill() {
+        let mut m: RingMap<i64> = RingMap::with_capacity(4);
+        m.insert(0, 0);
+        m.insert(4, 40);
+        m.insert(1, 10);
+        assert_eq!(m.spill.len(), 1);
+
+        // the ring is half full, so this collision doubles it instead of spilling
+        m.insert(5, 50);
+        assert_eq!(m.keys.len(), 8);
+        assert_eq!(m.spill.len(), 0);
+        assert_eq!(m.in_ring, 4);
+
+        for k in [0, 1, 4, 5] {
+            assert_eq!(m.get(k), Some(k * 10));
+        }
+        assert_eq!(m.get(2), None);
+    }
+
+    #[test]
+    fn ring_map_follows_a_sliding_window() {
+        let mut m: RingMap<i64> = RingMap::new();
+
+        // keep 100 live keys while 10k pass through
+        for k in 0..10_000 {
+            m.insert(k, -k);
+            if k >= 100 {
+                assert_eq!(m.remove(k - 100), Some(100 - k));
+            }
+        }
+
+        assert_eq!(m.len(), 100);
+        assert_eq!(m.spill.len(), 0);
+        assert!(m.keys.len() <= 256);
+
+        for k in 9_900..10_000 {
+            *m.get_mut(k).unwrap() += 1;
+        }
+
+        let mut vals: Vec<i64> = m.values().copied().collect();
+        vals.sort_unstable();
+        let expected: Vec<i64> = (9_900..10_000).rev().map(|k| 1 - k).collect();
+        assert_eq!(vals, expected);
+    }
+
+    #[test]
+    fn ring_map_keeps_stragglers_across_growth() {
+        let mut m: RingMap<i64> = RingMap::with_capacity(4);
+
+        // an old key that outlives the window, then a window that wraps past it
+        m.insert(0, 0);
+        for k in 1..64 {
+            m.insert(k, k);
+            if k >= 3 {
+                m.remove(k - 2);
+            }
+        }
+
+        assert_eq!(m.get(0), Some(0));
+        assert_eq!(m.get(62), Some(62));
+        assert_eq!(m.get(63), Some(63));
+        assert_eq!(m.len(), 3);
+
+        let mut keys: Vec<i64> = m.iter_mut().map(|(k, _)| k).collect();
+        keys.sort_unstable();
+        assert_eq!(keys, vec![0, 62, 63]);
+    }
+}
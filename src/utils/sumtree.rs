@@ -1,11 +1,32 @@
 use numpy::{ToPyArray, PyArray1, PyReadonlyArray1};
-use ndarray::{s, Array1, Array2, Axis};
+use ndarray::{s, Array1, Array2};
 use std::iter;
 use std::cmp::*;
-use pyo3::{prelude::*, types::{PyBytes, PyTuple}};
+use std::ops::Add;
+use pyo3::{prelude::*, exceptions::PyValueError, types::{PyBytes, PyDict, PyTuple}};
 use bincode::{deserialize, serialize};
 use serde::{Deserialize, Serialize};
 
+// The whole tree lives in one flat heap. Node n keeps all of its dims next to
+// each other at [n * dims, (n + 1) * dims), the root is node 1 and the leaves
+// are nodes total_size..2 * total_size. A walk touches one short run per level,
+// and the top few levels share a handful of cache lines.
+#[derive(Serialize, Deserialize)]
+enum Nodes {
+    F64(Vec<f64>),
+    F32(Vec<f32>),
+}
+
+// runs $body with $x bound to the nodes, whichever precision they are kept in
+macro_rules! on_nodes {
+    ($nodes:expr, $x:ident => $body:expr) => {
+        match $nodes {
+            Nodes::F64($x) => $body,
+            Nodes::F32($x) => $body,
+        }
+    };
+}
+
 #[pyclass(module = "rust")]
 #[derive(Serialize, Deserialize)]
 
@@ -15,6 +36,17 @@ pub struct SumTree {
     #[pyo3(get)]
     dims: usize,
     total_size: u32,
+    nodes: Nodes,
+}
+
+// The layout SumTree was pickled in while each level was its own (dims, width)
+// array, leaves first. Only read so that those pickles can still be loaded.
+#[derive(Deserialize)]
+#[allow(dead_code)]
+struct LegacySumTree {
+    size: u32,
+    dims: usize,
+    total_size: u32,
     raw: Vec<Array2<f64>>,
 }
 
@@ -28,10 +60,10 @@ impl SumTree {
                 size: 0,
                 dims: 0,
                 total_size: 0,
-                raw: vec![],
+                nodes: Nodes::F64(vec![]),
             },
 
-            2 => {
+            2 | 3 => {
                 let size = args
                     .get_item(0).unwrap()
                     .extract::<u32>().unwrap();
@@ -40,23 +72,23 @@ impl SumTree {
                     .get_item(1).unwrap()
                     .extract::<usize>().unwrap();
 
-                let total_size = u32::next_power_of_two(size);
-                let n_layers = u32::ilog2(total_size) + 1;
+                // halves the memory of the tree, for very large buffers
+                let single = args.len() == 3 && args
+                    .get_item(2).unwrap()
+                    .extract::<bool>().unwrap();
 
-                let dummy = Array2::<f64>::zeros((1, 1));
-                let mut layers = vec![dummy; n_layers as usize];
-
-                for i in (0..n_layers).rev() {
-                    let r = n_layers - i - 1;
-                    let layer = Array2::<f64>::zeros((dims, usize::pow(2, i)));
-                    layers[r as usize] = layer;
-                }
+                let total_size = u32::next_power_of_two(size);
+                let n = 2 * total_size as usize * dims;
+                let nodes = match single {
+                    false => Nodes::F64(vec![0.; n]),
+                    true => Nodes::F32(vec![0.; n]),
+                };
 
                 SumTree {
                     size,
                     dims,
                     total_size,
-                    raw: layers,
+                    nodes,
                 }
             },
 
@@ -64,14 +96,48 @@ impl SumTree {
         }
     }
 
+    // true if the tree is kept in f32
+    #[getter]
+    pub fn single(&self) -> bool {
+        matches!(self.nodes, Nodes::F32(_))
+    }
+
     pub fn update(
         &mut self,
         dim: usize,
         idxs: PyReadonlyArray1<i64>,
         values: PyReadonlyArray1<f64>,
     ) {
-        iter::zip(idxs.as_array(), values.as_array())
-            .for_each(|(idx, v)| { self.update_single(dim, *idx, *v) });
+        let idxs = idxs.as_array();
+        let values = values.as_array();
+        if idxs.is_empty() {
+            return;
+        }
+
+        let lo = *idxs.iter().min().unwrap();
+        let hi = *idxs.iter().max().unwrap();
+        if lo < 0 || hi >= self.size as i64 {
+            panic!("Tried to update index outside of tree: <{lo}, {hi}>");
+        }
+
+        // a few scattered indices share little beyond the top of the tree, and
+        // walking each one to the root is cheapest. Once the batch covers its
+        // range densely, recompute that range once per level instead.
+        let (lo, hi) = (lo as usize, hi as usize);
+        let n_layers = u32::ilog2(self.total_size) as usize + 1;
+        if idxs.len() * n_layers < hi - lo + 1 {
+            iter::zip(idxs, values)
+                .for_each(|(idx, v)| { self.update_single(dim, *idx, *v) });
+            return;
+        }
+
+        let (d, t) = (self.dims, self.total_size as usize);
+        on_nodes!(&mut self.nodes, x => {
+            iter::zip(idxs, values)
+                .for_each(|(idx, v)| { x[(t + *idx as usize) * d + dim] = Node::of(*v) });
+
+            resum(x, d, dim, t + lo, t + hi);
+        });
     }
 
     pub fn update_single(
@@ -84,18 +150,12 @@ impl SumTree {
             panic!("Tried to update index outside of tree: <{idx}>");
         }
 
-        let mut sub_idx = idx as usize;
-        let old = self.raw[0][[dim, sub_idx]];
-
-        self.raw.iter_mut()
-            .for_each(|level| {
-                level[[dim, sub_idx]] += value - old;
-                sub_idx = sub_idx / 2;
-            });
+        let (d, t) = (self.dims, self.total_size as usize);
+        on_nodes!(&mut self.nodes, x => update_path(x, d, dim, t + idx as usize, value));
     }
 
     pub fn get_value(&mut self, dim: usize, idx: i64) -> f64 {
-        self.raw[0][[dim, idx as usize]]
+        self.node(idx as usize + self.total_size as usize, dim)
     }
 
     pub fn get_values<'py>(
@@ -104,56 +164,38 @@ impl SumTree {
         idxs: PyReadonlyArray1<i64>,
         py: Python<'py>,
     ) -> &'py PyArray1<f64> {
-        let idxs = idxs.as_array().map(|a| { *a as usize });
-        let arr = self.raw[0]
-            .slice(s![dim, ..])
-            .select(Axis(0), &idxs.to_vec());
+        let t = self.total_size as usize;
+        let arr: Array1<f64> = idxs.as_array()
+            .iter()
+            .map(|idx| self.node(*idx as usize + t, dim))
+            .collect();
 
-            arr.to_pyarray(py)
+        arr.to_pyarray(py)
     }
 
     pub fn dim_total(&mut self, dim: usize) -> f64 {
-        *self.raw
-            .last()
-            .expect("")
-            .get((dim, 0))
-            .expect("")
+        self.node(1, dim)
     }
 
     pub fn all_totals<'py>(
         &mut self,
         py: Python<'py>,
     ) -> &'py PyArray1<f64> {
-        let arr = self.raw
-            .last()
-            .expect("")
-            .slice(s![.., 0]);
-
-        arr.to_pyarray(py)
+        self.totals().to_pyarray(py)
     }
 
     pub fn total(
         &mut self,
         w: PyReadonlyArray1<f64>,
     ) -> f64 {
-        let x = self.raw
-            .last()
-            .expect("")
-            .slice(s![.., 0]);
-
-        w.as_array().dot(&x)
+        w.as_array().dot(&self.totals())
     }
 
     pub fn effective_weights<'py>(
         &mut self,
         py: Python<'py>,
     ) -> &'py PyArray1<f64> {
-        let arr = self.raw
-            .last()
-            .expect("")
-            .slice(s![.., 0]);
-
-        let arr: Array1<f64> = arr.map(safe_invert);
+        let arr: Array1<f64> = self.totals().map(safe_invert);
         arr.to_pyarray(py)
     }
 
@@ -163,31 +205,67 @@ impl SumTree {
         w: PyReadonlyArray1<f64>,
         py: Python<'py>,
     ) -> &'py PyArray1<i64> {
-        let n = v.len();
-
-        let w = w.as_array();
-        let v = v.as_array();
-        let mut totals = Array1::<f64>::zeros(n);
-        let mut idxs = Array1::<i64>::zeros(n);
-
-        self.raw.iter()
-            .rev()
-            .for_each(|layer| {
-                for j in 0..n {
-                    idxs[j] = idxs[j] * 2;
-                    let part = layer.slice(s![.., idxs[j] as usize]);
-                    let left = w.dot(&part);
-
-                    let m = left < (v[j] - totals[j]);
-                    totals[j] += if m { left } else { 0. };
-                    idxs[j] += if m { 1 } else { 0 };
-                }
-            });
+        let w = w.as_array().to_vec();
+        let (d, t) = (self.dims, self.total_size as usize);
+        let last = (self.size - 1) as i64;
+
+        let idxs: Array1<i64> = on_nodes!(&self.nodes, x => {
+            v.as_array()
+                .iter()
+                .map(|v| min(query_weighted(x, d, t, &w, *v) as i64, last))
+                .collect()
+        });
 
-        idxs = idxs.map(|i| { min(*i, (self.size - 1) as i64) });
         idxs.to_pyarray(py)
     }
 
+    // Walks only dim dims[j] for value v[j]. A mixture over dims can pick the dim
+    // of each sample up front, then pay for a single dim instead of collapsing
+    // every node it visits with the mixture weights.
+    pub fn query_dims<'py>(
+        &mut self,
+        v: PyReadonlyArray1<f64>,
+        dims: PyReadonlyArray1<i64>,
+        py: Python<'py>,
+    ) -> &'py PyArray1<i64> {
+        let (d, t) = (self.dims, self.total_size as usize);
+        let last = (self.size - 1) as i64;
+
+        let idxs: Array1<i64> = on_nodes!(&self.nodes, x => {
+            iter::zip(v.as_array(), dims.as_array())
+                .map(|(v, dim)| min(query_dim(x, d, t, *dim as usize, *v) as i64, last))
+                .collect()
+        });
+
+        idxs.to_pyarray(py)
+    }
+
+    // bytes held by all nodes of the tree
+    #[getter]
+    pub fn nbytes(&self) -> usize {
+        on_nodes!(&self.nodes, x => std::mem::size_of_val(&x[..]))
+    }
+
+    // reads a pickle of the old layout into the state that the python
+    // SumTree.__getstate__ gives, so it can be restored like any other
+    #[staticmethod]
+    pub fn legacy_state<'py>(state: &PyBytes, py: Python<'py>) -> PyResult<&'py PyDict> {
+        let old: LegacySumTree = deserialize(state.as_bytes())
+            .map_err(|e| PyValueError::new_err(format!("Could not read legacy SumTree: {e}")))?;
+
+        let leaves = match old.raw.first() {
+            Some(layer) => layer.slice(s![.., ..old.size as usize]).to_owned(),
+            None => Array2::zeros((old.dims, 0)),
+        };
+
+        let d = PyDict::new(py);
+        d.set_item("size", old.size)?;
+        d.set_item("dims", old.dims)?;
+        d.set_item("dtype", "float64")?;
+        d.set_item("leaves", leaves.to_pyarray(py))?;
+        Ok(d)
+    }
+
     // enable pickling this data type
     pub fn __setstate__(&mut self, state: &PyBytes) -> PyResult<()> {
         *self = deserialize(state.as_bytes()).unwrap();
@@ -198,6 +276,118 @@ impl SumTree {
     }
 }
 
+impl SumTree {
+    fn node(&self, n: usize, dim: usize) -> f64 {
+        on_nodes!(&self.nodes, x => x[n * self.dims + dim].f())
+    }
+
+    fn totals(&self) -> Array1<f64> {
+        (0..self.dims).map(|dim| self.node(1, dim)).collect()
+    }
+
+}
+
+// --------------------
+// -- Internal Utils --
+// --------------------
+
+trait Node: Copy + Add<Output = Self> {
+    // f64 sums are exact enough to move whole paths by one delta. f32 ones
+    // would drift, so each write re-sums its path from the siblings instead.
+    const RESUM: bool;
+
+    fn of(x: f64) -> Self;
+    fn f(self) -> f64;
+}
+
+impl Node for f64 {
+    const RESUM: bool = false;
+
+    fn of(x: f64) -> Self { x }
+    fn f(self) -> f64 { self }
+}
+
+impl Node for f32 {
+    const RESUM: bool = true;
+
+    fn of(x: f64) -> Self { x as f32 }
+    fn f(self) -> f64 { self as f64 }
+}
+
+// sets leaf node n and brings every ancestor up to date
+fn update_path<T: Node>(x: &mut [T], dims: usize, dim: usize, n: usize, value: f64) {
+    let mut n = n;
+    let old = x[n * dims + dim];
+    let mut s = T::of(value);
+    x[n * dims + dim] = s;
+
+    if T::RESUM {
+        // the running sum stays in a register, so only the siblings are read
+        while n > 1 {
+            s = s + x[(n ^ 1) * dims + dim];
+            n /= 2;
+            x[n * dims + dim] = s;
+        }
+    } else {
+        let delta = T::of(value - old.f());
+        while n > 1 {
+            n /= 2;
+            x[n * dims + dim] = x[n * dims + dim] + delta;
+        }
+    }
+}
+
+// the leaf that the weighted prefix sum v falls in, counted from the first leaf
+fn query_weighted<T: Node>(x: &[T], dims: usize, t: usize, w: &[f64], v: f64) -> usize {
+    let mut n = 1;
+    let mut total = 0.;
+
+    while n < t {
+        n *= 2;
+        let left: f64 = iter::zip(&x[n * dims..(n + 1) * dims], w)
+            .map(|(a, b)| a.f() * b)
+            .sum();
+
+        if left < v - total {
+            total += left;
+            n += 1;
+        }
+    }
+
+    n - t
+}
+
+fn query_dim<T: Node>(x: &[T], dims: usize, t: usize, dim: usize, v: f64) -> usize {
+    let mut n = 1;
+    let mut total = 0.;
+
+    while n < t {
+        n *= 2;
+        let left = x[n * dims + dim].f();
+
+        if left < v - total {
+            total += left;
+            n += 1;
+        }
+    }
+
+    n - t
+}
+
+// recomputes every ancestor of the nodes in [lo, hi] from its children
+fn resum<T: Node>(x: &mut [T], dims: usize, dim: usize, lo: usize, hi: usize) {
+    let (mut lo, mut hi) = (lo, hi);
+
+    while hi > 1 {
+        lo /= 2;
+        hi /= 2;
+
+        for p in lo..=hi {
+            x[p * dims + dim] = x[2 * p * dims + dim] + x[(2 * p + 1) * dims + dim];
+        }
+    }
+}
+
 fn safe_invert(a: &f64) -> f64 {
     if *a == 0. {
         0.
@@ -205,3 +395,91 @@ fn safe_invert(a: &f64) -> f64 {
         1. / *a
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const SIZE: usize = 16;
+    const DIMS: usize = 3;
+
+    // every parent in dim is exactly the sum of its children
+    fn assert_consistent<T: Node + PartialEq + std::fmt::Debug>(x: &[T], dim: usize) {
+        for p in 1..SIZE {
+            assert_eq!(x[p * DIMS + dim], x[2 * p * DIMS + dim] + x[(2 * p + 1) * DIMS + dim], "node {p}");
+        }
+    }
+
+    fn set_leaves<T: Node>(x: &mut [T], dim: usize, lo: usize, hi: usize, f: impl Fn(usize) -> f64) {
+        for i in lo..=hi {
+            x[(SIZE + i) * DIMS + dim] = T::of(f(i));
+        }
+    }
+
+    #[test]
+    fn resum_recomputes_every_ancestor_of_the_range() {
+        let mut x = vec![0.; 2 * SIZE * DIMS];
+
+        for (lo, hi) in [(0, 0), (3, 9), (7, 8), (15, 15), (0, 15)] {
+            set_leaves(&mut x, 1, lo, hi, |i| (i * lo + hi) as f64);
+            resum(&mut x, DIMS, 1, SIZE + lo, SIZE + hi);
+            assert_consistent(&x, 1);
+        }
+
+        let leaves: f64 = (0..SIZE).map(|i| x[(SIZE + i) * DIMS + 1]).sum();
+        assert_eq!(x[DIMS + 1], leaves);
+
+        // other dims are left alone
+        assert!(x.iter().enumerate().all(|(i, v)| i % DIMS == 1 || *v == 0.));
+    }
+
+    #[test]
+    fn resum_agrees_with_walking_each_path() {
+        let mut walked = vec![0.; 2 * SIZE * DIMS];
+        let mut resummed = vec![0.; 2 * SIZE * DIMS];
+
+        for (lo, hi) in [(2, 5), (0, 15), (9, 9), (4, 12)] {
+            let f = |i: usize| ((3 * i + lo) % 7) as f64;
+            for i in lo..=hi {
+                update_path(&mut walked, DIMS, 2, SIZE + i, f(i));
+            }
+
+            set_leaves(&mut resummed, 2, lo, hi, f);
+            resum(&mut resummed, DIMS, 2, SIZE + lo, SIZE + hi);
+            assert_eq!(walked, resummed);
+        }
+    }
+
+    #[test]
+    fn f32_paths_are_resummed_not_shifted() {
+        let mut x = vec![0f32; 2 * SIZE * DIMS];
+
+        // deltas in f32 would leave the parents off by a rounding error or two
+        for step in 0..1000 {
+            let i = (step * 7) % SIZE;
+            update_path(&mut x, DIMS, 0, SIZE + i, 0.1 + (step % 13) as f64 / 3.);
+            assert_consistent(&x, 0);
+        }
+
+        set_leaves(&mut x, 0, 5, 11, |i| 1. / (i + 1) as f64);
+        resum(&mut x, DIMS, 0, SIZE + 5, SIZE + 11);
+        assert_consistent(&x, 0);
+    }
+
+    #[test]
+    fn query_dim_finds_the_leaf_holding_each_prefix_sum() {
+        let mut x = vec![0.; 2 * SIZE * DIMS];
+        set_leaves(&mut x, 1, 0, SIZE - 1, |i| if i % 3 == 0 { 0. } else { i as f64 });
+        resum(&mut x, DIMS, 1, SIZE, 2 * SIZE - 1);
+
+        let mut start = 0.;
+        for i in 0..SIZE {
+            let v = x[(SIZE + i) * DIMS + 1];
+            if v > 0. {
+                assert_eq!(query_dim(&x, DIMS, SIZE, 1, start + v / 2.), i);
+                assert_eq!(query_dim(&x, DIMS, SIZE, 1, start + v), i);
+            }
+            start += v;
+        }
+    }
+}
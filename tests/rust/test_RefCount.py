@@ -1,4 +1,6 @@
-from typing import Any
+import pytest
+import numpy as np
+from typing import Any, List
 import ReplayTables.rust as ru
 
 def test_add_and_load():
@@ -50,3 +52,73 @@ def test_remove_transition():
     xid1 = 26
     idx = r.add_state(eid, xid1)
     assert idx == 0
+
+def test_repeated_xid():
+    r = ru.RefCount()
+    eid: Any = 0
+    xid: Any = 0
+
+    # an eid referencing the same xid twice holds a single reference
+    assert r.add_state(eid, xid) == 0
+    assert r.add_state(eid, xid) == 0
+
+    r.remove_transition(eid)
+    assert not r.has_xid(xid)
+
+def test_too_many_xids():
+    r = ru.RefCount()
+    eid: Any = 0
+
+    r.add_state(eid, 0)
+    r.add_state(eid, 1)
+    with pytest.raises(ValueError):
+        r.add_state(eid, 2)
+
+def test_sliding_window():
+    r = ru.RefCount()
+    window = 1000
+    straggler = 5
+
+    for eid in range(50_000):
+        old = eid - window
+        if old >= 0 and old != straggler:
+            r.remove_transition(old)
+
+        r.add_state(eid, eid)
+        r.add_state(eid, eid + 1)
+
+    # an old transition that is never evicted keeps its states
+    assert r.has_xid(straggler) and r.has_xid(straggler + 1)
+    assert not r.has_xid(straggler + 2)
+
+    # idxs are recycled, so they stay bounded by the number of live states
+    assert r.load_state(50_000) <= window + 3
+    assert r.load_state(straggler) == straggler
+
+def test_episodes_stay_contiguous():
+    r = ru.RefCount()
+    rng = np.random.default_rng(0)
+    size = 1000
+
+    # a circular buffer of lag-1 transitions, with episodes of random length
+    slots: List[Any] = [None] * size
+    xid = 0
+    ep_end = rng.integers(1, 50)
+    for eid in range(20_000):
+        if slots[eid % size] is not None:
+            r.remove_transition(slots[eid % size])
+
+        slots[eid % size] = eid
+        r.add_state(eid, xid)
+        if eid == ep_end:
+            ep_end += rng.integers(1, 50)
+            xid += 2
+        else:
+            r.add_state(eid, xid + 1)
+            xid += 1
+
+    # after many wraps, states that were seen one after the other still sit side by side
+    live = [x for x in range(xid - 2 * size, xid + 1) if r.has_xid(x)]
+    sidxs = np.array([r.load_state(x) for x in live])
+    adjacent = np.mean(np.diff(sidxs) == 1)
+    assert adjacent > 0.9
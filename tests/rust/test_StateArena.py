@@ -0,0 +1,96 @@
+import pytest
+import threading
+import numpy as np
+from typing import Any
+import ReplayTables.rust as ru
+
+def test_store_and_gather():
+    arena = ru.StateArena(4, 10)
+    assert arena.row_bytes == 4
+    assert arena.capacity == 10
+
+    for i in range(10):
+        sidx: Any = i
+        arena.store(sidx, np.full(4, i, dtype=np.uint8))
+
+    sidxs: Any = np.array([3, 7, -1, 0], dtype=np.int64)
+    out = np.empty((4, 4), dtype=np.uint8)
+    arena.gather(sidxs, out)
+
+    assert np.all(out[:, 0] == [3, 7, 0, 0])
+    assert np.all(out == out[:, :1])
+
+def test_gather_pair():
+    arena = ru.StateArena(2, 5)
+    for i in range(5):
+        sidx: Any = i
+        arena.store(sidx, np.array([i, 2 * i], dtype=np.uint8))
+
+    sidxs: Any = np.array([0, 1, 2], dtype=np.int64)
+    n_sidxs: Any = np.array([1, 2, -1], dtype=np.int64)
+    out = np.empty((3, 2), dtype=np.uint8)
+    n_out = np.empty((3, 2), dtype=np.uint8)
+    arena.gather_pair(sidxs, n_sidxs, out, n_out)
+
+    assert np.all(out == [[0, 0], [1, 2], [2, 4]])
+    assert np.all(n_out == [[1, 2], [2, 4], [0, 0]])
+
+def test_reserve_keeps_states():
+    arena = ru.StateArena(3, 2)
+    sidx: Any = 1
+    arena.store(sidx, np.array([1, 2, 3], dtype=np.uint8))
+
+    arena.reserve(100)
+    assert arena.capacity == 100
+
+    sidxs: Any = np.array([1, -1], dtype=np.int64)
+    out = np.empty((2, 3), dtype=np.uint8)
+    arena.gather(sidxs, out)
+    assert np.all(out == [[1, 2, 3], [0, 0, 0]])
+
+def test_out_of_bounds():
+    arena = ru.StateArena(1, 2)
+    sidx: Any = 2
+    with pytest.raises(IndexError):
+        arena.store(sidx, np.zeros(1, dtype=np.uint8))
+
+    sidxs: Any = np.array([5], dtype=np.int64)
+    with pytest.raises(IndexError):
+        arena.gather(sidxs, np.empty((1, 1), dtype=np.uint8))
+
+def test_pickle():
+    arena = ru.StateArena(4, 10)
+    sidx: Any = 3
+    arena.store(sidx, np.arange(4, dtype=np.uint8))
+
+    got = ru.StateArena()
+    got.__setstate__(arena.__getstate__())
+
+    sidxs: Any = np.array([3], dtype=np.int64)
+    out = np.empty((1, 4), dtype=np.uint8)
+    got.gather(sidxs, out)
+    assert np.all(out == np.arange(4))
+
+def test_gather_while_storing():
+    # large rows so gathers are split across threads and run outside of the GIL
+    arena = ru.StateArena(1 << 16, 64)
+    for i in range(64):
+        sidx: Any = i
+        arena.store(sidx, np.full(1 << 16, i, dtype=np.uint8))
+
+    def writer():
+        for _ in range(20):
+            for i in range(32, 64):
+                sidx: Any = i
+                arena.store(sidx, np.full(1 << 16, i, dtype=np.uint8))
+
+    t = threading.Thread(target=writer)
+    t.start()
+
+    sidxs: Any = np.arange(64, dtype=np.int64)
+    out = np.empty((64, 1 << 16), dtype=np.uint8)
+    for _ in range(20):
+        arena.gather(sidxs, out)
+        assert np.all(out == np.arange(64, dtype=np.uint8)[:, None])
+
+    t.join()
@@ -1,8 +1,12 @@
+import pytest
 import numpy as np
 from typing import cast, Any
 from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.tools import max_states, take_into
 from ReplayTables.interface import LaggedTimestep, EID, XID
 
+from tests._utils.fake_data import fake_lagged_timestep
+
 def test_inferred_types1():
     storage = BasicStorage(10)
 
@@ -54,3 +58,143 @@ def test_inferred_types2():
     assert storage._state_store.dtype == np.float32
     assert storage._state_store.shape == (11, 15)
     assert storage._a.dtype == np.int32
+
+def test_reserve():
+    storage = BasicStorage(10)
+
+    # reserving before the first add sizes the initial allocation
+    storage.reserve(15)
+    idx: Any = 0
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1))
+    assert storage._state_store.shape == (16, 8)
+
+    # reserving after the first add keeps the stored states
+    storage.reserve(20)
+    assert storage._state_store.shape == (21, 8)
+    assert np.all(storage._state_store[-1] == 0)
+
+    idxs: Any = np.array([0], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.x == 0)
+
+    # can never shrink
+    storage.reserve(5)
+    assert storage._state_store.shape == (21, 8)
+
+def test_grows_geometrically():
+    storage = BasicStorage(100)
+
+    # every transition is its own episode, so it owns two states
+    allocations = set()
+    for i in range(100):
+        idx: Any = i
+        x = np.full(8, i)
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=2 * i, n_xid=2 * i + 1, x=x, n_x=x + 1))
+        allocations.add(id(storage._state_store))
+
+    assert storage._state_store.shape == (201, 8)
+    assert len(allocations) <= 3
+
+    idxs: Any = np.arange(100, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.x[:, 0] == np.arange(100))
+    assert np.all(batch.xp[:, 0] == np.arange(100) + 1)
+
+def test_max_states():
+    assert max_states(100) == 200
+
+def test_take_into():
+    src = np.arange(10) * 10
+    out = np.empty(3, dtype=src.dtype)
+
+    take_into(src, np.array([0, 9, 4]), out)
+    assert out.tolist() == [0, 90, 40]
+
+    # -1 is only allowed where it stands for the last row
+    take_into(src, np.array([-1, 2, -1]), out, minus_one_is_last=True)
+    assert out.tolist() == [90, 20, 90]
+
+    for idxs in [[0, 10, 1], [-1, 0, 1]]:
+        with pytest.raises(IndexError):
+            take_into(src, np.array(idxs), out)
+
+    for idxs in [[0, 10, 1], [-2, 0, 1]]:
+        with pytest.raises(IndexError):
+            take_into(src, np.array(idxs), out, minus_one_is_last=True)
+
+def test_extras():
+    storage = BasicStorage(10)
+
+    for i in range(10):
+        idx: Any = i
+        extra = {'logp': -i / 10, 'goal': np.full(2, i)}
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, extra=extra))
+
+    assert storage._extras['logp'].dtype == np.float_
+    assert storage._extras['goal'].shape == (10, 2)
+
+    idxs: Any = np.array([1, 4, 7], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert batch.extra is not None
+    assert np.allclose(batch.extra['logp'], [-0.1, -0.4, -0.7])
+    assert np.all(batch.extra['goal'] == [[1, 1], [4, 4], [7, 7]])
+
+    idx = 3
+    got = storage.get_item(idx)
+    assert got.extra['logp'] == -0.3
+
+    # keys missing from a transition are left empty
+    idx = 4
+    storage.add(idx, fake_lagged_timestep(eid=14, xid=14, n_xid=15, extra={'goal': np.full(2, 4)}))
+    got = storage.get_item(idx)
+    assert np.isnan(got.extra['logp'])
+    assert len(storage) == 10
+
+def test_extras_are_not_truncated():
+    storage = BasicStorage(10)
+
+    idx: Any = 0
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1, extra={'v': 0, 'name': 'ab'}))
+    idx = 1
+    storage.add(idx, fake_lagged_timestep(eid=1, xid=1, n_xid=2, extra={'v': -0.3, 'name': 'abcdef'}))
+    idx = 2
+    storage.add(idx, fake_lagged_timestep(eid=2, xid=2, n_xid=3, extra={'v': 7.9}))
+
+    idxs: Any = np.arange(3, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert batch.extra is not None
+    assert np.allclose(batch.extra['v'], [0, -0.3, 7.9])
+    assert batch.extra['name'].tolist() == ['ab', 'abcdef', None]
+
+@pytest.mark.parametrize('declared, extra', [
+    (((), np.int32), {'k': 0.5}),
+    (((), np.uint8), {'k': 300}),
+    (((), np.bool_), {'k': 1}),
+    (((2, ), np.float_), {'k': np.zeros(3)}),
+    (((), np.int32), {}),
+])
+def test_extras_that_do_not_fit(declared, extra):
+    storage = BasicStorage(10)
+    shape, dtype = declared
+    storage.declare_extra('k', shape, dtype)
+
+    idx: Any = 0
+    with pytest.raises(ValueError):
+        storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1, extra=extra))
+
+    # nothing was written
+    assert len(storage) == 0
+    assert not storage.meta.has_xid(cast(XID, 0))
+
+def test_declare_extra():
+    storage = BasicStorage(10)
+    storage.declare_extra('mask', shape=(3, ), dtype=np.bool_)
+
+    idx: Any = 0
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1, extra={'mask': [True, False, True]}))
+
+    idxs: Any = np.array([0], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert batch.extra is not None
+    assert batch.extra['mask'].dtype == np.bool_
+    assert np.all(batch.extra['mask'] == [[True, False, True]])
@@ -0,0 +1,211 @@
+import time
+import pickle
+import pytest
+import numpy as np
+from typing import Any
+from ReplayTables.storage.CompressedStorage import CompressedStorage
+from ReplayTables.storage.Codecs import BitShuffle, ByteShuffle, Codec, Delta, LZ4, Zlib
+
+from tests._utils.fake_data import fake_lagged_timestep
+
+CODECS = {
+    'lz4': lambda: Codec(),
+    'zlib': lambda: Codec(compressor=Zlib()),
+    'byteshuffle+lz4': lambda: Codec([ByteShuffle()]),
+    'bitshuffle+lz4': lambda: Codec([BitShuffle()]),
+    'delta+byteshuffle+zlib': lambda: Codec([Delta(), ByteShuffle()], Zlib()),
+    'delta+bitshuffle+lz4': lambda: Codec([Delta(), BitShuffle()], LZ4()),
+}
+
+def frames(n: int, shape=(4, 32, 32)):
+    # stacked frames of normalized pixels: a textured background and a small moving object
+    rng = np.random.default_rng(0)
+    h, w = shape[1:]
+    background = rng.integers(0, 256, size=(h, w)) / np.float32(255)
+    steps = np.repeat(background[None], n + shape[0], axis=0)
+    for i in range(n + shape[0]):
+        r, c = (i * 3) % (h - 4), (i * 5) % (w - 4)
+        steps[i, r:r + 4, c:c + 4] = 1.
+
+    return np.stack([steps[i:i + shape[0]] for i in range(n + 1)]).astype(np.float32)
+
+def fill(storage: CompressedStorage, n: int, shape=(16, 16)):
+    rng = np.random.default_rng(0)
+    xs = rng.integers(0, 255, size=(n + 1, ) + shape, dtype=np.uint8)
+    for i in range(n):
+        idx: Any = i
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=xs[i], n_x=xs[i + 1]))
+
+    return xs
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch_decode(workers: int):
+    storage = CompressedStorage(512, decode_workers=workers)
+    xs = fill(storage, 512)
+
+    rng = np.random.default_rng(1)
+    idxs: Any = rng.integers(0, 512, size=300)
+    batch = storage.get(idxs)
+
+    assert batch.x.dtype == np.uint8
+    assert batch.x.shape == (300, 16, 16)
+    assert np.all(batch.x == xs[idxs])
+    assert np.all(batch.xp == xs[idxs + 1])
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch_decode_into_strided_out(workers: int):
+    storage = CompressedStorage(512, decode_workers=workers)
+    xs = fill(storage, 512)
+    storage.flush()
+
+    # a view that reshape would have to copy
+    out = storage.empty_batch(300)
+    out = out._replace(x=np.zeros((300, 32, 16), dtype=np.uint8)[:, ::2])
+
+    rng = np.random.default_rng(1)
+    idxs: Any = rng.integers(0, 512, size=300)
+    batch = storage.get(idxs, out=out)
+
+    assert batch.x is out.x
+    assert np.all(out.x == xs[idxs])
+    assert np.all(batch.xp == xs[idxs + 1])
+
+def test_batch_decode_after_pickle():
+    storage = CompressedStorage(128, decode_workers=2)
+    xs = fill(storage, 128)
+
+    storage = pickle.loads(pickle.dumps(storage))
+    idxs: Any = np.arange(128, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.x == xs[:128])
+
+def test_decoded_cache():
+    storage = CompressedStorage(128, decode_workers=1, cache_bytes=16 * 16 * 16)
+    xs = fill(storage, 128)
+    storage.flush()
+
+    idxs: Any = np.arange(8, dtype=np.int64)
+    assert np.all(storage.get(idxs).x == xs[:8])
+    assert np.all(storage.get(idxs).x == xs[:8])
+
+    stats = storage.cache_stats()
+    assert stats['entries'] <= 16 and stats['bytes'] <= 16 * 16 * 16
+    assert stats['hits'] >= 8 and 0 < stats['hit_rate'] < 1
+
+    # overwriting a state drops its decoded copy
+    storage.add(idxs[0], fake_lagged_timestep(eid=500, xid=500, n_xid=501, x=xs[9], n_x=xs[10]))
+    batch = storage.get(idxs)
+    assert np.all(batch.x[0] == xs[9]) and np.all(batch.xp[0] == xs[10])
+    assert np.all(batch.x[1:] == xs[1:8])
+
+    # the budget survives a round trip, the decoded states do not
+    storage = pickle.loads(pickle.dumps(storage))
+    assert storage.cache_stats()['entries'] == 0
+    assert np.all(storage.get(idxs).x[1:] == xs[1:8])
+    assert storage.memory_usage()['decoded_cache'] > 0
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_codecs(codec: str):
+    storage = CompressedStorage(64, decode_workers=2, codec=CODECS[codec]())
+    xs = frames(64)
+    for i in range(64):
+        idx: Any = i
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=xs[i], n_x=xs[i + 1]))
+
+    storage = pickle.loads(pickle.dumps(storage))
+    idxs: Any = np.arange(64, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert batch.x.dtype == np.float32
+    assert np.array_equal(batch.x, xs[:64]) and np.array_equal(batch.xp, xs[1:])
+    assert np.array_equal(storage.get(idxs[:3]).x, xs[:3])
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.int16, np.float64, np.bool_])
+def test_filters_round_trip(dtype):
+    rng = np.random.default_rng(0)
+    x = (rng.random((3, 5, 7)) * 100).astype(dtype)
+    for filters in [[ByteShuffle()], [BitShuffle()], [Delta(axis=1)], [Delta(), BitShuffle()]]:
+        codec = Codec(filters)
+        codec.build(x.dtype, x.shape)
+        got = codec.decode(codec.encode(x))
+        assert got.dtype == x.dtype and np.array_equal(got, x)
+
+class SlowLZ4(LZ4):
+    def compress(self, data: Any) -> bytes:
+        time.sleep(1e-3)
+        return super().compress(data)
+
+def test_compression_backpressure():
+    storage = CompressedStorage(
+        256, decode_workers=1, codec=Codec(compressor=SlowLZ4()),
+        compress_workers=2, max_pending=16, compress_batch=4,
+    )
+
+    # overwrite the same idxs many times while compression lags behind
+    rng = np.random.default_rng(0)
+    xs = rng.integers(0, 255, size=(201, 16, 16), dtype=np.uint8)
+    for i in range(200):
+        idx: Any = i % 50
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=xs[i], n_x=xs[i + 1]))
+        assert storage.compression_stats()['queue_depth'] <= 16
+
+    # pending states are served before their blobs exist, and stale blobs never win
+    idxs: Any = np.arange(50, dtype=np.int64)
+    assert np.all(storage.get(idxs).x == xs[150:200])
+
+    storage.flush()
+    stats = storage.compression_stats()
+    assert stats['queue_depth'] == 0
+    assert stats['compressed'] >= 200 and stats['blocked'] > 0 and stats['latency_max'] >= stats['latency_mean'] > 0
+    assert np.all(storage.get(idxs).x == xs[150:200])
+    assert np.all(storage.get(idxs).xp == xs[151:201])
+
+# ------------------------------
+# -- Performance Benchmarking --
+# ------------------------------
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_decode_256(benchmark, workers: int):
+    benchmark.name = f'workers={workers}'
+    benchmark.group = 'storage | compressed decode'
+
+    storage = CompressedStorage(1024, decode_workers=workers)
+    fill(storage, 1024, shape=(84, 84, 4))
+
+    rng = np.random.default_rng(1)
+    idxs: Any = rng.integers(0, 1024, size=256)
+    benchmark(storage.get, idxs)
+
+@pytest.mark.parametrize('cache', [0, 64])
+def test_skewed_decode_256(benchmark, cache: int):
+    benchmark.name = f'cache={cache}MB'
+    benchmark.group = 'storage | compressed skewed decode'
+
+    storage = CompressedStorage(1024, decode_workers=1, cache_bytes=cache * 2**20)
+    fill(storage, 1024, shape=(84, 84, 4))
+
+    rng = np.random.default_rng(1)
+    def _inner():
+        idxs: Any = np.minimum(rng.geometric(1e-2, size=256) - 1, 1023).astype(np.int64)
+        storage.get(idxs)
+
+    benchmark(_inner)
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_codec_256(benchmark, codec: str):
+    benchmark.name = codec
+    benchmark.group = 'storage | compressed codecs'
+
+    storage = CompressedStorage(256, decode_workers=1, codec=CODECS[codec]())
+    xs = frames(256, shape=(4, 84, 84))
+
+    def _inner():
+        for i in range(256):
+            idx: Any = i
+            storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=xs[i], n_x=xs[i + 1]))
+
+        storage.get(np.arange(256, dtype=np.int64))
+
+    benchmark(_inner)
+
+    used, _ = storage._state_memory()
+    benchmark.extra_info['ratio'] = storage.meta.n_states() * xs[0].nbytes / used
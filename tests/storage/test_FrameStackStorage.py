@@ -0,0 +1,98 @@
+import numpy as np
+from typing import Any
+from ReplayTables.ingress.LagBuffer import LagBuffer
+from ReplayTables.interface import Timestep
+from ReplayTables.storage.FrameStackStorage import FrameStackStorage
+
+from tests._utils.fake_data import lags_to_batch
+
+class AtariStream:
+    def __init__(self, k: int, stack_axis: int = 0):
+        self._k = k
+        self._axis = stack_axis
+        self._rng = np.random.default_rng(0)
+        self._frames: list[np.ndarray] = []
+
+    def _frame(self):
+        return self._rng.integers(1, 255, size=(6, 6), dtype=np.uint8)
+
+    def reset(self):
+        # like gym's FrameStack, the first frame is repeated to fill the stack
+        f = self._frame()
+        self._frames = [f] * self._k
+        return self._stack()
+
+    def step(self):
+        self._frames = self._frames[1:] + [self._frame()]
+        return self._stack()
+
+    def _stack(self):
+        return np.stack(self._frames, axis=self._axis)
+
+
+def run(storage: FrameStackStorage, lag: int, stream: AtariStream, steps: int, ep_len: int):
+    lag_buffer = LagBuffer(lag)
+    added = []
+
+    x = stream.reset()
+    t = 0
+    for _ in range(steps):
+        t += 1
+        term = t == ep_len
+        r = None if t == 1 else 1.0
+        exps = lag_buffer.add(Timestep(x=x, a=0, r=r, gamma=0.99, terminal=False))
+
+        for exp in exps:
+            idx: Any = exp.eid % storage.max_size
+            storage.add(idx, exp)
+            added.append(exp)
+
+        if term:
+            # soft termination so the final state is kept for bootstrapping
+            exps = lag_buffer.add(Timestep(x=stream.step(), a=0, r=1.0, gamma=0.99, terminal=True))
+            for exp in exps:
+                idx = exp.eid % storage.max_size
+                storage.add(idx, exp)
+                added.append(exp)
+
+            x = stream.reset()
+            t = 0
+        else:
+            x = stream.step()
+
+    return added[-storage.max_size:]
+
+
+def check(storage: FrameStackStorage, added):
+    expected = lags_to_batch(added)
+    eids: Any = expected.eid
+    got = storage.get(eids % storage.max_size)
+
+    assert got.x.shape == expected.x.shape
+    assert np.all(got.x == expected.x)
+    assert np.all(got.xp == expected.xp)
+
+
+def test_shares_frames():
+    storage = FrameStackStorage(50)
+    added = run(storage, lag=1, stream=AtariStream(4), steps=200, ep_len=1000)
+    check(storage, added)
+
+    # each state adds a single frame once the stack is full
+    assert storage._n_frames - len(storage._free_frames) <= 51 + 4
+
+def test_episode_boundaries():
+    for lag in [1, 3]:
+        storage = FrameStackStorage(50)
+        added = run(storage, lag=lag, stream=AtariStream(4), steps=300, ep_len=7)
+        check(storage, added)
+
+def test_channels_last():
+    storage = FrameStackStorage(30, stack_axis=-1)
+    added = run(storage, lag=2, stream=AtariStream(4, stack_axis=-1), steps=100, ep_len=11)
+    check(storage, added)
+
+    idx: Any = added[-1].eid % 30
+    got = storage.get_item(idx)
+    assert got.x.shape == (6, 6, 4)
+    assert np.all(got.x == added[-1].x)
@@ -0,0 +1,60 @@
+import pickle
+import numpy as np
+from typing import Any
+from ReplayTables.storage.MemmapStorage import MemmapStorage
+
+from tests._utils.fake_data import fake_lagged_timestep
+
+def test_sized_from_first_state(tmp_path):
+    path = str(tmp_path / 'states.dat')
+    storage = MemmapStorage(10, path=path)
+
+    x = np.ones((4, 4), dtype=np.uint8)
+    idx: Any = 0
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1, x=x, n_x=2 * x))
+
+    assert isinstance(storage._state_store, np.memmap)
+    assert storage._state_store.dtype == np.uint8
+    assert storage._state_store.shape == (21, 4, 4)
+    assert np.all(storage._state_store[-1] == 0)
+
+    idxs: Any = np.array([0], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert type(batch.x) is np.ndarray
+    assert np.all(batch.x == 1)
+    assert np.all(batch.xp == 2)
+
+def test_pickle_reopens_file(tmp_path):
+    path = str(tmp_path / 'states.dat')
+    storage = MemmapStorage(10, path=path)
+
+    for i in range(5):
+        idx: Any = i
+        x = np.full((32, 32), i, dtype=np.float32)
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=x, n_x=x + 1))
+
+    # the states live in the file, not the pickle
+    byt = pickle.dumps(storage)
+    assert len(byt) < storage._state_store.nbytes
+
+    got = pickle.loads(byt)
+    assert isinstance(got._state_store, np.memmap)
+    assert got._state_store.filename == storage._state_store.filename
+
+    idxs: Any = np.arange(5, dtype=np.int64)
+    assert np.all(got.get(idxs).x == storage.get(idxs).x)
+
+def test_pickle_anonymous_file():
+    storage = MemmapStorage(10)
+
+    for i in range(5):
+        idx: Any = i
+        x = np.full(3, i, dtype=np.float32)
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=x, n_x=x + 1))
+
+    got = pickle.loads(pickle.dumps(storage))
+    assert isinstance(got._state_store, np.memmap)
+
+    idxs: Any = np.arange(5, dtype=np.int64)
+    assert np.all(got.get(idxs).x == storage.get(idxs).x)
+    assert np.all(got.get(idxs).xp == storage.get(idxs).xp)
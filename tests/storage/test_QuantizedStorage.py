@@ -0,0 +1,85 @@
+import pickle
+import pytest
+import numpy as np
+from typing import Any
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.QuantizedStorage import QuantizedStorage
+
+from tests._utils.fake_data import fake_lagged_timestep
+
+def fill(storage: BasicStorage, n: int):
+    rng = np.random.default_rng(0)
+    low = np.array([-1, 0, 10, 5], dtype=np.float32)
+    high = np.array([1, 100, 11, 5], dtype=np.float32)
+    xs = rng.uniform(low, high, size=(n + 1, 4)).astype(np.float32)
+
+    for i in range(n):
+        idx: Any = i
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=xs[i], n_x=xs[i + 1]))
+
+    return xs
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.float16])
+def test_calibrates_and_quantizes(dtype):
+    storage = QuantizedStorage(100, dtype=dtype, calibration_size=150)
+    xs = fill(storage, 100)
+
+    assert storage._state_store.dtype == dtype
+
+    idxs: Any = np.arange(100, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert batch.x.dtype == np.float32
+
+    # error is bounded by the resolution of each feature
+    err = np.abs(batch.x - xs[:100]).max(axis=0)
+    width = np.array([2, 100, 1, 1])
+    assert np.all(err <= width / 200)
+
+    got = storage.get_item(idxs[3])
+    assert np.allclose(got.x, xs[3], atol=0.5)
+
+def test_given_bounds():
+    storage = QuantizedStorage(100, low=[-1, 0, 10, 5], high=[1, 100, 11, 5])
+    xs = fill(storage, 10)
+
+    assert storage._state_store.dtype == np.uint8
+    idxs: Any = np.arange(10, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.allclose(batch.x, xs[:10], atol=0.2)
+
+def test_rejects_bad_config():
+    with pytest.raises(AssertionError):
+        QuantizedStorage(10, low=[-1, 0, 10, 5])
+
+    with pytest.raises(AssertionError):
+        QuantizedStorage(10, high=[1, 100, 11, 5])
+
+    storage = QuantizedStorage(10)
+    idx: Any = 0
+    with pytest.raises(AssertionError):
+        storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1, x=np.ones(4, dtype=np.int32), n_x=np.ones(4, dtype=np.int32)))
+
+def test_bootstrap_state_is_zero():
+    storage = QuantizedStorage(10, low=[-1, 0, 10, 5], high=[1, 100, 11, 5])
+    idx: Any = 0
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=None, x=np.ones(4, dtype=np.float32), n_x=None))
+
+    idxs: Any = np.array([0], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.xp == 0)
+
+def test_pickle():
+    storage = QuantizedStorage(100, calibration_size=50)
+    fill(storage, 100)
+
+    got = pickle.loads(pickle.dumps(storage))
+    idxs: Any = np.arange(100, dtype=np.int64)
+    assert np.all(got.get(idxs).x == storage.get(idxs).x)
+
+def test_memory():
+    basic = BasicStorage(100)
+    quant = QuantizedStorage(100, calibration_size=10)
+    fill(basic, 100)
+    fill(quant, 100)
+
+    assert quant._state_store.nbytes * 4 == basic._state_store.nbytes
@@ -0,0 +1,109 @@
+import pickle
+import pytest
+import multiprocessing as mp
+import numpy as np
+from typing import Any
+from ReplayTables.storage.SharedStorage import SharedStorage, SharedStorageReader
+
+from tests._utils.fake_data import fake_lagged_timestep
+
+def fill(storage: SharedStorage, n: int, start: int = 0):
+    for i in range(start, start + n):
+        idx: Any = i % storage.max_size
+        x = np.full(4, i, dtype=np.float32)
+        terminal = i % 3 == 0
+        n_xid = None if terminal else i + 1
+        n_x = None if terminal else x + 1
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=n_xid, x=x, n_x=n_x, a=i, r=i / 2, terminal=terminal))
+
+def test_reader_sees_writes():
+    storage = SharedStorage(10)
+    fill(storage, 10)
+
+    reader = SharedStorageReader(storage.name)
+    assert reader.size() == 10
+
+    idxs: Any = np.arange(10, dtype=np.int64)
+    expected = storage.get(idxs)
+    got = reader.get(idxs)
+
+    for field in ['x', 'a', 'r', 'gamma', 'terminal', 'eid', 'xp']:
+        assert np.all(getattr(got, field) == getattr(expected, field))
+
+    # bootstrapping from terminal states reads the zero row
+    assert np.all(got.xp[0] == 0)
+
+    # later writes are visible without re-attaching
+    fill(storage, 5, start=10)
+    got = reader.get(idxs)
+    assert np.all(got.eid == storage.get(idxs).eid)
+
+    reader.close()
+    storage.close()
+
+def test_cannot_pickle():
+    storage = SharedStorage(10)
+    fill(storage, 1)
+
+    with pytest.raises(TypeError):
+        pickle.dumps(storage)
+
+    storage.close()
+
+def _read_in_child(name: str, q: Any):
+    reader = SharedStorageReader(name)
+    idxs: Any = np.arange(reader.size(), dtype=np.int64)
+    batch = reader.get(idxs)
+    q.put((reader.size(), batch.x.sum(), batch.eid.tolist()))
+    reader.close()
+
+def test_reader_in_other_process():
+    storage = SharedStorage(10)
+    fill(storage, 25)
+
+    ctx = mp.get_context('spawn')
+    q = ctx.Queue()
+    p = ctx.Process(target=_read_in_child, args=(storage.name, q))
+    p.start()
+    size, total, eids = q.get(timeout=60)
+    p.join()
+
+    idxs: Any = np.arange(10, dtype=np.int64)
+    expected = storage.get(idxs)
+    assert size == 10
+    assert total == expected.x.sum()
+    assert eids == expected.eid.tolist()
+
+    storage.close()
+
+def test_failed_write_releases_readers():
+    storage = SharedStorage(10)
+    fill(storage, 3)
+
+    reader = SharedStorageReader(storage.name, timeout=0.1)
+
+    # a transition that cannot be stored fails part way through the write
+    bad = fake_lagged_timestep(eid=3, xid=3, n_xid=4, x=np.zeros(5, dtype=np.float32), n_x=np.zeros(5, dtype=np.float32))
+    with pytest.raises(ValueError):
+        storage.add(3, bad)  # type: ignore
+
+    idxs: Any = np.arange(3, dtype=np.int64)
+    assert np.all(reader.get(idxs).eid == [0, 1, 2])
+
+    reader.close()
+    storage.close()
+
+def test_reader_times_out_on_stuck_writer():
+    storage = SharedStorage(10)
+    fill(storage, 3)
+
+    reader = SharedStorageReader(storage.name, timeout=0.05)
+    storage._header[0] += 1
+
+    idxs: Any = np.arange(3, dtype=np.int64)
+    with pytest.raises(AssertionError):
+        reader.get(idxs)
+
+    storage._header[0] += 1
+    reader.close()
+    storage.close()
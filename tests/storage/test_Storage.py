@@ -1,25 +1,39 @@
+import copy
 import pytest
 import numpy as np
 
 from collections import deque
 from typing import Any, Sequence, Type
+from ReplayTables.storage.ArenaStorage import ArenaStorage
 from ReplayTables.storage.BasicStorage import Storage, BasicStorage
 from ReplayTables.storage.CompressedStorage import CompressedStorage
+from ReplayTables.storage.FrameStackStorage import FrameStackStorage
+from ReplayTables.storage.MemmapStorage import MemmapStorage
 from ReplayTables.storage.NonArrayStorage import NonArrayStorage
+from ReplayTables.storage.QuantizedStorage import QuantizedStorage
+from ReplayTables.storage.SharedStorage import SharedStorage, SharedStorageReader
+from ReplayTables.storage.StructuredStorage import StructuredStorage
+from ReplayTables.storage.TieredStorage import TieredStorage
 from ReplayTables.interface import LaggedTimestep, IDX, IDXs
 
-from tests._utils.fake_data import fake_lagged_timestep, LaggedDataStream, lagged_equal, batch_equal, lags_to_batch
+from tests._utils.fake_data import fake_lagged_timestep, LaggedDataStream, lagged_equal, batch_equal, lags_to_batch, obs_equal
 
 
 STORAGES = [
+    ArenaStorage,
     BasicStorage,
     CompressedStorage,
+    FrameStackStorage,
+    MemmapStorage,
     NonArrayStorage,
 ]
 
 BATCH_STORAGES = [
+    ArenaStorage,
     BasicStorage,
     CompressedStorage,
+    FrameStackStorage,
+    MemmapStorage,
 ]
 
 @pytest.mark.parametrize('Store', STORAGES)
@@ -182,9 +196,218 @@ def test_integration2(Store: Type[Storage]):
     assert np.all(got.xp[0] == 0)
     assert got.terminal[0]
 
-# ------------------------------
-# -- Performance Benchmarking --
-# ------------------------------
+@pytest.mark.parametrize('Store', BATCH_STORAGES)
+def test_add_many(Store: Type[Storage]):
+    one = Store(10)
+    many = Store(10)
+    data = LaggedDataStream(lag=1)
+    data.next()
+
+    # chunks larger than the storage overwrite idxs within a single call
+    for size in [3, 7, 1, 25, 10, 4]:
+        chunk = []
+        for i in range(size):
+            exps = data.next(hard_term=i == 2, soft_term=i == 5)
+            if i in (2, 5):
+                data.next()
+
+            chunk += exps
+
+        for d in chunk:
+            one.add(as_idx(d.eid % 10), d)
+
+        idxs = as_idxs(np.array([d.eid % 10 for d in chunk], dtype=np.int64))
+        items = many.add_many(idxs, chunk)
+        assert [item.eid for item in items] == [d.eid for d in chunk]
+
+        assert len(one) == len(many)
+        idxs = as_idxs(np.arange(len(one)))
+        assert batch_equal(one.get(idxs), many.get(idxs))
+
+@pytest.mark.parametrize('Store', STORAGES)
+def test_defragment(Store: Type[Storage]):
+    storage = Store(20)
+    data = LaggedDataStream(lag=1)
+    rng = np.random.default_rng(0)
+    data.next()
+
+    # evicting at random scatters states across the store
+    for i in range(200):
+        d = data.next_single() if i % 13 else data.next(hard_term=True)[0]
+        if i % 13 == 0: data.next()
+
+        idx = i if i < 20 else rng.integers(20)
+        storage.add(as_idx(idx), d)
+
+    idxs = as_idxs(np.arange(20))
+    # some storages hand out views, so hold onto copies
+    before = [copy.deepcopy(storage.get_item(as_idx(i))) for i in range(20)]
+    storage.defragment()
+
+    for i in range(20):
+        assert lagged_equal(storage.get_item(as_idx(i)), before[i])
+
+    # states are numbered in the order they were seen, with no gaps
+    items = storage.meta.get_items_by_idx(idxs)
+    xids = np.concatenate([items.xids, items.n_xids[items.n_sidxs >= 0]])
+    sidxs = np.concatenate([items.sidxs, items.n_sidxs[items.n_sidxs >= 0]])
+    order = np.argsort(xids, kind='stable')
+    _, first = np.unique(xids[order], return_index=True)
+    assert np.all(sidxs[order][first] == np.arange(len(first)))
+
+    # and the storage keeps working afterwards
+    for i in range(30):
+        d = data.next_single()
+        storage.add(as_idx(i % 20), d)
+        assert lagged_equal(storage.get_item(as_idx(i % 20)), d)
+
+# every storage that renumbers its states when defragmenting
+DEFRAG_STORAGES = {
+    'arena': lambda: ArenaStorage(20),
+    'basic': lambda: BasicStorage(20),
+    'compressed': lambda: CompressedStorage(20),
+    'framestack': lambda: FrameStackStorage(20),
+    'memmap': lambda: MemmapStorage(20),
+    'nonarray': lambda: NonArrayStorage(20),
+    'quantized': lambda: QuantizedStorage(20, calibration_size=50),
+    'shared': lambda: SharedStorage(20),
+    'structured': lambda: StructuredStorage(20),
+    'tiered': lambda: TieredStorage(20, hot_size=8),
+}
+
+def _round_trip_equal(b1, b2):
+    # NonArrayStorage hands back lists of states rather than stacked arrays
+    if isinstance(b1.x, list):
+        states_equal = all(
+            obs_equal(x1, x2) and obs_equal(xp1, xp2)
+            for x1, x2, xp1, xp2 in zip(b1.x, b2.x, b1.xp, b2.xp)
+        )
+        return len(b1.x) == len(b2.x) and states_equal and batch_equal(b1._replace(x=0, xp=0), b2._replace(x=0, xp=0))
+
+    return batch_equal(b1, b2)
+
+@pytest.mark.parametrize('name', DEFRAG_STORAGES.keys())
+def test_defragment_round_trip(name: str):
+    storage: Any = DEFRAG_STORAGES[name]()
+    data = LaggedDataStream(lag=1)
+    rng = np.random.default_rng(0)
+    data.next()
+
+    for i in range(200):
+        d = data.next_single() if i % 13 else data.next(hard_term=True)[0]
+        if i % 13 == 0: data.next()
+
+        idx = i if i < 20 else rng.integers(20)
+        storage.add(as_idx(idx), d)
+
+    idxs = as_idxs(np.arange(20))
+    repeats = as_idxs(rng.integers(20, size=50))
+    before = copy.deepcopy(storage.get(idxs))
+    before_repeats = copy.deepcopy(storage.get(repeats))
+
+    storage.defragment()
+
+    assert _round_trip_equal(storage.get(idxs), before)
+    assert _round_trip_equal(storage.get(repeats), before_repeats)
+
+    if name != 'nonarray':
+        out = storage.empty_batch(50)
+        assert _round_trip_equal(storage.get(repeats, out=out), before_repeats)
+
+    # readers gather through the sidxs that defragment rewrote
+    if name == 'shared':
+        reader = SharedStorageReader(storage.name)
+        assert _round_trip_equal(reader.get(idxs), before)
+        reader.close()
+        storage.close()
+
+@pytest.mark.parametrize('Store', BATCH_STORAGES)
+def test_get_out(Store: Type[Storage]):
+    storage = Store(20)
+    data = LaggedDataStream(lag=1)
+    data.next()
+
+    for i in range(50):
+        d = data.next_single() if i % 7 else data.next(hard_term=True)[0]
+        if i % 7 == 0: data.next()
+        storage.add(as_idx(i % 20), d)
+
+    out = storage.empty_batch(8)
+    x = out.x
+    for start in range(0, 20, 4):
+        idxs = as_idxs(np.arange(start, start + 8) % 20)
+        got = storage.get(idxs, out=out)
+
+        # filled in place, and the same as a freshly allocated batch
+        assert got.x is x
+        assert batch_equal(got, storage.get(idxs))
+
+    # separately allocated arrays are filled too
+    sep = out._replace(x=out.x.copy(), xp=out.xp.copy())
+    idxs = as_idxs(np.arange(8))
+    assert batch_equal(storage.get(idxs, out=sep), storage.get(idxs))
+
+@pytest.mark.parametrize('Store', STORAGES)
+def test_memory_usage(Store: Type[Storage]):
+    storage = Store(100)
+    assert all(v >= 0 for v in storage.memory_usage().values())
+
+    data = LaggedDataStream(lag=1)
+    data.next()
+
+    used = []
+    for n in [30, 60]:
+        for i in range(n - 30, n):
+            storage.add(as_idx(i), data.next_single())
+
+        usage = storage.memory_usage()
+        key = next(k for k in usage if k.startswith('states') and k.endswith('_used'))
+        used.append(usage[key])
+
+        # live states never take more than what is allocated for them
+        assert 0 < usage[key] <= usage[key.removesuffix('_used')]
+        assert usage['metadata_items'] > 0 and usage['metadata_ref_count'] > 0
+
+    assert used[1] > used[0]
+
+
+@pytest.mark.parametrize('Store', BATCH_STORAGES)
+def test_add_many_speed(benchmark, Store: Type[Storage]):
+    benchmark.name = Store.__name__
+    benchmark.group = 'storage | add many'
+
+    def add(storage: Storage, timesteps, idxs):
+        for i in range(0, 1000, 64):
+            storage.add_many(idxs[i:i + 64], timesteps[i:i + 64])
+
+    storage = Store(10_000)
+    data = [
+        fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=np.ones(10), n_x=np.ones(10))
+        for i in range(1000)
+    ]
+    idxs = np.arange(1000, dtype=np.int64)
+
+    benchmark(add, storage, data, idxs)
+
+@pytest.mark.parametrize('out', [False, True])
+@pytest.mark.parametrize('Store', BATCH_STORAGES)
+def test_get_speed(benchmark, Store: Type[Storage], out: bool):
+    benchmark.name = Store.__name__ + (' out' if out else '')
+    benchmark.group = 'storage | get'
+
+    def get(storage: Storage, idxs, batch):
+        for _ in range(10):
+            storage.get(idxs, out=batch)
+
+    storage = Store(10_000)
+    x = np.ones((64, 64, 3), dtype=np.uint8)
+    for i in range(1000):
+        storage.add(as_idx(i), fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=x, n_x=x))
+
+    idxs = as_idxs(np.random.default_rng(0).integers(1000, size=512))
+    batch = storage.empty_batch(512) if out else None
+
+    benchmark(get, storage, idxs, batch)
 
 @pytest.mark.parametrize('Store', STORAGES)
 def test_small_data(benchmark, Store: Type[Storage]):
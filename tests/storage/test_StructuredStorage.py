@@ -0,0 +1,115 @@
+import pickle
+import pytest
+import numpy as np
+from typing import Any, NamedTuple
+from ReplayTables.storage.StructuredStorage import StructuredStorage
+
+from tests._utils.fake_data import fake_lagged_timestep
+
+class Obs(NamedTuple):
+    pos: np.ndarray
+    goal: int
+
+def make_obs(i: int):
+    return {
+        'image': np.full((3, 4), i, dtype=np.uint8),
+        'state': (np.full(2, i / 10, dtype=np.float32), Obs(pos=np.array([i, -i]), goal=i)),
+    }
+
+def fill(storage: StructuredStorage, n: int):
+    for i in range(n):
+        idx: Any = i
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=make_obs(i), n_x=make_obs(i + 1)))
+
+def test_columns():
+    storage = StructuredStorage(10)
+    fill(storage, 10)
+
+    assert len(storage._columns) == 4
+    assert storage._columns[0].shape[1:] == (3, 4)
+    assert storage._columns[0].dtype == np.uint8
+    assert storage._columns[1].dtype == np.float32
+
+def test_get_batch():
+    storage = StructuredStorage(10)
+    fill(storage, 10)
+
+    idxs: Any = np.array([2, 5, 7], dtype=np.int64)
+    batch = storage.get(idxs)
+
+    x = batch.x
+    assert isinstance(x, dict)
+    assert x['image'].shape == (3, 3, 4)
+    assert np.all(x['image'][:, 0, 0] == [2, 5, 7])
+
+    vec, obs = x['state']
+    assert isinstance(obs, Obs)
+    assert np.allclose(vec[:, 0], [0.2, 0.5, 0.7])
+    assert np.all(obs.pos == [[2, -2], [5, -5], [7, -7]])
+    assert np.all(obs.goal == [2, 5, 7])
+
+    assert np.all(batch.xp['image'][:, 0, 0] == [3, 6, 8])
+
+def test_get_item():
+    storage = StructuredStorage(10)
+    fill(storage, 10)
+
+    idx: Any = 4
+    got = storage.get_item(idx)
+    assert np.all(got.x['image'] == 4)
+    assert got.x['state'][1].goal == 4
+    assert np.all(got.n_x['image'] == 5)
+
+def test_bootstrap_zeros():
+    storage = StructuredStorage(10)
+    idx: Any = 0
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=None, x=make_obs(3), n_x=None))
+
+    idxs: Any = np.array([0], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.xp['image'] == 0)
+    assert np.all(batch.xp['state'][1].goal == 0)
+
+def test_key_order():
+    storage = StructuredStorage(10)
+    idx: Any = 0
+    x = {'a': np.zeros(2), 'b': np.ones(3)}
+    storage.add(idx, fake_lagged_timestep(eid=0, xid=0, n_xid=1, x=x, n_x={'b': np.ones(3) * 2, 'a': np.ones(2) * 2}))
+
+    idxs: Any = np.array([0], dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.xp['a'] == 2)
+    assert np.all(batch.xp['b'] == 2)
+
+def test_grows_and_pickles():
+    storage = StructuredStorage(10)
+    for i in range(10):
+        idx: Any = i
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=2 * i, n_xid=2 * i + 1, x=make_obs(i), n_x=make_obs(i + 1)))
+
+    storage = pickle.loads(pickle.dumps(storage))
+    idxs: Any = np.arange(10, dtype=np.int64)
+    batch = storage.get(idxs)
+    assert np.all(batch.x['image'][:, 0, 0] == np.arange(10))
+    assert np.all(batch.xp['image'][:, 0, 0] == np.arange(10) + 1)
+
+def test_get_out():
+    storage = StructuredStorage(10)
+    for i in range(10):
+        idx: Any = i
+        x = np.full(3, i, dtype=np.float32)
+        storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=x, n_x=x + 1))
+
+    # array states can be gathered into a preallocated batch
+    out = storage.empty_batch(4)
+    idxs: Any = np.array([3, 0, 9, 3], dtype=np.int64)
+    batch = storage.get(idxs, out=out)
+    assert batch.x is out.x
+    assert np.all(batch.x[:, 0] == [3, 0, 9, 3])
+    assert np.all(batch.xp[:, 0] == [4, 1, 10, 4])
+
+    # structured states cannot
+    storage = StructuredStorage(10)
+    fill(storage, 2)
+    with pytest.raises(AssertionError):
+        storage.empty_batch(4)
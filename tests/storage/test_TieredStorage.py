@@ -0,0 +1,91 @@
+import pickle
+import pytest
+import numpy as np
+from typing import Any
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.TieredStorage import TieredStorage
+
+from tests._utils.fake_data import LaggedDataStream, batch_equal, fake_lagged_timestep
+
+def test_matches_basic_storage(tmp_path):
+    storage = TieredStorage(100, hot_size=16, path=str(tmp_path / 'states.dat'))
+    basic = BasicStorage(100)
+    data = LaggedDataStream(lag=1)
+    rng = np.random.default_rng(0)
+    data.next()
+
+    for i in range(500):
+        d = data.next_single() if i % 11 else data.next(hard_term=True)[0]
+        if i % 11 == 0: data.next()
+
+        idx: Any = i % 100
+        storage.add(idx, d)
+        basic.add(idx, d)
+
+        # skewed samples, like under prioritized replay
+        n = min(i + 1, 100)
+        idxs: Any = np.minimum(rng.geometric(0.1, size=32) - 1, n - 1).astype(np.int64)
+        assert batch_equal(storage.get(idxs), basic.get(idxs))
+
+    assert np.count_nonzero(storage._owners >= 0) <= 16
+
+def test_hot_set_follows_samples():
+    storage = TieredStorage(100, hot_size=24)
+    data = LaggedDataStream(lag=1)
+    data.next()
+
+    for i in range(100):
+        idx: Any = i
+        storage.add(idx, data.next_single())
+
+    # the first states were pushed out by newer ones
+    popular: Any = np.arange(10, dtype=np.int64)
+    sidxs = storage.meta.get_items_by_idx(popular).sidxs
+    assert np.all(storage._slots[sidxs] < 0)
+
+    # sampling them brings them back, and keeps them while others come and go
+    for i in range(50):
+        storage.get(popular)
+        others: Any = np.arange(20 + i, 30 + i, dtype=np.int64)
+        storage.get(others)
+
+    assert np.all(storage._slots[sidxs] >= 0)
+
+def test_pickle():
+    storage = TieredStorage(50, hot_size=8)
+    data = LaggedDataStream(lag=1)
+    data.next()
+
+    for i in range(80):
+        idx: Any = i % 50
+        storage.add(idx, data.next_single())
+
+    got = pickle.loads(pickle.dumps(storage))
+    idxs: Any = np.arange(50, dtype=np.int64)
+    assert batch_equal(got.get(idxs), storage.get(idxs))
+
+    usage = got.memory_usage()
+    assert usage['states_used'] <= 8 * got._hot[0].nbytes < usage['states_on_disk_used']
+
+# ----------------
+# -- Benchmarks --
+# ----------------
+
+class TestBenchmarks:
+    @pytest.mark.parametrize('hot', [None, 1000])
+    def test_skewed_get(self, benchmark, hot: int | None):
+        benchmark.name = 'BasicStorage' if hot is None else f'TieredStorage hot={hot}'
+        benchmark.group = 'storage | skewed get'
+
+        storage = BasicStorage(10_000) if hot is None else TieredStorage(10_000, hot_size=hot)
+        x = np.ones((64, 64, 3), dtype=np.uint8)
+        for i in range(10_000):
+            idx: Any = i
+            storage.add(idx, fake_lagged_timestep(eid=i, xid=i, n_xid=i + 1, x=x, n_x=x))
+
+        rng = np.random.default_rng(0)
+        def _inner():
+            idxs: Any = np.minimum(rng.geometric(1e-3, size=256) - 1, 9_999).astype(np.int64)
+            storage.get(idxs)
+
+        benchmark(_inner)
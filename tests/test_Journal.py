@@ -0,0 +1,155 @@
+import os
+import pickle
+import pytest
+import numpy as np
+import ReplayTables.Journal as journal_module
+import ReplayTables._utils.snapshot as snapshot
+
+from ReplayTables.Journal import Journal, _replay
+from ReplayTables.PER import PrioritizedReplay
+
+from tests._utils.fake_data import fake_timestep
+
+def _step(buffer: PrioritizedReplay, i: int):
+    buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i, terminal=i % 17 == 0))
+    if buffer.size() > 16:
+        batch = buffer.sample(16)
+        buffer.update_priorities(batch, np.arange(16, dtype=np.float64) + i)
+
+def _last_eid(buffer: PrioritizedReplay):
+    return buffer._lag_buffer._eid - 1
+
+def test_recover_to_last_checkpoint(tmp_path):
+    rng = np.random.default_rng(0)
+    buffer = PrioritizedReplay(100, 2, rng)
+    journal = Journal(buffer, str(tmp_path), compact_ratio=1e6)
+
+    for i in range(150):
+        _step(buffer, i)
+
+    buffer.delete_sample(_last_eid(buffer))
+    journal.checkpoint()
+    expected = pickle.loads(pickle.dumps(buffer))
+
+    # work after the checkpoint is lost, along with a torn write
+    for i in range(150, 170):
+        _step(buffer, i)
+
+    journal.close()
+    with open(tmp_path / 'log-1', 'ab') as f:
+        f.write(b'\x10\x00\x00')
+
+    recovered = Journal.recover(str(tmp_path))
+    assert isinstance(recovered, PrioritizedReplay)
+    assert recovered.size() == expected.size()
+
+    # same contents, same priorities, and the same rng
+    eids = np.arange(_last_eid(expected) - 99, _last_eid(expected) + 1)
+    b1 = expected.get(eids)
+    b2 = recovered.get(eids)
+    assert np.all(b1.x == b2.x) and np.all(b1.a == b2.a) and np.all(b1.xp == b2.xp)
+    assert np.allclose(expected.isr_weights(eids), recovered.isr_weights(eids))
+    assert np.all(expected.sample(32).eid == recovered.sample(32).eid)
+
+    # both keep going identically, including the pending lagged steps
+    for i in range(150, 170):
+        _step(expected, i)
+        _step(recovered, i)
+
+    eids = np.arange(_last_eid(expected) - 99, _last_eid(expected) + 1)
+    assert np.all(expected.get(eids).x == recovered.get(eids).x)
+
+def test_compaction(tmp_path):
+    rng = np.random.default_rng(0)
+    buffer = PrioritizedReplay(100, 1, rng)
+    journal = Journal(buffer, str(tmp_path), compact_ratio=0.5)
+
+    for i in range(500):
+        _step(buffer, i)
+        if i % 25 == 0:
+            journal.checkpoint()
+
+    journal.checkpoint()
+
+    # old generations are cleaned up after each compaction
+    names = sorted(os.listdir(tmp_path))
+    assert len([n for n in names if n.startswith('base-')]) == 1
+    assert len([n for n in names if n.startswith('log-')]) == 1
+
+    journal.close()
+    recovered = Journal.recover(str(tmp_path), mmap=False)
+
+    eids = np.arange(_last_eid(buffer) - 99, _last_eid(buffer) + 1)
+    assert np.all(buffer.get(eids).x == recovered.get(eids).x)
+    assert np.allclose(buffer.isr_weights(eids), recovered.isr_weights(eids))
+
+def test_compaction_is_durable_before_dropping_the_old_generation(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    buffer = PrioritizedReplay(100, 1, rng)
+    journal = Journal(buffer, str(tmp_path), compact_ratio=1e6)
+    for i in range(50):
+        _step(buffer, i)
+
+    events = []
+    fsync_dir = snapshot.fsync_dir
+    write_head = journal_module._write_head
+    rmtree = journal_module.shutil.rmtree
+
+    def record_fsync_dir(path):
+        events.append(('fsync', os.path.relpath(path, tmp_path)))
+        fsync_dir(path)
+
+    def record_write_head(path, gen):
+        events.append(('head', gen))
+        write_head(path, gen)
+
+    def record_rmtree(path, **kwargs):
+        events.append(('rmtree', os.path.relpath(path, tmp_path)))
+        rmtree(path, **kwargs)
+
+    monkeypatch.setattr(snapshot, 'fsync_dir', record_fsync_dir)
+    monkeypatch.setattr(journal_module, '_write_head', record_write_head)
+    monkeypatch.setattr(journal_module.shutil, 'rmtree', record_rmtree)
+    journal.compact()
+
+    # the new base and the journal directory reach disk before HEAD moves to them,
+    # and the old generation is only dropped after HEAD
+    head = events.index(('head', 2))
+    assert ('fsync', 'base-2.tmp') in events[:head]
+    assert ('fsync', 'base-2.tmp/arrays') in events[:head]
+    assert ('fsync', '.') in events[:head]
+    assert events.index(('rmtree', 'base-1')) > head
+    assert events[-1] == ('fsync', '.')
+
+    journal.close()
+
+def test_log_grows_with_new_data(tmp_path):
+    rng = np.random.default_rng(0)
+    buffer = PrioritizedReplay(1000, 1, rng)
+    journal = Journal(buffer, str(tmp_path), compact_ratio=1e6)
+
+    for i in range(1000):
+        _step(buffer, i)
+
+    journal.compact()
+    log = tmp_path / 'log-2'
+
+    sizes = []
+    for _ in range(3):
+        start = log.stat().st_size
+        for i in range(10):
+            _step(buffer, i)
+
+        journal.checkpoint()
+        sizes.append(log.stat().st_size - start)
+
+    # each checkpoint costs about the same, regardless of how full the buffer is
+    assert max(sizes) < 2 * min(sizes)
+    assert max(sizes) < 0.1 * sum(f.stat().st_size for f in (tmp_path / 'base-2').rglob('*') if f.is_file())
+
+def test_unknown_op():
+    buffer = PrioritizedReplay(10, 1, np.random.default_rng(0))
+    frame = {'ops': [pickle.dumps(('resize', (20, )))], 't': 0, 'rng': None, 'lag': None}
+
+    with pytest.raises(ValueError, match='Unknown journal op <resize>'):
+        _replay(buffer, frame)
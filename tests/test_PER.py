@@ -1,11 +1,40 @@
 import pickle
+import pytest
 import numpy as np
+from pathlib import Path
 from typing import cast, Any
 
 from ReplayTables.interface import EID, Timestep
 from ReplayTables.PER import PrioritizedReplay, PERConfig
-
-from tests._utils.fake_data import fake_timestep
+from ReplayTables.storage.BasicStorage import BasicStorage
+from ReplayTables.storage.CompressedStorage import CompressedStorage
+
+from tests._utils.fake_data import batch_equal, fake_timestep
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+STORAGES = {
+    'basic': lambda: BasicStorage(10),
+    'compressed': lambda: CompressedStorage(10),
+}
+
+def _fill_for_pickle(buffer: PrioritizedReplay, n: int):
+    rng = np.random.default_rng(n)
+    for i in range(n):
+        buffer.add_step(Timestep(
+            x=rng.random(4).astype(np.float32),
+            a=i % 3,
+            r=float(i),
+            gamma=0.99,
+            terminal=(i % 7 == 6),
+            extra={'step': i},
+        ))
+
+    buffer.update_priorities(buffer.get(_newest_eids(buffer, 5)), np.arange(5.) + 1)
+    return buffer
+
+def _newest_eids(buffer: PrioritizedReplay, n: int) -> Any:
+    last = buffer._idx_mapper._max_eid
+    return np.arange(last - n + 1, last + 1, dtype=np.int64)
 
 class TestPER:
     def test_simple_buffer(self):
@@ -103,8 +132,8 @@ class TestPER:
         b = np.sum(batch.a == 1)
         a = np.sum(batch.a == 0)
 
-        assert b == 6660
-        assert a == 3340
+        assert b == 6662
+        assert a == 3338
 
     def test_pickeable(self):
         rng = np.random.default_rng(0)
@@ -125,6 +154,72 @@ class TestPER:
 
         assert np.all(s.x == s2.x) and np.all(s.a == s2.a)
 
+    def test_memory_usage(self):
+        rng = np.random.default_rng(0)
+        buffer = PrioritizedReplay(1000, 1, rng)
+
+        for i in range(100):
+            buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+
+        usage = buffer.memory_usage()
+        assert usage['sampler.sum_tree'] >= 2 * 1000 * 8
+        assert usage['storage.states'] >= 1000 * 8 * 8
+        assert usage['storage.states_used'] == 100 * 8 * 8
+
+        # a float32 tree takes half the memory
+        buffer = PrioritizedReplay(1000, 1, rng, PERConfig(tree_dtype='float32'))
+        assert 2 * buffer.memory_usage()['sampler.sum_tree'] == usage['sampler.sum_tree']
+
+    def test_snapshot(self, tmp_path):
+        rng = np.random.default_rng(0)
+        buffer = PrioritizedReplay(1000, 1, rng)
+
+        for i in range(1500):
+            buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+
+        batch = buffer.sample(64)
+        buffer.update_batch(batch, priorities=np.arange(64, dtype=np.float64))
+
+        buffer.save(str(tmp_path))
+        buffer2 = PrioritizedReplay.load(str(tmp_path))
+
+        s = buffer.sample(128)
+        s2 = buffer2.sample(128)
+        assert np.all(s.x == s2.x) and np.all(s.a == s2.a)
+        assert np.allclose(buffer.isr_weights(s.eid), buffer2.isr_weights(s.eid))
+
+        # new states go to the same slots in both buffers
+        for i in range(100):
+            buffer.add_step(fake_timestep(x=np.ones(8) * -i))
+            buffer2.add_step(fake_timestep(x=np.ones(8) * -i))
+
+        idxs = np.arange(1000, dtype=np.int64)
+        assert np.all(buffer._storage.meta.get_items_by_idx(idxs).sidxs == buffer2._storage.meta.get_items_by_idx(idxs).sidxs)
+
+    @pytest.mark.parametrize('storage', ['basic', 'compressed'])
+    def test_load_baseline_pickle(self, storage: str):
+        # pickled by ReplayTables 6.2.16 after running _fill_for_pickle on a fresh buffer
+        with open(FIXTURES / f'baseline_per_{storage}.pkl', 'rb') as f:
+            buffer = pickle.load(f)
+
+        expected = PrioritizedReplay(10, 2, np.random.default_rng(0), storage=STORAGES[storage]())
+        _fill_for_pickle(expected, 23)
+        assert buffer.size() == expected.size() == 10
+
+        eids = _newest_eids(buffer, 10)
+        assert batch_equal(buffer.get(eids), expected.get(eids))
+        assert np.all(buffer.get(eids).extra['step'] == expected.get(eids).extra['step'])
+        assert np.allclose(buffer.isr_weights(eids), expected.isr_weights(eids))
+
+        # the loaded buffer keeps going like one that was never pickled
+        _fill_for_pickle(buffer, 17)
+        _fill_for_pickle(expected, 17)
+
+        eids = _newest_eids(buffer, 10)
+        assert np.all(eids == _newest_eids(expected, 10))
+        assert batch_equal(buffer.get(eids), expected.get(eids))
+        assert np.allclose(buffer.isr_weights(eids), expected.isr_weights(eids))
+
     def test_delete_sample(self):
         rng = np.random.default_rng(0)
         buffer = PrioritizedReplay(5, 1, rng)
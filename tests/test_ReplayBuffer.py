@@ -1,5 +1,7 @@
 import numpy as np
 import pickle
+import threading
+import pytest
 from ReplayTables.ReplayBuffer import ReplayBuffer
 
 from tests._utils.fake_data import fake_timestep
@@ -153,6 +155,148 @@ class TestReplayBuffer:
 
         assert np.all(s.a == s2.a) and np.all(s.x == s2.x)
 
+    def test_add_many(self):
+        buffer = ReplayBuffer(50, 1, np.random.default_rng(0))
+        buffer2 = ReplayBuffer(50, 1, np.random.default_rng(0))
+
+        lagged = []
+        for i in range(120):
+            lagged += buffer2.add_step(fake_timestep(x=np.ones(4) * i, a=i))
+
+        for i in range(0, len(lagged), 16):
+            buffer.add_many(lagged[i:i + 16])
+
+        assert buffer.size() == buffer2.size() == 50
+
+        eids = np.arange(69, 119)
+        b1 = buffer.get(eids)
+        b2 = buffer2.get(eids)
+        assert np.all(b1.x == b2.x) and np.all(b1.xp == b2.xp) and np.all(b1.a == b2.a)
+
+    def test_snapshot(self, tmp_path):
+        rng = np.random.default_rng(0)
+        buffer = ReplayBuffer(1000, 1, rng)
+
+        for i in range(1200):
+            buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+
+        buffer.save(str(tmp_path))
+
+        # large columns are written as raw arrays, not into the pickle
+        assert len(list((tmp_path / 'arrays').iterdir())) > 0
+        assert (tmp_path / 'meta.pkl').stat().st_size < 20_000
+
+        s = buffer.sample(32)
+        for mmap in [True, False]:
+            buffer2 = ReplayBuffer.load(str(tmp_path), mmap=mmap)
+            assert buffer2.size() == buffer.size()
+
+            s2 = buffer2.get(s.eid)
+            assert np.all(s.a == s2.a) and np.all(s.x == s2.x) and np.all(s.xp == s2.xp)
+
+            # the loaded buffer keeps working, without writing back into the snapshot
+            for i in range(10):
+                buffer2.add_step(fake_timestep(x=np.zeros(8), a=-1))
+
+            assert ReplayBuffer.load(str(tmp_path)).get(s.eid).a.tolist() == s.a.tolist()
+
+    def test_snapshot_overwrite(self, tmp_path, monkeypatch):
+        big = ReplayBuffer(1000, 1, np.random.default_rng(0))
+        for i in range(1200):
+            big.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+
+        small = ReplayBuffer(100, 1, np.random.default_rng(0))
+        for i in range(120):
+            small.add_step(fake_timestep(x=np.ones(4) * -i, a=-i))
+
+        big.save(str(tmp_path / 'snap'))
+        n_arrays = len(list((tmp_path / 'snap' / 'arrays').iterdir()))
+        small.save(str(tmp_path / 'snap'))
+
+        # nothing from the larger snapshot is left behind
+        assert len(list((tmp_path / 'snap' / 'arrays').iterdir())) < n_arrays
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['snap']
+        assert ReplayBuffer.load(str(tmp_path / 'snap')).size() == 100
+
+        # a save that dies part way leaves the previous snapshot intact
+        save = np.save
+        calls = []
+        def flaky_save(*args, **kwargs):
+            calls.append(1)
+            if len(calls) > 1:
+                raise OSError('disk full')
+            save(*args, **kwargs)
+
+        monkeypatch.setattr(np, 'save', flaky_save)
+        with pytest.raises(OSError):
+            big.save(str(tmp_path / 'snap'))
+
+        monkeypatch.setattr(np, 'save', save)
+        eids = np.arange(50, 60)
+        assert ReplayBuffer.load(str(tmp_path / 'snap')).get(eids).a.tolist() == small.get(eids).a.tolist()
+
+        # so does dying between moving the old snapshot aside and moving the new one in
+        (tmp_path / 'snap').rename(tmp_path / 'snap.old')
+        assert ReplayBuffer.load(str(tmp_path / 'snap')).size() == 100
+
+        big.save(str(tmp_path / 'snap'))
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['snap']
+        assert ReplayBuffer.load(str(tmp_path / 'snap')).size() == 1000
+
+    def test_sample_out(self):
+        buffer = ReplayBuffer(100, 1, np.random.default_rng(0))
+        buffer2 = ReplayBuffer(100, 1, np.random.default_rng(0))
+
+        for i in range(150):
+            buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+            buffer2.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+
+        out = buffer.empty_batch(32)
+        for _ in range(5):
+            b1 = buffer.sample(32, out=out)
+            b2 = buffer2.sample(32)
+
+            assert b1 is out
+            assert np.all(b1.x == b2.x) and np.all(b1.xp == b2.xp)
+            assert np.all(b1.a == b2.a) and np.all(b1.eid == b2.eid)
+
+    def test_iter_batches(self):
+        rng = np.random.default_rng(0)
+        buffer = ReplayBuffer(100, 1, rng)
+
+        for i in range(50):
+            buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+
+        batches = buffer.iter_batches(32, prefetch=3)
+
+        # keep adding while batches are built in the background
+        for i in range(50, 500):
+            buffer.add_step(fake_timestep(x=np.ones(8) * i, a=i))
+            batch = next(batches)
+
+            # every batch is internally consistent, even across evictions
+            assert batch.x.shape == (32, 8)
+            assert np.all(batch.x[:, 0] == batch.a)
+            assert np.all(batch.xp[:, 0] == batch.a + 1)
+            assert np.all(batch.eid == batch.a)
+
+        # closing the iterator stops its worker
+        batches.close()
+        assert not any(t.name == 'ReplayTables-prefetch' for t in threading.enumerate())
+
+        # and the buffer is still picklable
+        buffer2 = pickle.loads(pickle.dumps(buffer))
+        assert np.all(buffer2.get(batch.eid).a == batch.a)
+
+    def test_iter_batches_errors(self):
+        rng = np.random.default_rng(0)
+        buffer = ReplayBuffer(100, 1, rng)
+
+        # sampling an empty buffer fails on the worker, and the error reaches the consumer
+        batches = buffer.iter_batches(32)
+        with pytest.raises(Exception):
+            next(batches)
+
 # ----------------
 # -- Benchmarks --
 # ----------------
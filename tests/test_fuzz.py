@@ -33,7 +33,7 @@ class SuperSimpleBuffer:
         return len(self.storage)
 
     def get(self, idxs: IDXs) -> Batch:
-        x, a, r, g, t, e, xp = zip(*[self.storage[idx] for idx in idxs])
+        x, a, r, g, t, e, xp, _ = zip(*[self.storage[idx] for idx in idxs])
 
         xps = []
         for _xp in xp:
@@ -0,0 +1,66 @@
+import pickle
+import numpy as np
+
+from ReplayTables._utils.BlobArena import BlobArena
+
+def _blob(rng: np.random.Generator, n: int) -> bytes:
+    return rng.integers(0, 255, size=n, dtype=np.uint8).tobytes()
+
+class TestBlobArena:
+    def test_put_get_remove(self):
+        arena = BlobArena()
+        rng = np.random.default_rng(0)
+
+        blobs = {k: _blob(rng, 10 + 7 * k) for k in range(-1, 20)}
+        for k, b in blobs.items():
+            arena.put(k, b)
+
+        assert len(arena) == 21
+        assert arena.used == sum(len(b) for b in blobs.values())
+        assert all(bytes(arena.get(k)) == b for k, b in blobs.items())
+
+        arena.remove(3)
+        arena.remove(3)
+        assert 3 not in arena and len(arena) == 20
+
+        # overwriting with a blob of another size moves it, the rest are untouched
+        blobs[5] = _blob(rng, 500)
+        arena.put(5, blobs[5])
+        del blobs[3]
+        assert all(bytes(arena.get(k)) == b for k, b in blobs.items())
+
+    def test_reuses_freed_extents(self):
+        arena = BlobArena()
+        rng = np.random.default_rng(0)
+
+        # a sliding window of similarly sized blobs
+        for k in range(2000):
+            arena.put(k, _blob(rng, int(rng.integers(900, 1000))))
+            if k >= 100:
+                arena.remove(k - 100)
+
+        # about 100 live blobs worth of space, not 2000
+        assert arena._end < 200 * 1024
+
+    def test_permute_and_pickle(self):
+        arena = BlobArena()
+        rng = np.random.default_rng(0)
+
+        blobs = {k: _blob(rng, 20 + k) for k in range(-1, 10)}
+        for k, b in blobs.items():
+            arena.put(k, b)
+
+        arena.remove(4)
+        src = np.array([9, 0, 7], dtype=np.int64)
+        arena.permute(src)
+
+        assert len(arena) == 4 and arena.free_bytes == 0
+        assert bytes(arena.get(-1)) == blobs[-1]
+        assert [bytes(arena.get(k)) for k in range(3)] == [blobs[9], blobs[0], blobs[7]]
+
+        got = pickle.loads(pickle.dumps(arena))
+        assert len(got._data) == got._end
+        assert [bytes(got.get(k)) for k in range(-1, 3)] == [bytes(arena.get(k)) for k in range(-1, 3)]
+
+        got.put(3, blobs[1])
+        assert bytes(got.get(3)) == blobs[1] and bytes(got.get(2)) == blobs[7]
@@ -1,4 +1,5 @@
 import pickle
+import pytest
 import numpy as np
 
 from ReplayTables._utils.SumTree import SumTree
@@ -85,12 +86,99 @@ class TestSumTree:
             tree.all_totals() == tree2.all_totals()
         )
 
+    def test_single_precision(self):
+        tree = SumTree(1000, dims=2, dtype=np.float32)
+        exact = SumTree(1000, dims=2)
+        assert 2 * tree.nbytes == exact.nbytes
+
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            idxs = rng.integers(0, 1000, size=32)
+            vals = rng.uniform(0, 2, size=32)
+            tree.update(0, idxs, vals)
+            exact.update(0, idxs, vals)
+
+        all_idxs = np.arange(1000)
+        assert np.all(tree.get_values(0, all_idxs) == exact.get_values(0, all_idxs).astype(np.float32))
+        assert np.isclose(tree.dim_total(0), exact.dim_total(0), rtol=1e-6)
+
+        got = pickle.loads(pickle.dumps(tree))
+        assert got.dtype == np.float32 and got.nbytes == tree.nbytes
+        assert np.all(got.get_values(0, all_idxs) == tree.get_values(0, all_idxs))
+
+        with pytest.raises(ValueError):
+            SumTree(10, dims=1, dtype=np.int64)
+
+    def test_batched_update_matches_single(self):
+        tree = SumTree(1000, dims=2)
+        single = SumTree(1000, dims=2)
+        rng = np.random.default_rng(0)
+
+        # scattered, dense with repeats, and contiguous batches
+        batches = [
+            lambda: rng.integers(0, 1000, size=8),
+            lambda: rng.integers(100, 300, size=500),
+            lambda: np.arange(rng.integers(0, 900), 1000),
+        ]
+
+        for i in range(60):
+            idxs = batches[i % 3]()
+            vals = rng.integers(0, 100, size=len(idxs)).astype(np.float64)
+
+            tree.update(1, idxs, vals)
+            for idx, v in zip(idxs, vals):
+                single.update_single(1, int(idx), float(v))
+
+            all_idxs = np.arange(1000)
+            assert np.all(tree.get_values(1, all_idxs) == single.get_values(1, all_idxs))
+            assert np.all(tree.all_totals() == single.all_totals())
+
+        # the inner nodes agree too, not only the root
+        v = rng.uniform(0, tree.dim_total(1), size=1000)
+        dims = np.ones(1000, dtype=np.int64)
+        assert np.all(tree.st.query_dims(v, dims) == single.st.query_dims(v, dims))
+
+    def test_can_sample_mixture(self):
+        tree = SumTree(10, dims=3)
+        tree.update(0, np.arange(10), np.arange(10))
+        tree.update(1, np.arange(10), np.ones(10))
+
+        # the last dim is empty, and has no weight
+        p = np.array([0.25, 0.75, 0.])
+        expected = 0.25 * np.arange(10) / 45 + 0.75 / 10
+
+        rng = np.random.default_rng(0)
+        for sample in [tree.sample_mixture, tree.stratified_sample_mixture]:
+            samples = sample(rng, 200_000, p)
+            c = np.bincount(samples, minlength=10) / 200_000
+            assert np.allclose(c, expected, atol=3e-3)
+
+    def test_cannot_sample_empty_mixture(self):
+        tree = SumTree(10, dims=2)
+        tree.update(0, np.arange(10), np.ones(10))
+        rng = np.random.default_rng(0)
+
+        # every dim is empty, so the weights left after dropping empty dims are nan
+        with pytest.raises(AssertionError):
+            SumTree(10, dims=2).sample_mixture(rng, 10, np.full(2, np.nan))
+
+        with pytest.raises(AssertionError):
+            tree.sample_mixture(rng, 10, np.zeros(2))
+
+        # the weight is on a dim with nothing in it
+        with pytest.raises(AssertionError):
+            tree.stratified_sample_mixture(rng, 10, np.array([0., 1.]))
+
 # ----------------
 # -- Benchmarks --
 # ----------------
 class TestBenchmarks:
-    def test_sumtree_update(self, benchmark):
-        tree = SumTree(100_000, dims=1)
+    @pytest.mark.parametrize('dtype', ['float64', 'float32'])
+    def test_sumtree_update(self, benchmark, dtype: str):
+        benchmark.name = dtype
+        benchmark.group = 'sumtree | update'
+
+        tree = SumTree(100_000, dims=1, dtype=dtype)
         rng = np.random.default_rng(0)
         idxs = np.arange(32)
         vals = rng.uniform(0, 2, size=32)
@@ -100,9 +188,28 @@ class TestBenchmarks:
 
         benchmark(_inner, tree, idxs, vals)
 
-    def test_sumtree_sample(self, benchmark):
+    @pytest.mark.parametrize('batch', [256, 4096, 100_000])
+    def test_sumtree_update_batch(self, benchmark, batch: int):
+        benchmark.name = f'batch={batch}'
+        benchmark.group = 'sumtree | batched update'
+
         tree = SumTree(100_000, dims=1)
         rng = np.random.default_rng(0)
+        idxs = rng.permutation(100_000)[:batch]
+        vals = rng.uniform(0, 2, size=batch)
+
+        def _inner(tree: SumTree, idxs, vals):
+            tree.update(0, idxs, vals)
+
+        benchmark(_inner, tree, idxs, vals)
+
+    @pytest.mark.parametrize('dtype', ['float64', 'float32'])
+    def test_sumtree_sample(self, benchmark, dtype: str):
+        benchmark.name = dtype
+        benchmark.group = 'sumtree | sample'
+
+        tree = SumTree(100_000, dims=1, dtype=dtype)
+        rng = np.random.default_rng(0)
 
         idxs = np.arange(10_000)
         vals = rng.uniform(0, 2, size=10_000)
@@ -112,3 +219,17 @@ class TestBenchmarks:
             tree.sample(rng, 32)
 
         benchmark(_inner, tree, rng)
+
+    def test_sumtree_sample_mixture(self, benchmark):
+        tree = SumTree(100_000, dims=2)
+        rng = np.random.default_rng(0)
+
+        idxs = np.arange(10_000)
+        tree.update(0, idxs, rng.uniform(0, 2, size=10_000))
+        tree.update(1, idxs, np.ones(10_000))
+        p = np.array([0.9, 0.1])
+
+        def _inner(tree: SumTree, rng):
+            tree.sample_mixture(rng, 32, p)
+
+        benchmark(_inner, tree, rng)
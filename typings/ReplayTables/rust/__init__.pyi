@@ -1,26 +1,55 @@
 import numpy as np
-from typing import Tuple
-from ReplayTables.interface import EID, IDX, SIDX, XID, IDXs, Item, Items
+from typing import Any, Dict, Tuple
+from ReplayTables.interface import EID, IDX, SIDX, SIDXs, XID, IDXs, Item, Items
+
+API_VERSION: int
 
 class RefCount:
     def add_state(self, eid: EID, xid: XID) -> SIDX: ...
     def load_state(self, xid: XID) -> int: ...
     def has_xid(self, xid: XID) -> bool: ...
     def remove_transition(self, eid: EID) -> None: ...
+    def n_states(self) -> int: ...
+    def nbytes(self) -> int: ...
 
 
 class MetadataStorage:
     def __init__(self, *args): ...
     def get_item_by_idx(self, idx: IDX) -> Item: ...
     def get_items_by_idx(self, idxs: IDXs) -> Items: ...
+    def get_sidxs_into(self, idxs: IDXs, eids: np.ndarray, sidxs: np.ndarray) -> None: ...
     def add_item(self, eid: EID, idx: IDX, xid: XID, n_xid: XID | None) -> Tuple[Item, Item | None]: ...
+    def add_items(self, eids: np.ndarray, idxs: IDXs, xids: np.ndarray, n_xids: np.ndarray) -> Tuple[SIDXs, SIDXs, SIDXs]: ...
     def has_xid(self, xid: XID) -> bool: ...
+    def memory_usage(self) -> Tuple[int, int, int]: ...
+    def free_sidxs(self) -> SIDXs: ...
+    def last_sidx(self) -> SIDX: ...
+    def defragment(self) -> SIDXs: ...
+    def restore(self, eids: np.ndarray, xids: np.ndarray, n_xids: np.ndarray, sidxs: np.ndarray, n_sidxs: np.ndarray, free: SIDXs, last: SIDX) -> None: ...
+    @staticmethod
+    def legacy_state(state: bytes) -> Dict[str, Any]: ...
+    def __getstate__(self): ...
+    def __setstate__(self, state): ...
+
+class StateArena:
+    row_bytes: int
+    capacity: int
+    nbytes: int
+
+    def __init__(self, *args): ...
+    def reserve(self, rows: int) -> None: ...
+    def store(self, sidx: SIDX, row: np.ndarray) -> None: ...
+    def gather(self, sidxs: SIDXs, out: np.ndarray) -> None: ...
+    def gather_pair(self, sidxs: SIDXs, n_sidxs: SIDXs, out: np.ndarray, n_out: np.ndarray) -> None: ...
+    def permute(self, sidxs: SIDXs) -> None: ...
     def __getstate__(self): ...
     def __setstate__(self, state): ...
 
 class SumTree:
     size: int
     dims: int
+    nbytes: int
+    single: bool
 
     def __init__(self, *args): ...
     def update(self, dim: int, idxs: np.ndarray, values: np.ndarray): ...
@@ -32,5 +61,8 @@ class SumTree:
     def total(self, w: np.ndarray) -> float: ...
     def effective_weights(self) -> np.ndarray: ...
     def query(self, v: np.ndarray, w: np.ndarray) -> np.ndarray: ...
+    def query_dims(self, v: np.ndarray, dims: np.ndarray) -> np.ndarray: ...
+    @staticmethod
+    def legacy_state(state: bytes) -> Dict[str, Any]: ...
     def __getstate__(self): ...
     def __setstate__(self, state): ...
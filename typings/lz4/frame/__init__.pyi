@@ -1,5 +1,5 @@
 from typing import Any
-def compress(data: Any) -> Any:
+def compress(data: Any, compression_level: int = ...) -> Any:
     ...
 
 def decompress(buffer: Any) -> Any: